@@ -3,12 +3,17 @@ import logging
 import os
 from dotenv import load_dotenv
 import yaml
+from metrics import track
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for the iAgent; /chat runs an LLM, so it gets much longer than /clear
+CHAT_TIMEOUT = 120
+CLEAR_TIMEOUT = 10
+
 class AgentClient:
     def __init__(self, base_url="http://localhost:5000"):
         self.base_url = base_url
@@ -158,16 +163,19 @@ class AgentClient:
             logger.info(f"Using agent: {agent_id}")
             
             # Send request to the /chat endpoint using the required format
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json={
-                    "message": prompt,
-                    "session_id": self.session_id,
-                    "agent_id": agent_id,
-                    "agent_key": agent_key,
-                    "environment": "mainnet"
-                }
-            )
+            with track("iagent", "chat") as span:
+                response = requests.post(
+                    f"{self.base_url}/chat",
+                    json={
+                        "message": prompt,
+                        "session_id": self.session_id,
+                        "agent_id": agent_id,
+                        "agent_key": agent_key,
+                        "environment": "mainnet"
+                    },
+                    timeout=CHAT_TIMEOUT
+                )
+                span.failed = response.status_code != 200
             
             if response.status_code == 200:
                 result = response.json()
@@ -183,10 +191,13 @@ class AgentClient:
     async def clear_history(self):
         """Clear the chat history"""
         try:
-            response = requests.post(
-                f"{self.base_url}/clear",
-                params={"session_id": self.session_id}
-            )
+            with track("iagent", "clear") as span:
+                response = requests.post(
+                    f"{self.base_url}/clear",
+                    params={"session_id": self.session_id},
+                    timeout=CLEAR_TIMEOUT
+                )
+                span.failed = response.status_code != 200
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Error clearing history: {str(e)}")
@@ -0,0 +1,225 @@
+"""Open-loop load test of the bot's button routes with many simulated users.
+
+Updates arrive at a fixed rate regardless of how fast the bot answers, the way
+real users tap buttons, so the results show where one process saturates.
+
+Usage (from the repository root):
+
+    python -m benchmarks.load
+    python -m benchmarks.load --scenarios view_positions --rate 5 10 20 --duration 30 --users 200
+    python -m benchmarks.load --scenarios mixed --rate 2 --wait-scale 0 --json load_output.json
+    python -m benchmarks.load --scenarios mixed --rate 5 --concurrent-updates 8
+
+Per scenario and rate it reports throughput, handler latency percentiles,
+event-loop lag (how late a 10 ms timer fires while under load) and RSS growth.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import resource
+import sys
+import time
+from types import SimpleNamespace
+
+from benchmarks.run import add_backend_args, import_bot, make_chain_client, patch_bot, percentile
+from benchmarks.stubs import StubBot, StubServers, make_callback_update, make_context
+
+# scenario name -> [(callback data, weight)] dispatched through button_click
+SCENARIOS = {
+    "view_positions": [("view_positions", 1)],
+    "analyze_positions": [("analyze_positions", 1)],
+    "invest": [("invest_amount_1", 1), ("invest_amount_5", 1)],
+    "mixed": [("view_positions", 6), ("analyze_positions", 2), ("invest_amount_1", 1), ("invest_amount_5", 1)],
+}
+
+# How often the lag probe wakes up, seconds
+LAG_PROBE_INTERVAL = 0.01
+
+
+def rss_bytes():
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLagProbe:
+    """Measures how late the event loop runs a periodic timer"""
+
+    def __init__(self, interval=LAG_PROBE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self.peak_rss = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - scheduled))
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+
+
+async def run_load(bot, stub_bot, name, rate, duration, users, drain_timeout, processor=None):
+    routes, weights = zip(*SCENARIOS[name])
+    chat_data = {}
+    latencies = []
+    in_flight = set()
+    peak_in_flight = 0
+    errors_before = stub_bot.stats["errors"]
+    exceptions = 0
+
+    async def handle(chat_id, data):
+        nonlocal exceptions
+        update = make_callback_update(stub_bot, chat_id, data)
+        context = make_context(stub_bot, chat_data=chat_data.setdefault(chat_id, {}))
+        started = time.perf_counter()
+
+        async def dispatch():
+            await bot.button_click(update, context)
+
+        try:
+            if processor:
+                await processor.process_update(update, dispatch())
+            else:
+                await dispatch()
+        except Exception:
+            exceptions += 1
+        latencies.append(time.perf_counter() - started)
+
+    gc.collect()
+    rss_before = rss_bytes()
+    probe = LoopLagProbe().start()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    sent = 0
+    # Arrivals are scheduled against the clock, so a blocked loop shows up as a burst
+    # of late updates rather than a silently lower offered rate
+    while loop.time() - started < duration:
+        chat_id = 10_000 + random.randrange(users)
+        task = asyncio.create_task(handle(chat_id, random.choices(routes, weights)[0]))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        peak_in_flight = max(peak_in_flight, len(in_flight))
+        sent += 1
+        await asyncio.sleep(max(0.0, started + sent / rate - loop.time()))
+    offered_elapsed = loop.time() - started
+
+    if in_flight:
+        await asyncio.wait(set(in_flight), timeout=drain_timeout)
+    elapsed = loop.time() - started
+    unfinished = len(in_flight)
+    for task in list(in_flight):
+        task.cancel()
+    await probe.stop()
+    gc.collect()
+    rss_after = rss_bytes()
+
+    latencies.sort()
+    lag = sorted(probe.samples)
+    return {
+        "scenario": name,
+        "rate": rate,
+        "sent": sent,
+        "completed": len(latencies),
+        "unfinished": unfinished,
+        "errors": stub_bot.stats["errors"] - errors_before + exceptions,
+        "offered_rps": sent / offered_elapsed if offered_elapsed else 0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0,
+        "peak_in_flight": peak_in_flight,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0,
+        "lag_p50_ms": percentile(lag, 0.50) * 1000,
+        "lag_p99_ms": percentile(lag, 0.99) * 1000,
+        "lag_max_ms": lag[-1] * 1000 if lag else 0,
+        "rss_start_mb": rss_before / 2**20,
+        "rss_peak_mb": max(probe.peak_rss, rss_after) / 2**20,
+        "rss_growth_mb": (rss_after - rss_before) / 2**20,
+    }
+
+
+async def main(args):
+    random.seed(args.seed)
+    servers = StubServers(
+        http_latency=args.http_latency / 1000,
+        iagent_latency=args.iagent_latency / 1000,
+    ).start()
+    try:
+        bot = import_bot(servers, args)
+        chain_client = make_chain_client(bot, args)
+        patch_bot(bot, chain_client, servers, args)
+        stub_bot = StubBot(latency=args.telegram_latency / 1000)
+
+        processor = None
+        if args.concurrent_updates:
+            processor = bot.OrderedUpdateProcessor(args.concurrent_updates, bot.update_wallet_key)
+
+        application = SimpleNamespace(bot=stub_bot, bot_data={})
+        await bot.post_init(application)
+        try:
+            results = []
+            for name in args.scenarios:
+                for rate in args.rate:
+                    result = await run_load(
+                        bot, stub_bot, name, rate, args.duration, args.users, args.drain_timeout, processor
+                    )
+                    results.append(result)
+                    _print_result(result)
+        finally:
+            await bot.post_shutdown(application)
+    finally:
+        servers.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return results
+
+
+def _print_result(result):
+    if not getattr(_print_result, "header_printed", False):
+        print(
+            f"{'scenario':<20}{'rate':>6}{'sent':>6}{'done':>6}{'err':>5}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'lag p99':>9}{'lag max':>9}{'rss MB':>8}{'+MB':>7}"
+        )
+        _print_result.header_printed = True
+    print(
+        f"{result['scenario']:<20}{result['rate']:>6g}{result['sent']:>6}{result['completed']:>6}{result['errors']:>5}"
+        f"{result['throughput_rps']:>8.2f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+        f"{result['lag_p99_ms']:>9.1f}{result['lag_max_ms']:>9.1f}{result['rss_peak_mb']:>8.1f}{result['rss_growth_mb']:>7.1f}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--rate", nargs="+", type=float, default=[1.0, 5.0], help="updates per second, one run per value")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of arrivals per run")
+    parser.add_argument("--users", type=int, default=50, help="distinct simulated chats")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for in-flight updates")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrent-updates", type=int, default=0,
+                        help="dispatch through the bot's OrderedUpdateProcessor with this many handler slots")
+    add_backend_args(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    results = asyncio.run(main(parse_args()))
+    sys.exit(1 if any(result["errors"] or result["unfinished"] for result in results) else 0)
@@ -0,0 +1,234 @@
+"""Offline benchmark of the bot's main flows against local stand-ins.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios show_positions start -n 50 -c 8 --chain-latency 40
+    python -m benchmarks.run --wait-scale 0 --json bench_output.json
+    python -m benchmarks.run --record bench.jsonl.gz
+    python -m benchmarks.run --replay mainnet.jsonl.gz --replay-speed 10
+
+Latencies are in milliseconds. `--wait-scale` multiplies the fixed
+confirmation waits inside the tx flows (1 keeps them as in production, 0
+removes them so only the bot's own work and the stubbed I/O are measured).
+
+`--replay` serves chain and rate feed responses from a cassette recorded
+with PERP_CASSETTE_MODE=record (see cassette.py) instead of the fixtures,
+at the recorded latency divided by `--replay-speed`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.stubs import (
+    BENCH_PRIVATE_KEY,
+    FakeAsyncClient,
+    StubBot,
+    StubServers,
+    make_callback_update,
+    make_command_update,
+    make_context,
+)
+
+# scenario name -> (update kind, payload, handler attribute on the bot module)
+SCENARIOS = {
+    "start": ("command", "/start", "start"),
+    "show_positions": ("callback", "view_positions", "button_click"),
+    "analyze_with_iagent": ("callback", "analyze_positions", "button_click"),
+    "execute_delta_neutral_strategy": ("callback", "invest_amount_1", "button_click"),
+    "close_strategy": ("callback", "close_position", "button_click"),
+}
+
+
+class _ScaledAsyncio:
+    """asyncio stand-in for the bot module whose sleep() is scaled"""
+
+    def __init__(self, scale):
+        self._scale = scale
+
+    async def sleep(self, delay, result=None):
+        return await asyncio.sleep(delay * self._scale, result)
+
+    def __getattr__(self, attr):
+        return getattr(asyncio, attr)
+
+
+def import_bot(servers, args):
+    """Point the bot's configuration at the stubs, then import it"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+        "HELIX_DATA_URL": f"{servers.base_url}/helix",
+        "NEPTUNE_BORROW_URL": f"{servers.base_url}/neptune/borrow",
+        "NEPTUNE_LEND_URL": f"{servers.base_url}/neptune/lend",
+        "INJECTIVE_PRIVATE_KEY": BENCH_PRIVATE_KEY,
+        "METRICS_PORT": "0",
+        "STRATEGY_JOURNAL_PATH": os.path.join(tempfile.gettempdir(), f"perp_prophet_bench_journal_{os.getpid()}.json"),
+        "GAS_STATS_PATH": os.path.join(tempfile.gettempdir(), f"perp_prophet_bench_gas_{os.getpid()}.json"),
+        "FUNDING_LEDGER_PATH": os.path.join(tempfile.gettempdir(), f"perp_prophet_bench_funding_{os.getpid()}.json"),
+    })
+    import bot
+    return bot
+
+
+def make_chain_client(bot, args):
+    """Fixture-backed fake client, optionally recorded to or replayed from a cassette"""
+    from cassette import Cassette
+
+    if args.replay:
+        bot.cassette = Cassette("replay", args.replay, speed=args.replay_speed)
+        return bot.cassette.wrap_client(None)
+    fake_client = FakeAsyncClient(latency=args.chain_latency / 1000)
+    if args.record:
+        bot.cassette = Cassette("record", args.record)
+        return bot.cassette.wrap_client(fake_client)
+    return fake_client
+
+
+def patch_bot(bot, fake_client, servers, args):
+    """Swap the bot's chain client, wallet setup and iAgent URL for the stubs"""
+    from pyinjective.core.network import Network
+    from pyinjective.wallet import PrivateKey
+
+    network = Network.mainnet()
+    priv_key = PrivateKey.from_hex(BENCH_PRIVATE_KEY)
+    pub_key = priv_key.to_public_key()
+    address = pub_key.to_address()
+
+    async def setup_client():
+        composer = await fake_client.composer()
+        await fake_client.sync_timeout_height()
+        await fake_client.fetch_account(address.to_acc_bech32())
+        return instrumented, composer, network, priv_key, pub_key, address
+
+    instrumented = bot.InstrumentedClient(fake_client)
+    bot.client = instrumented
+    bot.setup_client = bot.timed("query", "setup_client")(setup_client)
+    bot.agent_client.base_url = servers.base_url
+    bot.asyncio = _ScaledAsyncio(args.wait_scale)
+
+
+async def run_scenario(bot, stub_bot, name, iterations, concurrency):
+    kind, payload, handler_name = SCENARIOS[name]
+    handler = getattr(bot, handler_name)
+    latencies = []
+    errors_before = stub_bot.stats["errors"]
+    pending = iter(range(iterations))
+
+    async def worker(chat_id):
+        chat_data = {}
+        for _ in pending:
+            if kind == "command":
+                update = make_command_update(stub_bot, chat_id, payload)
+            else:
+                update = make_callback_update(stub_bot, chat_id, payload)
+            context = make_context(stub_bot, chat_data=chat_data)
+            started = time.perf_counter()
+            try:
+                await handler(update, context)
+            except Exception:
+                stub_bot.stats["errors"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(10_000 + i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "iterations": len(latencies),
+        "concurrency": concurrency,
+        "errors": stub_bot.stats["errors"] - errors_before,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0,
+    }
+
+
+async def main(args):
+    servers = StubServers(
+        http_latency=args.http_latency / 1000,
+        iagent_latency=args.iagent_latency / 1000,
+    ).start()
+    try:
+        bot = import_bot(servers, args)
+        fake_client = make_chain_client(bot, args)
+        patch_bot(bot, fake_client, servers, args)
+        stub_bot = StubBot(latency=args.telegram_latency / 1000)
+
+        application = SimpleNamespace(bot=stub_bot, bot_data={})
+        await bot.post_init(application)
+        try:
+            results = []
+            for name in args.scenarios:
+                if args.warmup:
+                    await run_scenario(bot, stub_bot, name, args.warmup, 1)
+                calls_before = dict(fake_client.calls)
+                result = await run_scenario(bot, stub_bot, name, args.iterations, args.concurrency)
+                result["chain_calls_per_iteration"] = sum(
+                    count - calls_before.get(call, 0) for call, count in fake_client.calls.items()
+                ) / max(result["iterations"], 1)
+                results.append(result)
+                _print_result(result)
+        finally:
+            await bot.post_shutdown(application)
+    finally:
+        servers.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return results
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _print_result(result):
+    if not getattr(_print_result, "header_printed", False):
+        print(f"{'scenario':<32}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'req/s':>9}{'calls':>7}")
+        _print_result.header_printed = True
+    print(
+        f"{result['scenario']:<32}{result['iterations']:>6}{result['errors']:>5}"
+        f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['max_ms']:>9.1f}"
+        f"{result['throughput_rps']:>9.2f}{result['chain_calls_per_iteration']:>7.1f}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    parser.add_argument("-c", "--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=2, help="untimed iterations per scenario")
+    add_backend_args(parser)
+    return parser.parse_args(argv)
+
+
+def add_backend_args(parser):
+    """Options controlling the stubbed backends, shared with benchmarks.load"""
+    parser.add_argument("--chain-latency", type=float, default=25.0, help="per chain call, ms")
+    parser.add_argument("--http-latency", type=float, default=80.0, help="per rate feed request, ms")
+    parser.add_argument("--iagent-latency", type=float, default=1500.0, help="per iAgent /chat call, ms")
+    parser.add_argument("--telegram-latency", type=float, default=30.0, help="per Bot API call, ms")
+    parser.add_argument("--wait-scale", type=float, default=1.0, help="multiplier for fixed confirmation waits")
+    parser.add_argument("--json", help="also write results to this JSON file")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="PATH", help="record the fixture responses to a cassette")
+    cassette.add_argument("--replay", metavar="PATH", help="answer chain and rate feed calls from a cassette")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="replay timing multiplier, 0 = instant")
+
+
+if __name__ == "__main__":
+    results = asyncio.run(main(parse_args()))
+    sys.exit(1 if any(result["errors"] for result in results) else 0)
@@ -0,0 +1,325 @@
+"""Local stand-ins for mainnet, the rate feeds, iAgent and the Telegram Bot API.
+
+Nothing in here talks to the network: the chain client answers from recorded
+fixtures, the HTTP feeds are served from a local aiohttp server, and Telegram
+objects are bound to a bot whose API methods return immediately.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from aiohttp import web
+from telegram import Bot, CallbackQuery, Chat, Message, Update, User
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Throwaway key used only to sign transactions that the fake client discards
+BENCH_PRIVATE_KEY = "1" * 64
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r") as f:
+        return json.load(f)
+
+
+class FakeAsyncClient:
+    """Drop-in for pyinjective's AsyncClient that answers from chain.json.
+
+    Every call sleeps for `latency` seconds first, so handler timings include
+    a realistic (and configurable) network component.
+    """
+
+    def __init__(self, latency=0.0, fixtures=None):
+        self.latency = latency
+        self.fixtures = fixtures or load_fixture("chain.json")
+        self.timeout_height = 101234567 + 20
+        self.calls = {}
+        self.sequence = 0
+        self.number = 42
+
+    async def _respond(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return json.loads(json.dumps(self.fixtures[name]))
+
+    async def composer(self):
+        from pyinjective.composer import Composer
+        from pyinjective.core.market import DerivativeMarket
+        from pyinjective.core.token import Token
+
+        await self._respond("fetch_latest_block")
+        spec = self.fixtures["fetch_derivative_market"]["market"]
+        usdt = Token(
+            name="Tether", symbol="USDT", denom=spec["quoteDenom"], address="",
+            decimals=6, logo="", updated=0,
+        )
+        market = DerivativeMarket(
+            id=spec["marketId"], status="active", ticker=spec["ticker"],
+            oracle_base=spec["oracleBase"], oracle_quote=spec["oracleQuote"], oracle_type=spec["oracleType"],
+            oracle_scale_factor=spec["oracleScaleFactor"],
+            initial_margin_ratio=Decimal(spec["initialMarginRatio"]),
+            maintenance_margin_ratio=Decimal(spec["maintenanceMarginRatio"]),
+            quote_token=usdt,
+            maker_fee_rate=Decimal(spec["makerFeeRate"]), taker_fee_rate=Decimal(spec["takerFeeRate"]),
+            service_provider_fee=Decimal("0.4"),
+            min_price_tick_size=Decimal(spec["minPriceTickSize"]),
+            min_quantity_tick_size=Decimal(spec["minQuantityTickSize"]),
+            min_notional=Decimal(spec["minNotional"]),
+        )
+        return Composer(network="mainnet", derivative_markets={market.id: market}, tokens={usdt.symbol: usdt})
+
+    async def sync_timeout_height(self):
+        await self._respond("fetch_latest_block")
+
+    async def fetch_account(self, address):
+        await self._respond("fetch_latest_block")
+        return None
+
+    def get_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    def get_number(self):
+        return self.number
+
+    async def fetch_smart_contract_state(self, address, query_data):
+        query = next(iter(json.loads(query_data)))
+        self.calls[query] = self.calls.get(query, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = json.dumps(self.fixtures["contract_state"][query]).encode()
+        return {"data": base64.b64encode(data).decode()}
+
+    async def fetch_chain_subaccount_position_in_market(self, subaccount_id, market_id):
+        return await self._respond("fetch_chain_subaccount_position_in_market")
+
+    async def fetch_funding_rates(self, market_id, pagination=None):
+        return await self._respond("fetch_funding_rates")
+
+    async def fetch_funding_payments(self, market_ids=None, subaccount_id=None, pagination=None):
+        return await self._respond("fetch_funding_payments")
+
+    async def fetch_chain_derivative_markets(self, status=None, market_ids=None, with_mid_price_and_tob=False):
+        return await self._respond("fetch_chain_derivative_markets")
+
+    async def fetch_derivative_market(self, market_id):
+        return await self._respond("fetch_derivative_market")
+
+    async def fetch_derivative_mid_price_and_tob(self, market_id):
+        return await self._respond("fetch_derivative_mid_price_and_tob")
+
+    async def fetch_derivative_orderbooks_v2(self, market_ids):
+        return await self._respond("fetch_derivative_orderbooks_v2")
+
+    async def listen_derivative_orderbook_updates(self, market_ids, callback, on_end_callback=None,
+                                                  on_status_callback=None):
+        # The recorded book never changes; keep the stream open until cancelled
+        await asyncio.Event().wait()
+
+    async def listen_oracle_prices_updates(self, callback, on_end_callback=None, on_status_callback=None,
+                                           base_symbol=None, quote_symbol=None, oracle_type=None):
+        # Prices come from the recorded Neptune oracle query; keep the stream open until cancelled
+        await asyncio.Event().wait()
+
+    async def fetch_tx(self, hash):
+        return await self._respond("fetch_tx")
+
+    async def fetch_latest_block(self):
+        return await self._respond("fetch_latest_block")
+
+    async def simulate(self, tx_bytes):
+        return await self._respond("simulate")
+
+    async def broadcast_tx_sync_mode(self, tx_bytes):
+        return await self._respond("broadcast_tx_sync_mode")
+
+
+class StubServers:
+    """Rate feeds and a fake iAgent `/chat` endpoint served from a background thread.
+
+    The bot reads the rate feeds with blocking urllib/requests calls on its own
+    event loop, so the servers must run on a separate loop to avoid deadlock.
+    """
+
+    def __init__(self, http_latency=0.0, iagent_latency=0.0, host="127.0.0.1"):
+        self.http_latency = http_latency
+        self.iagent_latency = iagent_latency
+        self.host = host
+        self.port = None
+        self.requests = {}
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name="bench-stub-servers", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout=10):
+            raise RuntimeError("Stub servers failed to start")
+        return self
+
+    def stop(self):
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(timeout=10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start_app())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _start_app(self):
+        payloads = {
+            "/helix": json.dumps(load_fixture("helix_data.json")),
+            "/neptune/borrow": json.dumps(load_fixture("neptune_borrow.json")),
+            "/neptune/lend": json.dumps(load_fixture("neptune_lend.json")),
+        }
+
+        def feed(path):
+            async def handler(request):
+                self.requests[path] = self.requests.get(path, 0) + 1
+                if self.http_latency:
+                    await asyncio.sleep(self.http_latency)
+                return web.Response(text=payloads[path], content_type="application/json")
+            return handler
+
+        async def chat(request):
+            self.requests["/chat"] = self.requests.get("/chat", 0) + 1
+            body = await request.json()
+            if self.iagent_latency:
+                await asyncio.sleep(self.iagent_latency)
+            return web.json_response({
+                "response": f"Stub analysis for session {body.get('session_id')}: funding spread positive, hedge in band.",
+                "session_id": body.get("session_id"),
+            })
+
+        async def clear(request):
+            return web.json_response({"status": "cleared"})
+
+        app = web.Application(client_max_size=4 * 1024 * 1024)
+        for path in payloads:
+            app.router.add_get(path, feed(path))
+        app.router.add_post("/chat", chat)
+        app.router.add_post("/clear", clear)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+
+class StubBot(Bot):
+    """Bot whose API calls return synthetic messages instead of hitting Telegram"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(token="123456:BENCHMARK")
+        # Bot objects are frozen after __init__; counters are mutated in place below
+        with self._unfrozen():
+            self.latency = latency
+            self.stats = {"sent": 0, "edited": 0, "errors": 0}
+            self._message_ids = itertools.count(1000)
+
+    async def _fake_message(self, chat_id, text, message_id=None):
+        if text.startswith("❌") or text.startswith("Error"):
+            self.stats["errors"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = Message(
+            message_id=message_id or next(self._message_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=chat_id, type=Chat.PRIVATE),
+            text=text,
+        )
+        message.set_bot(self)
+        return message
+
+    async def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        self.stats["sent"] += 1
+        return await self._fake_message(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        self.stats["edited"] += 1
+        return await self._fake_message(chat_id, text, message_id)
+
+    async def delete_message(self, chat_id, message_id, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+
+_update_ids = itertools.count(1)
+
+
+def make_user(user_id):
+    return User(id=user_id, first_name=f"bench{user_id}", is_bot=False)
+
+
+def make_command_update(bot, chat_id, text):
+    """Synthesize an Update carrying a command message such as `/start`"""
+    user = make_user(chat_id)
+    message = Message(
+        message_id=next(_update_ids),
+        date=datetime.now(timezone.utc),
+        chat=Chat(id=chat_id, type=Chat.PRIVATE),
+        from_user=user,
+        text=text,
+    )
+    update = Update(update_id=next(_update_ids), message=message)
+    update.set_bot(bot)
+    message.set_bot(bot)
+    return update
+
+
+def make_callback_update(bot, chat_id, data):
+    """Synthesize an Update carrying an inline keyboard CallbackQuery with `data`"""
+    user = make_user(chat_id)
+    message = Message(
+        message_id=next(_update_ids),
+        date=datetime.now(timezone.utc),
+        chat=Chat(id=chat_id, type=Chat.PRIVATE),
+        from_user=user,
+        text="menu",
+    )
+    query = CallbackQuery(
+        id=str(next(_update_ids)),
+        from_user=user,
+        chat_instance=str(chat_id),
+        message=message,
+        data=data,
+    )
+    update = Update(update_id=next(_update_ids), callback_query=query)
+    for obj in (update, query, message):
+        obj.set_bot(bot)
+    return update
+
+
+def make_context(bot, chat_data=None, bot_data=None):
+    """Minimal stand-in for CallbackContext exposing what the handlers use"""
+    return SimpleNamespace(
+        args=None,
+        bot=bot,
+        bot_data=bot_data if bot_data is not None else {},
+        chat_data=chat_data if chat_data is not None else {},
+        user_data={},
+        error=None,
+    )
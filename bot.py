@@ -1,9 +1,10 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import (
     Application, 
     CommandHandler, 
     CallbackQueryHandler, 
     ContextTypes,
+    TypeHandler,
     filters
 )
 import urllib.request
@@ -24,29 +25,57 @@ from bech32 import bech32_decode, convertbits
 import base64
 import requests
 from agent_client import AgentClient
+from market_specs import MarketSpecCache, OrderValidationError
+from orderbook import OrderBookManager
+from metrics import InstrumentedClient, format_perf_report, metrics, start_metrics_server, timed, track
+from cassette import Cassette
+from webhook import serve_webhook
+from dispatcher import KeyedLocks, OrderedUpdateProcessor
+from outbox import MessageOutbox
+from prefetch import Prefetcher
+from journal import StepJournal, tx_hash_of
+from gas import GasModel, OUT_OF_GAS_CODE, wait_for_tx
+from funding_ledger import FundingLedger
+from logs import log_payload, new_request_id, setup_logging, with_tx_id
+from loop_monitor import LoopWatchdog
+from routing import EndpointPool, RoutedClient
+from risk import RiskEngine, health_factor as local_health_factor, parse_position
+from prices import OraclePriceCache
+from rebalancer import Rebalancer, plan_summary
+import report
 from decimal import Decimal
-from time import sleep
+import time
 from pyinjective.constant import GAS_PRICE
 from pyinjective.transaction import Transaction
 from pyinjective.wallet import PrivateKey
 import uuid
+import html
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Set up logging: records are queued and written as JSON (or LOG_FORMAT=text) by a background thread
+log_listener = setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    fmt=os.getenv('LOG_FORMAT', 'json')
 )
 logger = logging.getLogger(__name__)
 
 # Set event loop policy
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
+# Record or replay chain and rate feed responses when PERP_CASSETTE_MODE is set
+cassette = Cassette.from_env()
+
+# Extra chain endpoints read queries are routed across, besides the mainnet load balancer:
+# comma-separated `chain_grpc_host:port[|exchange_grpc_host:port]`. Ignored while recording or
+# replaying a cassette, which expects a single ordered stream of responses
+INJECTIVE_GRPC_ENDPOINTS = os.getenv('INJECTIVE_GRPC_ENDPOINTS', '') if not cassette.mode else ''
+
 # Initialize network for positions
 network = Network.mainnet()
-client = AsyncClient(network=network)  # Add back for positions
+endpoint_pool = EndpointPool.from_env(INJECTIVE_GRPC_ENDPOINTS, cassette.wrap_client)
+client = InstrumentedClient(RoutedClient(endpoint_pool.primary.client, endpoint_pool))  # Add back for positions
 
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
@@ -72,6 +101,96 @@ INJ_USDT_PERP_MARKET_ID = "0x9b9980167ecc3645ff1a5517886652d94a0825e54a77d2057cb
 # iAgent configuration
 IAGENT_URL = "http://localhost:5000"  # Default port for iAgent docker
 
+# Telegram user IDs allowed to use admin commands such as /perf
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Prometheus metrics endpoint (set METRICS_PORT=0 to disable)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+# Webhook mode is used instead of polling when WEBHOOK_URL is set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_SET = os.getenv('WEBHOOK_SET', '1') == '1'  # Only one replica needs to register the URL
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Number of updates handled at once (1 keeps updates strictly sequential). Above 1,
+# different chats run concurrently while each chat, and every update that signs with
+# the bot wallet, stays in arrival order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '256'))
+
+# Event-loop watchdog: lag is sampled every LOOP_LAG_INTERVAL seconds, and the stack of
+# whatever blocks the loop for more than LOOP_BLOCK_THRESHOLD seconds is logged (0 disables)
+LOOP_LAG_INTERVAL = 0.1
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.25'))
+
+# Seconds Neptune oracle prices are shared by every handler; with ORACLE_PRICE_STREAM=1 the INJ
+# price between queries follows the exchange oracle stream instead
+ORACLE_PRICE_TTL = 5
+ORACLE_PRICE_STREAM = os.getenv('ORACLE_PRICE_STREAM', '0') == '1'
+
+# Background rebalancing of the bot wallet's hedge ratio and health factor (see rebalancer.py)
+AUTO_REBALANCE = os.getenv('AUTO_REBALANCE', '0') == '1'
+
+# Seconds a loaded part of the position snapshot is reused by the expandable report sections
+POSITION_SNAPSHOT_TTL = 60
+
+# Parts that change only through governance, kept for their own TTL even across a refresh
+LONG_LIVED_PARTS = {'collateral_params': 3600}
+
+# Snapshot parts behind each report view; "summary" is the minimal set rendered on every refresh
+REPORT_SECTION_PARTS = {
+    'summary': ('base', 'collateral_params'),
+    'funding': ('base', 'cumulative_funding', 'funding_rate', 'funding_payments'),
+    'liquidation': ('base', 'cumulative_funding', 'collateral_params'),
+    'yield': ('base', 'cumulative_funding', 'funding_rate', 'borrow_rate'),
+    'stress': ('base', 'cumulative_funding', 'collateral_params', 'funding_rate', 'borrow_rate'),
+}
+REPORT_SECTION_PREFIX = "report_section:"
+
+# Seconds the position view waits for its chain queries. A part that misses the deadline is
+# rendered from its previous value, marked with its age; only a part never loaded before fails the view
+POSITION_QUERY_DEADLINE = float(os.getenv('POSITION_QUERY_DEADLINE', '6'))
+SNAPSHOT_PART_LABELS = {
+    'base': 'Balances and position',
+    'cumulative_funding': 'Cumulative funding',
+    'funding_rate': 'Funding rate',
+    'funding_payments': 'Funding payments',
+    'collateral_params': 'Collateral parameters',
+    'borrow_rate': 'Borrow rate',
+}
+
+# Seconds allowed for a rate feed HTTP request
+FEED_TIMEOUT = 10
+
+# Background loads started when the menu is shown, in anticipation of the next click:
+# at most PREFETCH_MAX_IN_FLIGHT at once, each cancelled if not claimed within PREFETCH_TTL seconds
+PREFETCH_MAX_IN_FLIGHT = int(os.getenv('PREFETCH_MAX_IN_FLIGHT', '8'))
+PREFETCH_TTL = 30
+
+# Amounts offered on the amount-selection screen, and how long their background quotes
+# may be used by execution instead of re-querying collateral and prices
+INVEST_AMOUNTS = (1, 5)
+QUOTE_TTL = 20
+
+# Seconds journaled borrow/short sizes stay valid when a failed execution is resumed;
+# older ones are re-planned from fresh collateral and prices
+JOURNAL_PLAN_TTL = 60
+
+# Share of the collateral value borrowed as USDT margin for the short
+BORROW_RATIO = 0.43
+
+# Report digests remembered per chat to skip edits that would not change the message
+MAX_RENDERED_DIGESTS = 20
+
+# Callback data prefixes and commands that send transactions from the bot wallet
+WALLET_CALLBACK_PREFIXES = ("invest_amount_", "close_position")
+WALLET_COMMANDS = ("/invest", "/close")
+
 # Add new constants for close commands
 CLOSE_COMMANDS = {
     'a': '/close_a',
@@ -84,7 +203,12 @@ NEPTUNE_ORACLE_ADDRESS = "inj1u6cclz0qh5tep9m2qayry9k97dm46pnlqf8nre"
 INJ_MARKET_ID = "0x9b9980167ecc3645ff1a5517886652d94a0825e54a77d2057cbbe3ebee015963"
 FEE_RECIPIENT = "inj1xwfmk0rxf5nw2exvc42u2utgntuypx3k3gdl90"
 MIN_NOTIONAL_SMALLEST_UNITS = 1000000  # 1,000,000 in USDT's smallest units
-GAS_BUFFER = 50000  # Buffer for gas fee computation
+# Rough gas per message when it has not been simulated yet in this process
+DEFAULT_GAS_ESTIMATES = {
+    'deposit_collateral': 250000,
+    'borrow': 400000,
+    'derivative_market_order': 200000,
+}
 
 def get_subaccount_id(address, subaccount_index=0):
     """Convert an Injective address to a subaccount ID"""
@@ -102,6 +226,39 @@ def get_subaccount_id(address, subaccount_index=0):
 # Initialize agent client
 agent_client = AgentClient()
 
+# Cached tick/lot/notional specs for the derivative markets we trade
+market_specs = MarketSpecCache()
+
+# Locally maintained L2 order books, kept current from the indexer stream
+order_books = OrderBookManager()
+outbox = MessageOutbox()
+
+# Speculative loads of the position snapshot started from the menu
+prefetcher = Prefetcher(PREFETCH_MAX_IN_FLIGHT, PREFETCH_TTL)
+
+# Completed steps of execute and close runs, so a retry resumes where a failure stopped
+journal = StepJournal.from_env()
+
+# Gas limits learned per message type from simulated versus on-chain gas
+gas_model = GasModel.from_env()
+
+# Every funding payment of the bot's subaccount, with running and daily totals
+funding_ledger = FundingLedger.from_env()
+
+# Neptune oracle INJ/USDT prices, shared by every handler within ORACLE_PRICE_TTL
+oracle_prices = OraclePriceCache(NEPTUNE_ORACLE_ADDRESS, ORACLE_PRICE_TTL)
+
+# Health factor, liquidation prices and hedge ratio recomputed on every oracle price tick
+risk_engine = RiskEngine()
+if ORACLE_PRICE_STREAM:
+    risk_engine.price_listeners.append(oracle_prices.on_stream_price)
+
+# Event-loop lag monitor and blocking-call detector
+loop_watchdog = LoopWatchdog(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD)
+
+# Wallet lock shared by the update processor and background rebalances
+wallet_locks = KeyedLocks()
+
 def get_server_url() -> str:
     """Get the server URL from file or environment"""
     try:
@@ -127,9 +284,14 @@ def create_transaction_url(transactions: list, user_id: str) -> str:
     encoded_data = quote(json.dumps(data))
     return f"{base_url}/transaction?data={encoded_data}"
 
+def fetch_feed(url):
+    """Read a rate feed body, through the cassette when recording or replaying"""
+    return cassette.http_get(url, lambda: urllib.request.urlopen(url, timeout=FEED_TIMEOUT).read().decode("utf-8"))
+
+@timed("query")
 def get_helix_rates():
     """Convert the list of opportunities to a dictionary with token as key"""
-    data = urllib.request.urlopen(HELX_DATA).read().decode("utf-8").replace("'", '"')
+    data = fetch_feed(HELX_DATA).replace("'", '"')
     loaded_data = json.loads(data)
     rates = {}
     
@@ -143,10 +305,11 @@ def get_helix_rates():
             }
     return rates
 
+@timed("query")
 def get_neptune_borrow_rates():
     try:
         # Fetch data from Neptune API
-        response = urllib.request.urlopen(NEPTUNE_BORROW).read()
+        response = fetch_feed(NEPTUNE_BORROW)
         data = json.loads(response)
         
         # Initialize dictionary for results
@@ -170,13 +333,14 @@ def get_neptune_borrow_rates():
         
         return rates
     except Exception as e:
-        print(f"Error fetching Neptune borrow rates: {e}")
+        logger.error("Error fetching Neptune borrow rates: %s", e)
         return {}
 
+@timed("query")
 def get_neptune_lend_rates():
     try:
         # Fetch data from Neptune API
-        response = urllib.request.urlopen(NEPTUNE_LEND).read()
+        response = fetch_feed(NEPTUNE_LEND)
         data = json.loads(response)
         
         # Initialize dictionary for results
@@ -200,9 +364,10 @@ def get_neptune_lend_rates():
         
         return rates
     except Exception as e:
-        print(f"Error fetching Neptune lending rates: {e}")
+        logger.error("Error fetching Neptune lending rates: %s", e)
         return {}
 
+@timed("handler")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
     user_id = update.effective_user.id
@@ -273,12 +438,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     reply_markup = InlineKeyboardMarkup(keyboard)
 
+    # The next click is almost always View Positions or Execute Strategy, so start
+    # loading what they need while the menu is being sent
+    if os.getenv("INJECTIVE_PRIVATE_KEY") and update.effective_chat:
+        prefetcher.start(update.effective_chat.id, lambda: prefetch_menu_data(context))
+
     if update.callback_query:
         await update.callback_query.edit_message_text(message, reply_markup=reply_markup)
     else:
         await update.message.reply_text(message, reply_markup=reply_markup)
 
+async def prefetch_menu_data(context):
+    """Warm the summary snapshot (position and oracle prices) and the perp market spec"""
+    await asyncio.gather(
+        load_position_snapshot(context, REPORT_SECTION_PARTS['summary'], refresh=True),
+        market_specs.get(client, INJ_PERP_MARKET_ID),
+    )
 
+
+@timed("query")
 async def get_position_info(client_tuple):
     """Get current position information for the Delta Neutral Strategy"""
     try:
@@ -299,16 +477,7 @@ async def get_position_info(client_tuple):
         )
         
         # Get current prices
-        price_query = json.dumps({
-            "get_prices": {
-                "assets": [
-                    {"native_token": {"denom": "inj"}},
-                    {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}}
-                ]
-            }
-        })
-        prices_data = await query_prices(client, NEPTUNE_ORACLE_ADDRESS, price_query)
-        inj_price, usdt_price = await extract_prices(prices_data)
+        inj_price, usdt_price = await oracle_prices.get(client)
         
         # Extract position details
         debt_amount = 0
@@ -351,20 +520,196 @@ async def get_position_info(client_tuple):
         logger.error(f"Error getting position info: {str(e)}")
         return None
 
-async def query_prices(client, contract_address, query_data):
-    """Query prices from Neptune Oracle"""
+async def edit_report(context, message, text, **kwargs):
+    """Edit `message` through the outbox unless it already shows exactly this content"""
+    rendered = context.chat_data.setdefault('rendered_digests', {})
+    digest = report.digest(text, kwargs.get('reply_markup'))
+    if rendered.get(message.message_id) == digest:
+        metrics.inc("report_edits_skipped_total")
+        return message
+    result = await outbox.edit(message, text, **kwargs)
+    rendered[message.message_id] = digest
+    while len(rendered) > MAX_RENDERED_DIGESTS:
+        rendered.pop(next(iter(rendered)))
+    return result
+
+async def load_position_snapshot(context, parts, refresh=False):
+    """Return the report inputs for `parts`, reusing parts cached in chat_data within POSITION_SNAPSHOT_TTL.
+
+    Parts are reloaded under a shared POSITION_QUERY_DEADLINE. One that misses it (or fails)
+    keeps its previous value and stays in the snapshot's 'stale' set until it reloads.
+    """
+    snapshot = context.chat_data.get('position_snapshot')
+    if snapshot is None:
+        snapshot = context.chat_data['position_snapshot'] = {'loaded_at': {}, 'values': {}, 'stale': set(), 'refreshed_at': float('-inf')}
+    now = time.monotonic()
+    if refresh:
+        # Reload everything, but keep the values as a fallback for parts that time out
+        snapshot['refreshed_at'] = now
+    def due(part):
+        loaded_at = snapshot['loaded_at'].get(part, float('-inf'))
+        if part in LONG_LIVED_PARTS:
+            return now - loaded_at > LONG_LIVED_PARTS[part]
+        return loaded_at < max(snapshot['refreshed_at'], now - POSITION_SNAPSHOT_TTL)
+
+    missing = [part for part in parts if due(part)]
+    metrics.record_cache("position_snapshot", not missing)
+    if not missing:
+        return snapshot['values']
+
+    deadline = now + POSITION_QUERY_DEADLINE
+    setup = asyncio.ensure_future(setup_client())
+
+    async def account():
+        # Shared by every part, so setup_client runs once and counts against each part's deadline
+        client, _, _, _, _, address = await asyncio.shield(setup)
+        return client, address.get_subaccount_id(index=0), address.to_acc_bech32()
+
+    async def load_base():
+        client, subaccount_id, user_address = await account()
+        # Query Neptune user accounts and prices, and the perp position; the health factor
+        # is computed locally by the risk engine
+        user_query = f'{{"get_user_accounts": {{"addr": "{user_address}"}}}}'
+        decoded_data, (inj_price, usdt_price), position_data = await asyncio.gather(
+            query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query),
+            oracle_prices.get(client),
+            query_derivative_position(client, INJ_PERP_MARKET_ID, subaccount_id),
+        )
+        return {
+            'inj_collateral': await extract_inj_collateral(decoded_data),
+            'usdt_debt': await extract_usdt_debt(decoded_data),
+            'inj_price': inj_price,
+            'usdt_price': usdt_price,
+            'position_data': position_data,
+        }
+
+    async def load_cumulative_funding():
+        client, subaccount_id, _ = await account()
+        cumulative_funding, _ = await query_derivative_market_data(client, INJ_PERP_MARKET_ID)
+        return {'cumulative_funding': cumulative_funding}
+
+    async def load_funding_rate():
+        client, subaccount_id, _ = await account()
+        return {'funding_rate': await query_funding_rate(client, INJ_PERP_MARKET_ID)}
+
+    async def load_funding_payments():
+        client, subaccount_id, _ = await account()
+        return {'funding_payments': await query_funding_payments(client, [INJ_PERP_MARKET_ID], subaccount_id)}
+
+    async def load_collateral_params():
+        client, subaccount_id, _ = await account()
+        inj_liquidation_ltv, _ = await query_collateral_params(client, NEPTUNE_MARKET_CONTRACT)
+        return {'inj_liquidation_ltv': inj_liquidation_ltv}
+
+    async def load_borrow_rate():
+        client, subaccount_id, _ = await account()
+        return {'usdt_borrow_rate': await query_borrow_rate(client, NEPTUNE_INTEREST_MODEL_ADDRESS)}
+
+    loaders = {
+        'base': load_base,
+        'cumulative_funding': load_cumulative_funding,
+        'funding_rate': load_funding_rate,
+        'funding_payments': load_funding_payments,
+        'collateral_params': load_collateral_params,
+        'borrow_rate': load_borrow_rate,
+    }
+    async def load(part):
+        return await asyncio.wait_for(loaders[part](), timeout=max(0.0, deadline - time.monotonic()))
+
     try:
-        response = await client.fetch_smart_contract_state(
-            address=contract_address,
-            query_data=query_data
+        results = await asyncio.gather(*(load(part) for part in missing), return_exceptions=True)
+    finally:
+        setup.cancel()
+    for part, result in zip(missing, results):
+        if not isinstance(result, Exception):
+            snapshot['values'].update(result)
+            snapshot['loaded_at'][part] = now
+            snapshot['stale'].discard(part)
+            continue
+        if part not in snapshot['loaded_at']:
+            # Nothing to fall back on
+            if isinstance(result, asyncio.TimeoutError):
+                raise asyncio.TimeoutError(f"{SNAPSHOT_PART_LABELS[part]} did not load within {POSITION_QUERY_DEADLINE:g}s")
+            raise result
+        metrics.inc("position_part_stale_total", part=part)
+        logger.warning("Position part %s unavailable, using cached value: %r", part, result)
+        snapshot['stale'].add(part)
+
+    values = snapshot['values']
+    if 'inj_collateral' in values:
+        risk_engine.update(
+            inj_collateral=values['inj_collateral'], usdt_debt=values['usdt_debt'],
+            liquidation_ltv=values.get('inj_liquidation_ltv'),
+            position_data=values['position_data'], has_position=bool(values['position_data']),
+            cumulative_funding=values.get('cumulative_funding'),
+            inj_price=values['inj_price'], usdt_price=values['usdt_price'],
         )
-        return json.loads(base64.b64decode(response["data"]))
-    except Exception as e:
-        logger.error(f"Error querying prices: {str(e)}")
-        return None
+    return values
 
+def position_report_keyboard(expanded):
+    """Section toggles followed by the usual position actions"""
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{'▾' if key in expanded else '▸'} {label}",
+            callback_data=f"{REPORT_SECTION_PREFIX}{key}"
+        )]
+        for key, (label, _) in report.EXPANDABLE_SECTIONS.items()
+    ]
+    keyboard += [
+        [InlineKeyboardButton("🔄 Refresh", callback_data="view_positions")],
+        [InlineKeyboardButton("Close Position", callback_data="close_position")],
+        [InlineKeyboardButton("Analyze with AI", callback_data="analyze_positions")],
+        [InlineKeyboardButton("Back to Menu", callback_data="back_to_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@timed("handler")
 async def show_positions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show current positions in the Delta Neutral Strategy."""
+    # A fresh view starts collapsed, so only the summary's queries run
+    context.chat_data['expanded_sections'] = set()
+    # Right after the menu the summary was usually prefetched; otherwise reload it
+    prefetched = await prefetcher.claim(update.effective_chat.id)
+    await render_position_report(update, context, refresh=not prefetched)
+
+@timed("handler")
+async def toggle_report_section(update: Update, context: ContextTypes.DEFAULT_TYPE, section):
+    """Expand or collapse one section of the positions report"""
+    if section not in report.EXPANDABLE_SECTIONS:
+        await update.callback_query.edit_message_text(f"Unsupported button: {update.callback_query.data}")
+        return
+    expanded = context.chat_data.setdefault('expanded_sections', set())
+    expanded.symmetric_difference_update({section})
+    await render_position_report(update, context, refresh=False)
+
+@timed("render", "show_positions")
+def render_report_chunks(context, values, expanded, parts):
+    """Message chunks of the report with the `expanded` sections, from snapshot `values`"""
+    sections = list(report.SUMMARY_SECTIONS)
+    sections += [render for key, (_, render) in report.EXPANDABLE_SECTIONS.items() if key in expanded]
+    # Prices and health factor come from the risk engine, current as of the last oracle tick;
+    # the local health factor is normalized so that liquidation is at 1
+    live = risk_engine.current() or {}
+    metrics_values = report.position_metrics(
+        live.get('inj_price', values['inj_price']), live.get('usdt_price', values['usdt_price']),
+        values['inj_collateral'], values['usdt_debt'],
+        live.get('health_factor') or 0, 1.0, values['position_data'],
+        inj_liquidation_ltv=values.get('inj_liquidation_ltv'),
+        cumulative_funding=values.get('cumulative_funding'),
+        usdt_borrow_rate=values.get('usdt_borrow_rate'),
+        funding_rate=values.get('funding_rate'),
+        funding_payments=values.get('funding_payments'),
+    )
+    snapshot = context.chat_data['position_snapshot']
+    now = time.monotonic()
+    metrics_values['stale'] = [
+        (SNAPSHOT_PART_LABELS[part], now - snapshot['loaded_at'][part])
+        for part in sorted(snapshot['stale'] & parts)
+    ]
+    return report.chunk_sections(report.render_sections(metrics_values, sections))
+
+async def render_position_report(update, context, refresh):
+    """Render the summary plus any expanded sections from the (cached) position snapshot"""
     # Check if private key is configured
     if not os.getenv("INJECTIVE_PRIVATE_KEY"):
         message = (
@@ -377,351 +722,53 @@ async def show_positions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        # Initialize the client
-        client = await setup_client()
-        
-        # Get user address and subaccount ID
-        _, _, _, _, _, address = client
-        user_address = address.to_acc_bech32()
-        subaccount_id = address.get_subaccount_id(index=0)
-        
-        # Query Neptune user accounts
-        user_query = f'{{"get_user_accounts": {{"addr": "{user_address}"}}}}'
-        decoded_data = await query_contract_state(client[0], NEPTUNE_MARKET_CONTRACT, user_query)
-        
-        # Query prices
-        price_query = '{"get_prices": {"assets": [{"native_token": {"denom": "inj"}}, {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}}]}}'
-        prices_data = await query_contract_state(client[0], NEPTUNE_ORACLE_ADDRESS, price_query)
-        
-        # Query account health
-        health_query = f'{{"get_account_health": {{"addr": "{user_address}", "account_index": 0}}}}'
-        health_data = await query_contract_state(client[0], NEPTUNE_QUERIER_ADDRESS, health_query)
-        
-        # Query derivative position
-        position_data = await query_derivative_position(client[0], INJ_PERP_MARKET_ID, subaccount_id)
-        
-        # Query Neptune interest model for borrow rate
-        usdt_borrow_rate = await query_borrow_rate(client[0], NEPTUNE_INTEREST_MODEL_ADDRESS)
-        
-        # Query funding rate
-        funding_rate = await query_funding_rate(client[0], INJ_PERP_MARKET_ID)
-        
-        # Query funding payments
-        total_funding, funding_details = await query_funding_payments(client[0], [INJ_PERP_MARKET_ID], subaccount_id)
-        
-        # Query derivative market data
-        cumulative_funding, market_mark_price = await query_derivative_market_data(client[0], INJ_PERP_MARKET_ID)
-        
-        # Query collateral parameters
-        inj_liquidation_ltv, inj_allowable_ltv = await query_collateral_params(client[0], NEPTUNE_MARKET_CONTRACT)
-        
-        # Extract data from responses
-        inj_collateral = await extract_inj_collateral(decoded_data)
-        usdt_debt = await extract_usdt_debt(decoded_data)
-        inj_price, usdt_price = await extract_prices(prices_data)
-        health_factor, liquidation_threshold = await extract_account_health(health_data)
-        
-        # Calculate values
-        inj_collateral_value = inj_collateral * inj_price
-        usdt_debt_value = usdt_debt * usdt_price
-        
-        # Prepare the message
-        message = (
-            "<b>=== CURRENT MARKET PRICES ===</b>\n"
-            f"INJ Price: ${inj_price:.2f}\n"
-            f"USDT Price: ${usdt_price:.2f}\n\n"
-            
-            "<b>=== NEPTUNE FINANCE POSITION ===</b>\n"
-            f"INJ Collateral: {inj_collateral} INJ (${inj_collateral_value:.2f})\n"
-            f"USDT Debt: {usdt_debt} USDT (${usdt_debt_value:.2f})\n"
-            f"Health Factor: {health_factor:.4f}\n"
-            f"Liquidation Threshold: {liquidation_threshold:.4f}\n"
-        )
-        
-        # Add liquidation price information
-        if inj_liquidation_ltv is not None:
-            neptune_liquidation_price = usdt_debt_value / (inj_collateral * inj_liquidation_ltv)
-            price_drop_percentage = ((inj_price - neptune_liquidation_price) / inj_price) * 100
-            message += (
-                f"Liquidation LTV: {inj_liquidation_ltv:.2f}\n"
-                f"Neptune Liquidation Price: ${neptune_liquidation_price:.2f} (current price: ${inj_price:.2f})\n"
-                f"Price Drop to Neptune Liquidation: {price_drop_percentage:.2f}%\n"
-            )
-            
-            # Add safety status
-            if price_drop_percentage > 40:
-                message += "✅ Very safe - large buffer to liquidation\n"
-            elif price_drop_percentage > 25:
-                message += "✅ Safe - good buffer to liquidation\n"
-            elif price_drop_percentage > 15:
-                message += "⚠️ Moderate buffer to liquidation\n"
-            else:
-                message += "🚨 Small buffer to liquidation - consider reducing debt or adding collateral\n"
-        
-        # Add health factor status
-        if health_factor > 0:
-            health_margin = ((health_factor / liquidation_threshold) - 1) * 100 if liquidation_threshold > 0 else 0
-            message += f"Health Status: "
-            if health_factor >= 1.5:
-                message += f"✅ Excellent (margin: {health_margin:.2f}%)\n"
-            elif health_factor >= 1.2:
-                message += f"✅ Good (margin: {health_margin:.2f}%)\n"
-            elif health_factor >= 1.0:
-                message += f"⚠️ Caution (margin: {health_margin:.2f}%)\n"
+        expanded = context.chat_data.setdefault('expanded_sections', set())
+        parts = set(REPORT_SECTION_PARTS['summary'])
+        for section in expanded:
+            parts.update(REPORT_SECTION_PARTS[section])
+        values = await load_position_snapshot(context, sorted(parts), refresh=refresh)
+        
+        chunks = render_report_chunks(context, values, expanded, parts)
+        
+        reply_markup = position_report_keyboard(expanded)
+        
+        # The report is split between sections to stay under Telegram's 4096 character limit;
+        # the keyboard goes on the last message. A toggle pressed on any message of the current
+        # report re-renders it in place, starting from its first message
+        pressed = update.callback_query.message
+        messages = context.chat_data.get('report_messages', [])
+        if pressed.message_id not in [message.message_id for message in messages]:
+            messages = [pressed]
+        rendered = []
+        for index, chunk in enumerate(chunks):
+            markup = reply_markup if index == len(chunks) - 1 else None
+            if index < len(messages):
+                edited = await edit_report(context, messages[index], chunk, reply_markup=markup, parse_mode="HTML")
+                rendered.append(edited if isinstance(edited, Message) else messages[index])
             else:
-                message += "🚨 At Risk of Liquidation!\n"
-        
-        # Add LTV ratio
-        ltv_ratio = (usdt_debt_value / inj_collateral_value) * 100 if inj_collateral_value > 0 else 0
-        message += f"Loan-to-Value Ratio: {ltv_ratio:.2f}%\n\n"
-        
-        # Add Injective perp position details
-        message += "<b>=== INJECTIVE PERP POSITION ===</b>\n"
-        
-        if position_data:
-            direction = "Long" if position_data.get('isLong', False) else "Short"
-            raw_entry_price = position_data.get('entryPrice', '0')
-            raw_quantity = position_data.get('quantity', '0')
-            raw_margin = position_data.get('margin', '0')
-            raw_cumulative_funding_entry = position_data.get('cumulativeFundingEntry', '0')
-            
-            quantity = float(raw_quantity) / 10**18
-            entry_price = float(raw_entry_price) / 10**24
-            margin = float(raw_margin) / 10**24
-            cumulative_funding_entry = float(raw_cumulative_funding_entry) / 10**18
-            
-            position_notional = quantity * inj_price
-            pnl = (entry_price - inj_price) * quantity if direction == "Short" else (inj_price - entry_price) * quantity
-            
-            message += (
-                f"Position Direction: {direction}\n"
-                f"Entry Price: ${entry_price:.2f}\n"
-                f"Current Price: ${inj_price:.2f}\n"
-                f"Quantity: {quantity} INJ\n"
-                f"Original Margin: {margin:.4f} USDT (${margin * usdt_price:.2f})\n"
-            )
-            
-            # Calculate funding payment
-            if cumulative_funding is not None and cumulative_funding_entry is not None:
-                scaling_factor = 1/1000000
-                funding_diff = cumulative_funding_entry - cumulative_funding if direction == "Short" else cumulative_funding - cumulative_funding_entry
-                funding_payment = -(quantity * funding_diff * scaling_factor)
-                
-                if funding_payment > 0:
-                    message += f"Total Accumulated Funding: +{funding_payment:.6f} USDT (+${funding_payment * usdt_price:.2f})\n"
-                else:
-                    message += f"Total Accumulated Funding: {funding_payment:.6f} USDT (${funding_payment * usdt_price:.2f})\n"
-            
-            margin_with_funding = margin + (funding_payment if 'funding_payment' in locals() else 0)
-            message += (
-                f"Current Margin (With Funding Payments): {margin_with_funding:.4f} USDT (${margin_with_funding * usdt_price:.2f})\n"
-                f"Notional Value: ${position_notional:.2f} ({quantity} INJ @ ${inj_price:.2f})\n"
-                f"Unrealized PnL: ${pnl:.2f}\n"
-            )
-            
-            # Calculate effective margin and leverage
-            effective_margin = margin_with_funding * usdt_price + pnl
-            leverage = position_notional / effective_margin if effective_margin > 0 else 0
-            message += (
-                f"Effective Margin: ${effective_margin:.2f}\n"
-                f"Effective Leverage: {leverage:.2f}x\n"
-            )
-            
-            # Calculate liquidation price for perp position
-            max_leverage = 25.0
-            maintenance_margin_ratio = 1 / max_leverage
-            
-            if direction == "Short":
-                buffer_factor = 0.02
-                liquidation_mark_price = (margin_with_funding * usdt_price + entry_price * quantity) / (quantity * (1 + maintenance_margin_ratio - buffer_factor))
-                price_movement_to_liquidation = ((liquidation_mark_price - inj_price) / inj_price) * 100
-                
-                message += (
-                    f"Perp Liquidation Price: ${liquidation_mark_price:.3f} (current: ${inj_price:.2f})\n"
-                    f"Price Increase to Perp Liquidation: {price_movement_to_liquidation:.2f}%\n"
-                )
-                
-                if price_movement_to_liquidation > 40:
-                    message += "✅ Very safe - large buffer to liquidation\n"
-                elif price_movement_to_liquidation > 25:
-                    message += "✅ Safe - good buffer to liquidation\n"
-                elif price_movement_to_liquidation > 15:
-                    message += "⚠️ Moderate buffer to liquidation\n"
-                else:
-                    message += "🚨 Small buffer to liquidation - consider adding margin\n"
-                
-                leverage_utilization = (leverage / (1/maintenance_margin_ratio)) * 100
-                message += f"Leverage Utilization: {leverage_utilization:.2f}% of maximum\n"
-            
-            # Add leverage warnings
-            if effective_margin <= 0:
-                message += "🚨 CRITICAL: Negative or zero effective margin! Position at extreme risk.\n"
-            elif leverage > 5:
-                message += "🚨 WARNING: Extremely high leverage! High risk of liquidation.\n"
-            elif leverage > 3:
-                message += "⚠️ CAUTION: Leverage is higher than recommended. Consider adding margin.\n"
-            
-            # Calculate overall strategy metrics
-            neptune_equity = inj_collateral_value - usdt_debt_value
-            overall_strategy_value = neptune_equity + effective_margin
-            
-            funding_pnl = funding_payment * usdt_price if 'funding_payment' in locals() else 0
-            funding_pnl_percentage = (funding_pnl / overall_strategy_value) * 100 if overall_strategy_value > 0 else 0
-            
-            message += (
-                "\n<b>=== OVERALL STRATEGY VALUE ===</b>\n"
-                f"Neptune Equity (Collateral - Debt): ${neptune_equity:.2f}\n"
-                f"Injective Perp Effective Margin: ${effective_margin:.2f}\n"
-                f"Total Strategy Value: ${overall_strategy_value:.2f}\n"
-            )
-            
-            if funding_pnl > 0:
-                message += f"PnL from Funding Rate: +${funding_pnl:.2f} (+{funding_pnl_percentage:.2f}% of strategy value)\n"
-            else:
-                message += f"PnL from Funding Rate: ${funding_pnl:.2f} ({funding_pnl_percentage:.2f}% of strategy value)\n"
-            
-            # Add borrowing and funding costs
-            message += (
-                "\n<b>=== BORROWING & FUNDING COSTS ===</b>\n"
-                f"USDT Borrow Rate (Neptune): {usdt_borrow_rate:.2f}% APR (${(usdt_debt_value * usdt_borrow_rate / 100):.2f}/year on ${usdt_debt_value:.2f} debt)\n"
-            )
-            
-            if funding_rate > 0:
-                message += (
-                    f"INJ Funding Rate (Injective): +{funding_rate:.2f}% APR (${(position_notional * funding_rate / 100):.2f}/year on ${position_notional:.2f} position)\n"
-                    "(shorts receive)\n"
-                )
-            elif funding_rate < 0:
-                message += (
-                    f"INJ Funding Rate (Injective): {funding_rate:.2f}% APR (-${abs(position_notional * funding_rate / 100):.2f}/year on ${position_notional:.2f} position)\n"
-                    "(shorts pay)\n"
-                )
-            else:
-                message += (
-                    f"INJ Funding Rate (Injective): {funding_rate:.2f}% APR ($0.00/year)\n"
-                    "(neutral)\n"
-                )
-            
-            if direction == "Short":
-                annual_borrow_cost = usdt_debt_value * (usdt_borrow_rate / 100)
-                annual_funding_income = position_notional * (funding_rate / 100)
-                annual_net_yield = annual_funding_income - annual_borrow_cost
-                
-                weighted_borrow_cost = (usdt_debt_value * (usdt_borrow_rate / 100)) / overall_strategy_value * 100 if overall_strategy_value > 0 else 0
-                weighted_funding_income = (position_notional * (funding_rate / 100)) / overall_strategy_value * 100 if overall_strategy_value > 0 else 0
-                weighted_effective_cost = weighted_borrow_cost - weighted_funding_income
-                
-                message += (
-                    "\nNet Annual Dollar Amounts:\n"
-                    f"   → Annual Borrow Cost: ${annual_borrow_cost:.2f}\n"
-                    f"   → Annual Funding Income: ${annual_funding_income:.2f}\n"
-                    f"   → Net Annual Yield: ${annual_net_yield:.2f}\n\n"
-                    f"As Percentage of Strategy Value (${overall_strategy_value:.2f}):\n"
-                    f"   → Borrow Cost: {weighted_borrow_cost:.2f}% APR\n"
-                    f"   → Funding Income: {weighted_funding_income:.2f}% APR\n"
-                    f"   → Effective Cost: {weighted_effective_cost:.2f}% APR\n"
-                )
-                
-                if weighted_effective_cost < 0:
-                    message += f"   → Funding payments received exceed borrowing costs by {abs(weighted_effective_cost):.2f}%\n"
-                else:
-                    message += "   → Net cost after accounting for funding payments\n"
-                
-                strategy_yield = -weighted_effective_cost
-                message += f"\nStrategy Yield: {strategy_yield:.2f}% APR (${annual_net_yield:.2f}/year)\n"
-                
-                if strategy_yield > 30:
-                    message += "✅ Excellent yield\n"
-                elif strategy_yield > 15:
-                    message += "✅ Very good yield\n"
-                elif strategy_yield > 5:
-                    message += "✅ Good yield\n"
-                elif strategy_yield > 0:
-                    message += "✅ Positive yield\n"
-                else:
-                    message += "🚨 Negative yield - consider adjusting strategy\n"
-            
-            # Add position comparison
-            message += (
-                "\n<b>=== POSITION COMPARISON ===</b>\n"
-                "Strategy: Short INJ on Injective Perp to hedge INJ collateral on Neptune\n"
-            )
-            
-            if direction == "Short":
-                hedge_ratio = inj_collateral_value / position_notional * 100 if position_notional > 0 else 0
-                message += f"Hedge Ratio (Collateral / Perp Notional): {hedge_ratio:.2f}%\n"
-                
-                if hedge_ratio > 95 and hedge_ratio < 105:
-                    message += (
-                        "✅ Position is well-hedged (95-105% range)\n"
-                        "   Your INJ collateral value is properly hedged against price movements.\n"
-                    )
-                elif hedge_ratio < 95:
-                    under_hedged_amount = position_notional - inj_collateral_value
-                    message += (
-                        f"⚠️ Position is under-hedged. Consider increasing collateral by ${under_hedged_amount:.2f}\n"
-                        f"   This would require approximately {under_hedged_amount / inj_price:.4f} more INJ as collateral.\n"
-                    )
-                else:
-                    over_hedged_amount = inj_collateral_value - position_notional
-                    message += (
-                        f"⚠️ Position is over-hedged. Consider reducing collateral by ${over_hedged_amount:.2f}\n"
-                        f"   This would require withdrawing approximately {over_hedged_amount / inj_price:.4f} INJ.\n"
-                    )
-                
-                net_inj_exposure = inj_collateral - quantity
-                net_inj_value = net_inj_exposure * inj_price
-                message += f"\nNet INJ Exposure: {net_inj_exposure:.4f} INJ (${net_inj_value:.2f})\n"
-                if abs(net_inj_exposure) < 0.01:
-                    message += "✅ Delta neutral position achieved\n"
-                else:
-                    message += f"{'⚠️ Long' if net_inj_exposure > 0 else '⚠️ Short'} bias in your overall position\n"
-        else:
-            message += (
-                "No derivative position found.\n\n"
-                "<b>=== POSITION COMPARISON ===</b>\n"
-                f"⚠️ No hedge for ${inj_collateral_value:.2f} of collateral. Consider opening a short position.\n"
-                f"   Recommended position size: Short {inj_collateral_value / inj_price:.4f} INJ\n"
-            )
-        
-        # Add navigation buttons
-        keyboard = [
-            [InlineKeyboardButton("Close Position", callback_data="close_position")],
-            [InlineKeyboardButton("Analyze with AI", callback_data="analyze_positions")],
-            [InlineKeyboardButton("Back to Menu", callback_data="back_to_menu")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Split message if it's too long (Telegram has a 4096 character limit)
-        if len(message) > 4000:
-            # Send the first part
-            first_part = message[:4000] + "...\n(continued in next message)"
-            await update.callback_query.edit_message_text(
-                first_part,
-                reply_markup=None,
-                parse_mode="HTML"
-            )
-            # Send the second part
-            second_part = "...(continued)\n" + message[4000:]
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=second_part,
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-        else:
-            await update.callback_query.edit_message_text(
-                message,
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
-        
+                rendered.append(await outbox.send_message(
+                    context.bot, update.effective_chat.id, chunk, reply_markup=markup, parse_mode="HTML"
+                ))
+        for message in messages[len(chunks):]:
+            try:
+                await outbox.delete(message)
+            except Exception as e:
+                # A message Telegram no longer lets the bot delete just stays behind
+                logger.warning("Could not delete report message %s: %s", message.message_id, e)
+        context.chat_data['report_messages'] = rendered
+        
+    except asyncio.TimeoutError as e:
+        logger.warning("Position view timed out: %s", e)
+        await update.callback_query.edit_message_text(
+            f"⏳ Position data is taking too long to load ({e}). Please try again in a moment.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Retry", callback_data="view_positions")]])
+        )
     except Exception as e:
         error_message = f"Error getting position info: {str(e)}"
         logger.error(error_message)
         await update.callback_query.edit_message_text(error_message)
 
+@timed("handler")
 async def close_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Close positions in the Delta Neutral Strategy."""
     # Check if private key is configured
@@ -736,7 +783,8 @@ async def close_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        status_message = await update.callback_query.edit_message_text(
+        status_message = await outbox.edit(
+            update.callback_query.message,
             "Closing Delta Neutral Strategy positions... Please wait."
         )
         
@@ -745,100 +793,42 @@ async def close_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Get subaccount ID
         subaccount_id = get_subaccount_id(address.to_acc_bech32())
+        user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
         
-        # 1. Close Helix position
-        await status_message.edit_text("Step 1/3: Closing Helix short position...")
-        
-        # Refresh account before Helix transaction
-        await client.fetch_account(address.to_acc_bech32())
-        await client.sync_timeout_height()
-        
-        helix_result = await close_helix_position(
-            client, composer, address, subaccount_id, 
-            INJ_PERP_MARKET_ID, network, priv_key, pub_key
-        )
-        if not helix_result:
-            raise Exception("Failed to close Helix position")
-        
-        # Wait for blockchain confirmation
-        await asyncio.sleep(5)
-        
-        # 2. Query user's debt and market state
-        await status_message.edit_text("Step 2/3: Calculating and repaying debt...")
-        await client.fetch_account(address.to_acc_bech32())
+        # Resume a close that failed part way through
+        run = journal.begin("close")
         
-        # Query user accounts to get debt info
-        user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
-        debt_info = await query_market_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
-        
-        # Query global market state to get debt pool info
-        market_query = '{"get_state": {}}'
-        market_state = await query_contract_state(client, NEPTUNE_MARKET_CONTRACT, market_query)
-        
-        # Extract USDT debt pool information
-        usdt_debt_pool = None
-        if "markets" in market_state:
-            for market in market_state["markets"]:
-                if len(market) >= 2 and "native_token" in market[0]:
-                    denom = market[0]["native_token"].get("denom", "")
-                    if denom == "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7":
-                        usdt_debt_pool = market[1].get("debt_pool", {})
-                        break
+        if run.done("close_short") and await has_open_position(client, subaccount_id, INJ_PERP_MARKET_ID):
+            # A short was opened after the journaled close, so its steps no longer apply
+            run.finish()
+            run = journal.begin("close")
         
-        # Calculate exact debt amount
-        if (debt_info and debt_info.get('debt') and 
-            "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7" in debt_info['debt'] and
-            usdt_debt_pool):
+        # 1. Close Helix position
+        if run.done("close_short"):
+            outbox.post_edit(status_message, "Step 1/3: Helix short already closed, resuming...")
+        else:
+            outbox.post_edit(status_message, "Step 1/3: Closing Helix short position...")
             
-            user_debt = debt_info['debt']["peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"]
-            user_shares = int(user_debt.get("shares", "0"))
+            # Refresh account before Helix transaction
+            await client.fetch_account(address.to_acc_bech32())
+            await client.sync_timeout_height()
             
-            if user_shares > 0:
-                usdt_balance = int(usdt_debt_pool.get("balance", "0"))
-                usdt_shares = int(usdt_debt_pool.get("shares", "0"))
-                
-                # Calculate exact debt using ceiling division
-                user_actual_debt = (user_shares * usdt_balance + usdt_shares - 1) // usdt_shares
-                
-                # Refresh account before debt repayment
-                # await client.fetch_account(address.to_acc_bech32())
-                # await client.sync_timeout_height()
-                
-                # Repay the calculated debt
-                repay_msg = {"return": {"account_index": 0}}
-                repay_result = await execute_contract(
-                    json.dumps(repay_msg), user_debt, client, composer,
-                    address, network, priv_key, pub_key, user_actual_debt
-                )
-                if not repay_result:
-                    raise Exception("Failed to repay debt")
-                
-                # Wait for blockchain confirmation
-                await asyncio.sleep(5)
-                
-                # Check for tiny remaining debt (≤10 USDT)
-                updated_debt_info = await query_market_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
-                if (updated_debt_info and updated_debt_info.get('debt') and 
-                    "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7" in updated_debt_info['debt']):
-                    updated_debt = updated_debt_info['debt']["peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"]
-                    tiny_debt = int(updated_debt.get("principal", "0"))
-                    if 0 < tiny_debt <= 10:
-                        # Refresh account before tiny debt repayment
-                        await client.fetch_account(address.to_acc_bech32())
-                        await client.sync_timeout_height()
-                        
-                        # Repay tiny remaining debt
-                        repay_result = await execute_contract(
-                            json.dumps(repay_msg), updated_debt, client, composer,
-                            address, network, priv_key, pub_key, tiny_debt
-                        )
-                        if not repay_result:
-                            raise Exception("Failed to repay tiny remaining debt")
-                        await asyncio.sleep(5)
+            helix_result = await close_helix_position(
+                client, composer, address, subaccount_id, 
+                INJ_PERP_MARKET_ID, network, priv_key, pub_key
+            )
+            if not helix_result:
+                raise Exception("Failed to close Helix position")
+            run.record("close_short", tx_hash_of(helix_result))
+        
+        # 2. Query user's debt and market state
+        if run.done("repay"):
+            outbox.post_edit(status_message, "Step 2/3: Debt already repaid, resuming...")
+        else:
+            await repay_usdt_debt(run, status_message, client, composer, network, priv_key, pub_key, address, user_query)
         
         # 3. Withdraw collateral
-        await status_message.edit_text("Step 3/3: Withdrawing collateral...")
-        await asyncio.sleep(5)  # Wait for previous transactions to be fully confirmed
+        outbox.post_edit(status_message, "Step 3/3: Withdrawing collateral...")
         
         # Query final state to check for collateral
         final_state = await query_market_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
@@ -863,11 +853,16 @@ async def close_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if not withdraw_result:
                     raise Exception("Failed to withdraw collateral")
         
+        # Everything is unwound, including any execution that stopped part way
+        run.finish()
+        journal.abandon("execute")
+        
         # Update message with success
         keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="back_to_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await status_message.edit_text(
+        await outbox.edit(
+            status_message,
             "✅ Successfully closed all Delta Neutral Strategy positions!",
             reply_markup=reply_markup
         )
@@ -875,15 +870,93 @@ async def close_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         error_message = f"Error closing positions: {str(e)}"
         logger.error(error_message)
+        if 'run' in locals() and run.completed():
+            error_message += "\n\nCompleted steps were saved; close again to resume."
         
         keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="back_to_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await status_message.edit_text(
+        await outbox.edit(
+            status_message,
             f"❌ {error_message}",
             reply_markup=reply_markup
         )
 
+async def repay_usdt_debt(run, status_message, client, composer, network, priv_key, pub_key, address, user_query):
+    """Step 2 of closing: repay the exact USDT debt, then any tiny remainder"""
+    outbox.post_edit(status_message, "Step 2/3: Calculating and repaying debt...")
+    await client.fetch_account(address.to_acc_bech32())
+    
+    # Query user accounts to get debt info
+    debt_info = await query_market_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
+    
+    # Query global market state to get debt pool info
+    market_query = '{"get_state": {}}'
+    market_state = await query_contract_state(client, NEPTUNE_MARKET_CONTRACT, market_query)
+    
+    # Extract USDT debt pool information
+    usdt_debt_pool = None
+    if "markets" in market_state:
+        for market in market_state["markets"]:
+            if len(market) >= 2 and "native_token" in market[0]:
+                denom = market[0]["native_token"].get("denom", "")
+                if denom == "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7":
+                    usdt_debt_pool = market[1].get("debt_pool", {})
+                    break
+    
+    # Calculate exact debt amount
+    tx_hashes = []
+    if (debt_info and debt_info.get('debt') and 
+        "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7" in debt_info['debt'] and
+        usdt_debt_pool):
+        
+        user_debt = debt_info['debt']["peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"]
+        user_shares = int(user_debt.get("shares", "0"))
+        
+        if user_shares > 0:
+            usdt_balance = int(usdt_debt_pool.get("balance", "0"))
+            usdt_shares = int(usdt_debt_pool.get("shares", "0"))
+            
+            # Calculate exact debt using ceiling division
+            user_actual_debt = (user_shares * usdt_balance + usdt_shares - 1) // usdt_shares
+            
+            # Refresh account before debt repayment
+            # await client.fetch_account(address.to_acc_bech32())
+            # await client.sync_timeout_height()
+            
+            # Repay the calculated debt
+            repay_msg = {"return": {"account_index": 0}}
+            repay_result = await execute_contract(
+                json.dumps(repay_msg), user_debt, client, composer,
+                address, network, priv_key, pub_key, user_actual_debt
+            )
+            if not repay_result:
+                raise Exception("Failed to repay debt")
+            tx_hashes.append(tx_hash_of(repay_result))
+            
+            # Check for tiny remaining debt (≤10 USDT)
+            updated_debt_info = await query_market_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
+            if (updated_debt_info and updated_debt_info.get('debt') and 
+                "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7" in updated_debt_info['debt']):
+                updated_debt = updated_debt_info['debt']["peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"]
+                tiny_debt = int(updated_debt.get("principal", "0"))
+                if 0 < tiny_debt <= 10:
+                    # Refresh account before tiny debt repayment
+                    await client.fetch_account(address.to_acc_bech32())
+                    await client.sync_timeout_height()
+                    
+                    # Repay tiny remaining debt
+                    repay_result = await execute_contract(
+                        json.dumps(repay_msg), updated_debt, client, composer,
+                        address, network, priv_key, pub_key, tiny_debt
+                    )
+                    if not repay_result:
+                        raise Exception("Failed to repay tiny remaining debt")
+                    tx_hashes.append(tx_hash_of(repay_result))
+    
+    run.record("repay", ", ".join(h for h in tx_hashes if h) or None)
+
+@timed("handler")
 async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Analyze positions using AI."""
     try:
@@ -900,12 +973,7 @@ async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE
         decoded_data = await query_contract_state(client[0], NEPTUNE_MARKET_CONTRACT, user_query)
         
         # Query prices
-        price_query = '{"get_prices": {"assets": [{"native_token": {"denom": "inj"}}, {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}}]}}'
-        prices_data = await query_contract_state(client[0], NEPTUNE_ORACLE_ADDRESS, price_query)
-        
-        # Query account health
-        health_query = f'{{"get_account_health": {{"addr": "{user_address}", "account_index": 0}}}}'
-        health_data = await query_contract_state(client[0], NEPTUNE_QUERIER_ADDRESS, health_query)
+        inj_price, usdt_price = await oracle_prices.get(client[0])
         
         # Query derivative position
         position_data = await query_derivative_position(client[0], INJ_PERP_MARKET_ID, subaccount_id)
@@ -917,7 +985,7 @@ async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE
         funding_rate = await query_funding_rate(client[0], INJ_PERP_MARKET_ID)
         
         # Query funding payments
-        total_funding, funding_details = await query_funding_payments(client[0], [INJ_PERP_MARKET_ID], subaccount_id)
+        funding_payments = await query_funding_payments(client[0], [INJ_PERP_MARKET_ID], subaccount_id)
         
         # Query derivative market data
         cumulative_funding, market_mark_price = await query_derivative_market_data(client[0], INJ_PERP_MARKET_ID)
@@ -928,12 +996,17 @@ async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Extract data from responses
         inj_collateral = await extract_inj_collateral(decoded_data)
         usdt_debt = await extract_usdt_debt(decoded_data)
-        inj_price, usdt_price = await extract_prices(prices_data)
-        health_factor, liquidation_threshold = await extract_account_health(health_data)
         
         # Calculate values
         inj_collateral_value = inj_collateral * inj_price
         usdt_debt_value = usdt_debt * usdt_price
+        health_factor = local_health_factor(inj_collateral, inj_price, inj_liquidation_ltv or 0, usdt_debt_value) or 0
+        liquidation_threshold = 1.0
+        risk_engine.update(
+            inj_collateral=inj_collateral, usdt_debt=usdt_debt, liquidation_ltv=inj_liquidation_ltv,
+            position_data=position_data, has_position=bool(position_data),
+            cumulative_funding=cumulative_funding, inj_price=inj_price, usdt_price=usdt_price,
+        )
         
         # Get Neptune lending and borrow rates
         neptune_lending_rates = get_neptune_lend_rates()
@@ -942,20 +1015,10 @@ async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Format position data for analysis
         helix_position_data = None
         if position_data:
-            direction = "Long" if position_data.get('isLong', False) else "Short"
-            quantity = float(position_data.get('quantity', '0')) / 10**18
-            entry_price = float(position_data.get('entryPrice', '0')) / 10**24
-            margin = float(position_data.get('margin', '0')) / 10**24
-            
-            # Calculate funding payment if available
-            funding_payment = 0
-            if cumulative_funding is not None and position_data.get('cumulativeFundingEntry') is not None:
-                cumulative_funding_entry = float(position_data['cumulativeFundingEntry']) / 10**18
-                scaling_factor = 1/1000000
-                funding_diff = cumulative_funding_entry - cumulative_funding if direction == "Short" else cumulative_funding - cumulative_funding_entry
-                funding_payment = -(quantity * funding_diff * scaling_factor)
-            
-            margin_with_funding = margin + funding_payment
+            position = parse_position(position_data, cumulative_funding)
+            direction, quantity, entry_price = position['direction'], position['quantity'], position['entry_price']
+            funding_payment = position['funding_payment'] or 0
+            margin_with_funding = position['margin_with_funding']
             position_notional = quantity * inj_price
             pnl = (entry_price - inj_price) * quantity if direction == "Short" else (inj_price - entry_price) * quantity
             
@@ -996,8 +1059,10 @@ async def analyze_with_iagent(update: Update, context: ContextTypes.DEFAULT_TYPE
             },
             'funding_rate': funding_rate,
             'funding_history': {
-                'total_payments': total_funding,
-                'recent_payments': funding_details
+                'total_payments': funding_payments['total'],
+                'payment_count': funding_payments['count'],
+                'last_7_days': funding_payments['last_7_days'],
+                'recent_payments': funding_payments['recent']
             },
             'lending_rates': neptune_lending_rates,
             'borrow_rates': neptune_borrow_rates,
@@ -1037,8 +1102,15 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
+    # Leaving the amount-selection screen makes its pending quotes pointless, and their
+    # late edit would overwrite whatever this click shows
+    if not query.data.startswith("invest_amount_"):
+        prefetcher.discard((update.effective_chat.id, "quotes"))
+    
     if query.data == "view_positions":
         await show_positions(update, context)
+    elif query.data.startswith(REPORT_SECTION_PREFIX):
+        await toggle_report_section(update, context, query.data[len(REPORT_SECTION_PREFIX):])
     elif query.data == "explain_strategy":
         await explain_strategy(update, context)
     elif query.data == "show_math":
@@ -1058,6 +1130,7 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await query.edit_message_text(f"Unsupported button: {query.data}")
 
+@timed("handler")
 async def explain_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Explain Delta Neutral Strategy to the user."""
     explanation = (
@@ -1080,6 +1153,7 @@ async def explain_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.callback_query.edit_message_text(explanation, reply_markup=reply_markup, parse_mode="HTML")
 
+@timed("handler")
 async def show_strategy_math(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show the mathematical formulas behind the Delta Neutral Strategy."""
     math_explanation = (
@@ -1114,6 +1188,7 @@ async def show_strategy_math(update: Update, context: ContextTypes.DEFAULT_TYPE)
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.callback_query.edit_message_text(math_explanation, reply_markup=reply_markup, parse_mode="HTML")
 
+@timed("handler")
 async def execute_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Execute the Delta Neutral Strategy with the specified amount."""
     # Check if private key is configured
@@ -1164,8 +1239,8 @@ async def execute_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     keyboard = [
         [
-            InlineKeyboardButton("Invest 1 INJ", callback_data="invest_amount_1"),
-            InlineKeyboardButton("Invest 5 INJ", callback_data="invest_amount_5"),
+            InlineKeyboardButton(f"Invest {amount} INJ", callback_data=f"invest_amount_{amount}")
+            for amount in INVEST_AMOUNTS
         ],
         [InlineKeyboardButton("Back", callback_data="back_to_menu")]
     ]
@@ -1173,123 +1248,242 @@ async def execute_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(
+        sent = await update.callback_query.edit_message_text(
             message,
             reply_markup=reply_markup,
             parse_mode="HTML"
         )
     else:
-        await update.message.reply_text(
+        sent = await update.message.reply_text(
             message,
             reply_markup=reply_markup,
             parse_mode="HTML"
         )
+    
+    # Quote the offered amounts in the background and add them to the screen when ready;
+    # pressing one of the buttons then starts signing without querying first
+    if isinstance(sent, Message):
+        context.chat_data.pop('execution_quotes_claimed', None)
+        prefetcher.start(
+            (update.effective_chat.id, "quotes"),
+            lambda: quote_invest_amounts(context, sent, message, reply_markup)
+        )
+
+async def quote_invest_amounts(context, message, text, reply_markup):
+    """Compute execution quotes for INVEST_AMOUNTS and show them under the amount selection"""
+    client, composer, network, priv_key, pub_key, address = await setup_client()
+    user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
+    decoded_data, (inj_price, _), market_spec = await asyncio.gather(
+        query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query),
+        oracle_prices.get(client),
+        market_specs.get(client, INJ_PERP_MARKET_ID),
+    )
+    inj_collateral = await extract_inj_collateral(decoded_data)
+    
+    # Only the deposit can be simulated up front; the borrow and order depend on it
+    await simulate_contract_gas(
+        client, composer, network, priv_key, pub_key, address, NEPTUNE_MARKET_CONTRACT,
+        '{"deposit_collateral": {"account_index": 0}}',
+        [composer.coin(amount=int(min(INVEST_AMOUNTS) * 10**18), denom="inj")]
+    )
+    gas = sum(gas_model.estimate(msg_type, default) for msg_type, default in DEFAULT_GAS_ESTIMATES.items())
+    
+    quotes = {}
+    for amount in INVEST_AMOUNTS:
+        # Collateral after the deposit is what is already there plus the new amount
+        plan = plan_execution(inj_collateral + amount, inj_price, market_spec)
+        plan['gas_fee'] = gas * GAS_PRICE / 10**18
+        quotes[float(amount)] = plan
+    context.chat_data['execution_quotes'] = {'computed_at': time.monotonic(), 'amounts': quotes}
+    
+    lines = [f"\n\n<b>Quotes</b> (INJ at ${inj_price:.2f})"]
+    for amount in INVEST_AMOUNTS:
+        plan = quotes[float(amount)]
+        lines.append(
+            f"• {amount} INJ: borrow {plan['usdt_to_borrow']:.2f} USDT, "
+            f"short {plan['inj_quantity']:.6f} INJ, {float(plan['dynamic_leverage']):.2f}x, "
+            f"gas ≈ {plan['gas_fee']:.6f} INJ"
+        )
+    # An execution that claimed the quotes has already replaced the screen with its status
+    if context.chat_data.get('execution_quotes_claimed'):
+        return
+    # Posted rather than awaited so cancelling this prefetch never strands a queued edit
+    outbox.post_edit(message, text + "\n".join(lines), reply_markup=reply_markup, parse_mode="HTML")
+
+async def take_execution_quote(update, context, amount):
+    """Return a fresh quote for `amount` computed by the amount-selection screen, if any"""
+    context.chat_data['execution_quotes_claimed'] = True
+    await prefetcher.claim((update.effective_chat.id, "quotes"))
+    quotes = context.chat_data.pop('execution_quotes', None)
+    if not quotes or time.monotonic() - quotes['computed_at'] > QUOTE_TTL:
+        return None
+    return quotes['amounts'].get(float(amount))
+
+def plan_execution(inj_collateral, inj_price, market_spec):
+    """Borrow amount, short quantity and leverage for `inj_collateral` INJ deposited at `inj_price`"""
+    # Calculate values for borrowing
+    inj_collateral_value = inj_collateral * inj_price
+    usdt_to_borrow = inj_collateral_value * BORROW_RATIO  # Borrow 43% of collateral value
+    usdt_to_borrow_amount = int(usdt_to_borrow * 10**6)  # Convert to USDT's smallest unit (6 decimals)
+    
+    # Calculate dynamic leverage
+    position_value = inj_collateral * inj_price  # Position value in USD
+    margin_value = usdt_to_borrow  # Margin value in USD (equal to borrowed USDT)
+    dynamic_leverage = Decimal(str((position_value / margin_value)))
+    
+    # Calculate order parameters
+    inj_price_decimal = Decimal(str(inj_price))
+    inj_quantity_decimal = market_spec.quantize_quantity(Decimal(str(inj_collateral)))  # Same amount as the deposited collateral
+    min_notional = max(market_spec.min_notional, Decimal(MIN_NOTIONAL_SMALLEST_UNITS) / 10**6)
+    
+    # Check if notional value meets minimum requirement
+    if inj_quantity_decimal * inj_price_decimal < min_notional:
+        inj_quantity_decimal = market_spec.quantize_quantity(min_notional * Decimal("1.01") / inj_price_decimal)
+        if inj_quantity_decimal * inj_price_decimal < min_notional:
+            inj_quantity_decimal += market_spec.quantity_tick
+    
+    return {
+        'inj_price': inj_price,
+        'usdt_to_borrow': usdt_to_borrow,
+        'usdt_to_borrow_amount': usdt_to_borrow_amount,
+        'dynamic_leverage': dynamic_leverage,
+        'inj_price_decimal': inj_price_decimal,
+        'inj_quantity_decimal': inj_quantity_decimal,
+        'inj_quantity': float(inj_quantity_decimal),
+    }
 
+@timed("handler")
 async def execute_delta_neutral_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE, amount: float):
     """Execute the actual Delta Neutral Strategy with the specified amount"""
     try:
         # Initialize status message
         if update.callback_query:
-            status_message = await update.callback_query.edit_message_text(
+            status_message = await outbox.edit(
+                update.callback_query.message,
                 f"Executing Delta Neutral Strategy with {amount} INJ..."
             )
         else:
-            status_message = await update.message.reply_text(
+            status_message = await outbox.send_message(
+                context.bot,
+                update.effective_chat.id,
                 f"Executing Delta Neutral Strategy with {amount} INJ..."
             )
         
+        # A new position is being opened, so a close that stopped part way no longer
+        # describes the wallet; resume an earlier run of this amount that failed part way through
+        journal.abandon("close")
+        run = journal.begin("execute", f"{amount:g}", amount=amount)
+        
+        # Use the quote shown on the amount-selection screen if it is still fresh
+        plan = await take_execution_quote(update, context, amount)
+        
         # Initialize client
         client, composer, network, priv_key, pub_key, address = await setup_client()
         
+        if run.done("deposit") and await deposited_collateral(client, address) < amount:
+            # The journaled deposit has since been withdrawn, so its steps no longer apply
+            run.finish()
+            run = journal.begin("execute", f"{amount:g}", amount=amount)
+        
+        # The quote assumes the deposit is still to come, so a resumed run cannot use it
+        if run.resumed:
+            plan = None
+        
         # Convert amount to smallest units (18 decimals for INJ)
         inj_amount = int(amount * 10**18)
         
         # 1. Deposit INJ collateral
-        await status_message.edit_text(f"Step 1/4: Depositing {amount} INJ as collateral...")
-        funds = [composer.coin(amount=inj_amount, denom="inj")]
-        deposit_msg = '{"deposit_collateral": {"account_index": 0}}'
-        
-        deposit_result = await execute_contract_tx(
-            client, composer, network, priv_key, pub_key, address,
-            NEPTUNE_MARKET_CONTRACT, deposit_msg, funds
-        )
-        
-        if not deposit_result:
-            raise Exception("Deposit transaction failed")
-        
-        # 2. Query collateral and prices
-        await status_message.edit_text("Step 2/4: Calculating optimal borrow amount...")
-        
-        # Query user accounts to get collateral
-        user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
-        decoded_data = await query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
-        
-        # Query prices
-        price_query = json.dumps({
-            "get_prices": {
-                "assets": [
-                    {"native_token": {"denom": "inj"}},
-                    {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}}
-                ]
-            }
-        })
-        prices_data = await query_prices(client, NEPTUNE_ORACLE_ADDRESS, price_query)
-        
-        # Extract data from responses
-        inj_collateral = await extract_inj_collateral(decoded_data)
-        inj_price, usdt_price = await extract_prices(prices_data)
+        if run.done("deposit"):
+            outbox.post_edit(status_message, f"Step 1/4: {amount} INJ already deposited, resuming...")
+        else:
+            outbox.post_edit(status_message, f"Step 1/4: Depositing {amount} INJ as collateral...")
+            funds = [composer.coin(amount=inj_amount, denom="inj")]
+            deposit_msg = '{"deposit_collateral": {"account_index": 0}}'
+            
+            deposit_result = await execute_contract_tx(
+                client, composer, network, priv_key, pub_key, address,
+                NEPTUNE_MARKET_CONTRACT, deposit_msg, funds
+            )
+            
+            if not deposit_result:
+                raise Exception("Deposit transaction failed")
+            run.record("deposit", tx_hash_of(deposit_result))
+        
+        # 2. Query collateral and prices, unless the journal or a fresh quote already has the sizes
+        journaled_plan = run.values("plan")
+        if journaled_plan and run.age("plan") <= JOURNAL_PLAN_TTL:
+            plan = journaled_plan
+            outbox.post_edit(status_message, "Step 2/4: Using the journaled borrow amount...")
+        elif plan:
+            outbox.post_edit(status_message, "Step 2/4: Using the quoted borrow amount...")
+        else:
+            outbox.post_edit(status_message, "Step 2/4: Calculating optimal borrow amount...")
+            
+            # Query user accounts to get collateral
+            user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
+            decoded_data = await query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
+            
+            # Query prices
+            inj_price, usdt_price = await oracle_prices.get(client)
+            
+            # Extract data from responses
+            inj_collateral = await extract_inj_collateral(decoded_data)
+            
+            # Load tick/lot constraints for the market (cached after the first call)
+            market_spec = await market_specs.get(client, INJ_PERP_MARKET_ID)
+            plan = plan_execution(inj_collateral, inj_price, market_spec)
         
-        # Calculate values for borrowing
-        inj_collateral_value = inj_collateral * inj_price
-        usdt_to_borrow = inj_collateral_value * 0.43  # Borrow 43% of collateral value
-        usdt_to_borrow_amount = int(usdt_to_borrow * 10**6)  # Convert to USDT's smallest unit (6 decimals)
+        if plan is not journaled_plan:
+            if run.done("borrow"):
+                # Re-planned after a stale resume: the margin already borrowed stays as it was
+                plan.update(run.values("borrow"))
+            run.record("plan", **plan)
         
-        # Calculate dynamic leverage
-        position_value = inj_collateral * inj_price  # Position value in USD
-        margin_value = usdt_to_borrow  # Margin value in USD (equal to borrowed USDT)
-        dynamic_leverage = Decimal(str((position_value / margin_value)))
+        inj_price = plan['inj_price']
+        usdt_to_borrow = plan['usdt_to_borrow']
+        usdt_to_borrow_amount = plan['usdt_to_borrow_amount']
+        dynamic_leverage = plan['dynamic_leverage']
         
         # 3. Borrow USDT
-        await status_message.edit_text(f"Step 3/4: Borrowing {usdt_to_borrow:.2f} USDT...")
-        
-        borrow_msg = {
-            "borrow": {
-                "account_index": 0,
-                "amount": str(usdt_to_borrow_amount),
-                "asset_info": {
-                    "native_token": {
-                        "denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"
+        if run.done("borrow"):
+            outbox.post_edit(status_message, f"Step 3/4: {usdt_to_borrow:.2f} USDT already borrowed, resuming...")
+        else:
+            outbox.post_edit(status_message, f"Step 3/4: Borrowing {usdt_to_borrow:.2f} USDT...")
+            
+            borrow_msg = {
+                "borrow": {
+                    "account_index": 0,
+                    "amount": str(usdt_to_borrow_amount),
+                    "asset_info": {
+                        "native_token": {
+                            "denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"
+                        }
                     }
                 }
             }
-        }
-        
-        borrow_result = await execute_contract_tx(
-            client, composer, network, priv_key, pub_key, address,
-            NEPTUNE_MARKET_CONTRACT, borrow_msg
-        )
-        
-        if not borrow_result:
-            raise Exception("Borrow transaction failed")
+            
+            borrow_result = await execute_contract_tx(
+                client, composer, network, priv_key, pub_key, address,
+                NEPTUNE_MARKET_CONTRACT, borrow_msg
+            )
+            
+            if not borrow_result:
+                raise Exception("Borrow transaction failed")
+            run.record(
+                "borrow", tx_hash_of(borrow_result),
+                usdt_to_borrow=usdt_to_borrow, usdt_to_borrow_amount=usdt_to_borrow_amount
+            )
         
         # 4. Create derivative market order
-        await status_message.edit_text("Step 4/4: Creating short position on Helix...")
+        outbox.post_edit(status_message, "Step 4/4: Creating short position on Helix...")
         
         # Get subaccount ID
         subaccount_id = get_subaccount_id(address.to_acc_bech32())
         
-        # Calculate order parameters
-        inj_quantity = inj_collateral  # Use the same amount as the deposited collateral
-        notional_value = inj_quantity * inj_price
-        min_notional = MIN_NOTIONAL_SMALLEST_UNITS / 10**6  # Convert to USDT
-        
-        # Check if notional value meets minimum requirement
-        if notional_value < min_notional:
-            inj_quantity = (MIN_NOTIONAL_SMALLEST_UNITS * 1.01) / 10**6 / inj_price
-        
-        # Convert to Decimal objects with appropriate precision
-        inj_quantity_decimal = Decimal(str(round(inj_quantity, 6)))
-        inj_price_decimal = Decimal(str(round(inj_price, 6)))
+        # Order parameters were sized against the market's tick/lot constraints above
+        inj_price_decimal = plan['inj_price_decimal']
+        inj_quantity_decimal = plan['inj_quantity_decimal']
+        inj_quantity = plan['inj_quantity']
         
         # Create and execute the derivative market order
         order_result = await create_derivative_market_order(
@@ -1299,12 +1493,14 @@ async def execute_delta_neutral_strategy(update: Update, context: ContextTypes.D
         
         if not order_result:
             raise Exception("Market order transaction failed")
+        run.finish()
         
         # Update message with success
         keyboard = [[InlineKeyboardButton("View Positions", callback_data="view_positions")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await status_message.edit_text(
+        await outbox.edit(
+            status_message,
             f"✅ Successfully executed Delta Neutral Strategy!\n\n"
             f"• Deposited: {amount} INJ\n"
             f"• Borrowed: {usdt_to_borrow:.2f} USDT\n"
@@ -1317,12 +1513,15 @@ async def execute_delta_neutral_strategy(update: Update, context: ContextTypes.D
     except Exception as e:
         error_message = f"Error executing strategy: {str(e)}"
         logger.error(error_message)
+        if 'run' in locals() and run.completed():
+            error_message += f"\n\nCompleted steps were saved; invest {amount:g} INJ again to resume."
         
         keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="back_to_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         if 'status_message' in locals():
-            await status_message.edit_text(
+            await outbox.edit(
+                status_message,
                 f"❌ {error_message}",
                 reply_markup=reply_markup
             )
@@ -1337,6 +1536,7 @@ async def execute_delta_neutral_strategy(update: Update, context: ContextTypes.D
                 reply_markup=reply_markup
             )
 
+@timed("query")
 async def setup_client():
     """Initialize client and account"""
     # Load private key from .env file
@@ -1358,7 +1558,7 @@ async def setup_client():
     
     # Initialize network and client
     network = Network.mainnet()
-    client = AsyncClient(network)
+    client = InstrumentedClient(RoutedClient(cassette.wrap_client(AsyncClient(network)), endpoint_pool))
     composer = await client.composer()
     await client.sync_timeout_height()
     
@@ -1373,46 +1573,36 @@ async def setup_client():
     
     return client, composer, network, priv_key, pub_key, address
 
+@with_tx_id
 async def execute_contract_tx(client, composer, network, priv_key, pub_key, address, contract, msg_data, funds=None):
     """Execute a contract transaction with simulation and broadcasting"""
     if funds is None:
         funds = []
     
+    # Prepare transaction message
+    msg = contract_msg(composer, address, contract, msg_data, funds)
+    return await broadcast_msgs(client, composer, network, priv_key, pub_key, address, [msg], contract_msg_type(msg_data))
+
+async def broadcast_msgs(client, composer, network, priv_key, pub_key, address, msgs, msg_type):
+    """Simulate, sign and broadcast `msgs` as one transaction, gas-sized as `msg_type`, and wait for it"""
     # Always refresh account information to get the latest sequence number
     await client.fetch_account(address.to_acc_bech32())
-        
-    # Prepare transaction message
-    msg = composer.MsgExecuteContract(
-        sender=address.to_acc_bech32(),
-        contract=contract,
-        msg=msg_data if isinstance(msg_data, str) else json.dumps(msg_data),
-        funds=funds,
-    )
-    
-    # Build and simulate transaction
-    tx = (
-        Transaction()
-        .with_messages(msg)
-        .with_sequence(client.get_sequence())
-        .with_account_num(client.get_number())
-        .with_chain_id(network.chain_id)
-    )
-    sim_sign_doc = tx.get_sign_doc(pub_key)
-    sim_sig = priv_key.sign(sim_sign_doc.SerializeToString())
-    sim_tx_raw_bytes = tx.get_tx_data(sim_sig, pub_key)
     
     # Simulate transaction
     try:
-        sim_res = await client.simulate(sim_tx_raw_bytes)
+        sim_res = await simulate_msg(client, network, priv_key, pub_key, *msgs)
     except RpcError as ex:
-        print(f"Simulation error: {ex}")
+        logger.error("Simulation error: %s", ex)
         return None
 
-    print(sim_res)
+    log_payload(logger, "Simulation result", sim_res)
+    simulated = int(sim_res["gasInfo"]["gasUsed"])
+    logger.info("Simulated %s: %d gas", msg_type, simulated)
+    gas_model.remember(msg_type, simulated)
     
     # Build transaction with gas limit
     gas_price = GAS_PRICE
-    gas_limit = int(sim_res["gasInfo"]["gasUsed"]) + GAS_BUFFER
+    gas_limit = gas_model.limit(msg_type, simulated)
     gas_fee = "{:.18f}".format((gas_price * gas_limit) / pow(10, 18)).rstrip("0")
     fee = [
         composer.coin(
@@ -1426,7 +1616,7 @@ async def execute_contract_tx(client, composer, network, priv_key, pub_key, addr
     
     tx = (
         Transaction()
-        .with_messages(msg)
+        .with_messages(*msgs)
         .with_sequence(client.get_sequence())
         .with_account_num(client.get_number())
         .with_chain_id(network.chain_id)
@@ -1440,15 +1630,82 @@ async def execute_contract_tx(client, composer, network, priv_key, pub_key, addr
     tx_raw_bytes = tx.get_tx_data(sig, pub_key)
     
     # Broadcast transaction
-    res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
-    logger.info(f"Transaction result: {res}")
-    logger.info(f"Gas used: {gas_limit}, Gas fee: {gas_fee} INJ")
+    with track("tx", "broadcast"):
+        res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
+    log_payload(logger, "Broadcast result", res)
+    logger.info("Broadcast %s %s with gas limit %d (fee %s INJ)", msg_type, tx_hash_of(res), gas_limit, gas_fee)
     
     # Wait for transaction to be included in a block
-    sleep(3)
+    return await confirm_tx(client, res, msg_type, simulated, gas_limit)
+
+async def confirm_tx(client, res, msg_type, simulated, gas_limit):
+    """Wait until a broadcast tx is in a block and feed its gas use back into gas_model.
+
+    Returns `res`, or None if the tx was rejected or failed on chain. A tx that is
+    not found in time is assumed to still be pending and is returned as is.
+    """
+    tx_response = (res or {}).get('txResponse', {})
+    if tx_response.get('code', 0) != 0:
+        logger.error("%s transaction rejected: %s", msg_type, tx_response.get('rawLog'))
+        return None
+    if not tx_response.get('txhash'):
+        return res
     
+    included = await wait_for_tx(client, tx_response['txhash'])
+    if included is None:
+        return res
+    code = int(included.get('code', 0) or 0)
+    gas_used = int(included.get('gasUsed', 0) or 0)
+    logger.info("Confirmed %s at height %s: %d of %d gas", msg_type, included.get('height'), gas_used, gas_limit)
+    gas_model.record(msg_type, simulated, gas_limit, gas_used, out_of_gas=code == OUT_OF_GAS_CODE)
+    if code != 0:
+        logger.error("%s transaction failed with code %s: %s", msg_type, code, included.get('rawLog'))
+        return None
     return res
 
+def contract_msg(composer, address, contract, msg_data, funds):
+    """MsgExecuteContract for `msg_data` (a JSON string or dict) sent from `address`"""
+    return composer.MsgExecuteContract(
+        sender=address.to_acc_bech32(),
+        contract=contract,
+        msg=msg_data if isinstance(msg_data, str) else json.dumps(msg_data),
+        funds=funds,
+    )
+
+def contract_msg_type(msg_data):
+    """Top-level key of a contract message, e.g. borrow or deposit_collateral"""
+    if isinstance(msg_data, str):
+        msg_data = json.loads(msg_data)
+    return next(iter(msg_data))
+
+async def simulate_msg(client, network, priv_key, pub_key, *msgs):
+    """Sign `msgs` as one transaction with the current sequence and simulate it"""
+    tx = (
+        Transaction()
+        .with_messages(*msgs)
+        .with_sequence(client.get_sequence())
+        .with_account_num(client.get_number())
+        .with_chain_id(network.chain_id)
+    )
+    sim_sign_doc = tx.get_sign_doc(pub_key)
+    sim_sig = priv_key.sign(sim_sign_doc.SerializeToString())
+    sim_tx_raw_bytes = tx.get_tx_data(sim_sig, pub_key)
+    with track("tx", "simulate"):
+        return await client.simulate(sim_tx_raw_bytes)
+
+async def simulate_contract_gas(client, composer, network, priv_key, pub_key, address, contract, msg_data, funds=None):
+    """Simulated gasUsed of a contract execution, or None if the simulation fails"""
+    msg = contract_msg(composer, address, contract, msg_data, funds or [])
+    try:
+        sim_res = await simulate_msg(client, network, priv_key, pub_key, msg)
+    except RpcError as ex:
+        logger.warning(f"Gas estimate simulation failed: {ex}")
+        return None
+    gas_used = int(sim_res["gasInfo"]["gasUsed"])
+    gas_model.remember(contract_msg_type(msg_data), gas_used)
+    return gas_used
+
+@timed("query")
 async def query_contract_state(client, contract_address, query_data):
     """Query a smart contract's state"""
     contract_state = await client.fetch_smart_contract_state(
@@ -1457,6 +1714,7 @@ async def query_contract_state(client, contract_address, query_data):
     )
     return json.loads(base64.b64decode(contract_state["data"]))
 
+@with_tx_id
 async def create_derivative_market_order(client, composer, network, priv_key, pub_key, address, 
                                       market_id, subaccount_id, price, quantity, usdt_to_borrow_amount, order_type="SELL"):
     """Create a derivative market order"""
@@ -1464,42 +1722,41 @@ async def create_derivative_market_order(client, composer, network, priv_key, pu
     await client.fetch_account(address.to_acc_bech32())
     await client.sync_timeout_height()
     
+    # Quantize and validate locally so invalid orders never reach simulation
+    try:
+        market_spec = await market_specs.get(client, market_id)
+        worst_price = price*Decimal("0.95") if order_type == "SELL" else price*Decimal("1.05")  # 5% price buffer for better execution
+        order_price, order_quantity = market_spec.quantize_order(worst_price, quantity, order_type)
+    except OrderValidationError as ex:
+        logger.error("Order rejected before simulation: %s", ex)
+        return None
+    
     # Prepare order message with 5% price buffer for better execution
     msg = composer.msg_create_derivative_market_order(
         sender=address.to_acc_bech32(),
         market_id=market_id,
         subaccount_id=subaccount_id,
         fee_recipient=FEE_RECIPIENT,
-        price=price*Decimal(0.95),  # 5% price buffer for better execution
-        quantity=quantity,
+        price=order_price,
+        quantity=order_quantity,
         margin=usdt_to_borrow_amount/Decimal(10**6),  # Convert from smallest units
         order_type=order_type,
         cid=str(uuid.uuid4()),
     )
     
-    # Build and simulate transaction
-    tx = (
-        Transaction()
-        .with_messages(msg)
-        .with_sequence(client.get_sequence())
-        .with_account_num(client.get_number())
-        .with_chain_id(network.chain_id)
-    )
-    sim_sign_doc = tx.get_sign_doc(pub_key)
-    sim_sig = priv_key.sign(sim_sign_doc.SerializeToString())
-    sim_tx_raw_bytes = tx.get_tx_data(sim_sig, pub_key)
-    
     # Simulate transaction
     try:
-        sim_res = await client.simulate(sim_tx_raw_bytes)
-        logger.info(f"Simulation successful. Gas used: {sim_res['gasInfo']['gasUsed']}")
+        sim_res = await simulate_msg(client, network, priv_key, pub_key, msg)
+        logger.info("Simulation successful. Gas used: %s", sim_res['gasInfo']['gasUsed'])
     except RpcError as ex:
-        print(f"Simulation failed: {ex}")
+        logger.error("Simulation failed: %s", ex)
         return None
+    simulated = int(sim_res["gasInfo"]["gasUsed"])
+    gas_model.remember('derivative_market_order', simulated)
     
     # Build transaction with gas limit
     gas_price = GAS_PRICE
-    gas_limit = int(sim_res["gasInfo"]["gasUsed"]) + GAS_BUFFER
+    gas_limit = gas_model.limit('derivative_market_order', simulated)
     gas_fee = "{:.18f}".format((gas_price * gas_limit) / pow(10, 18)).rstrip("0")
     
     # Refresh account information again before broadcasting
@@ -1524,14 +1781,28 @@ async def create_derivative_market_order(client, composer, network, priv_key, pu
     tx_raw_bytes = tx.get_tx_data(sig, pub_key)
     
     # Execute transaction
-    logger.info(f"Ready to execute transaction with gas fee: {gas_fee} INJ")
-    res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
-    logger.info(f"Transaction result: {res}")
+    logger.info("Ready to execute transaction with gas fee: %s INJ", gas_fee)
+    with track("tx", "broadcast"):
+        res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
+    log_payload(logger, "Broadcast result", res)
+    logger.info("Broadcast derivative_market_order %s", tx_hash_of(res))
     
     # Wait for transaction to be included in a block
-    sleep(3)
-    
-    return res
+    return await confirm_tx(client, res, 'derivative_market_order', simulated, gas_limit)
+
+async def has_open_position(client, subaccount_id, market_id):
+    """Whether the subaccount holds a position in the market, read from the chain"""
+    position = await client.fetch_chain_subaccount_position_in_market(
+        subaccount_id=subaccount_id, market_id=market_id
+    )
+    position_data = (position or {}).get("state") or {}
+    return float(position_data.get("quantity", "0")) > 0
+
+async def deposited_collateral(client, address):
+    """INJ collateral the address holds on Neptune, read from the chain"""
+    user_query = f'{{"get_user_accounts": {{"addr": "{address.to_acc_bech32()}"}}}}'
+    decoded_data = await query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query)
+    return await extract_inj_collateral(decoded_data)
 
 async def extract_inj_collateral(decoded_data):
     """Extract INJ collateral amount from contract query response"""
@@ -1551,73 +1822,60 @@ async def extract_inj_collateral(decoded_data):
     
     return inj_collateral
 
-async def extract_prices(prices_data):
-    """Extract asset prices from oracle query response"""
-    inj_price = 0
-    usdt_price = 0
-    
-    for asset_price_pair in prices_data:
-        asset = asset_price_pair[0]
-        price_info = asset_price_pair[1]
-        
-        if 'native_token' in asset and asset['native_token']['denom'] == 'inj':
-            inj_price = float(price_info['price'])
-        elif 'native_token' in asset and 'peggy' in asset['native_token']['denom']:
-            usdt_price = float(price_info['price'])
-    
-    return inj_price, usdt_price
-
+@with_tx_id
 async def close_helix_position(client, composer, address, subaccount_id, market_id, network, priv_key, pub_key):
     position = await client.fetch_chain_subaccount_position_in_market(
         subaccount_id=subaccount_id, market_id=market_id
     )
-    print("=== Position Info ===")
-    print(position)
+    log_payload(logger, "Position info", position)
 
     # Get current asset prices from the Neptune Oracle
-    price_query = json.dumps({
-        "get_prices": {
-            "assets": [
-                {"native_token": {"denom": "inj"}},
-                {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}}
-            ]
-        }
-    })
-    prices_data = await query_prices(client, NEPTUNE_ORACLE_ADDRESS, price_query)
-    inj_price, usdt_price = await extract_prices(prices_data)
-    print(f"Current INJ Price: ${inj_price:.4f}")
-    print(f"Current USDT Price: ${usdt_price:.4f}")
+    inj_price, usdt_price = await oracle_prices.get(client)
+    logger.info("Current INJ price $%.4f, USDT price $%.4f", inj_price, usdt_price)
 
     position_data = position.get("state", {})
     if not position_data:
-        print("No active position found in this market")
+        logger.info("No active position found in this market")
         return
 
     is_long = position_data.get("isLong", False)
     quantity = float(position_data.get("quantity", "0")) / 10**18
-    print(f"Position Direction: {'Long' if is_long else 'Short'}")
-    print(f"Position Quantity: {quantity} INJ")
     order_type = "SELL" if is_long else "BUY"
-    print(f"Order Type to Close: {order_type}")
-
-    # Fetch market prices for the derivative
-    prices = await client.fetch_derivative_mid_price_and_tob(market_id=market_id)
-    best_sell_price = float(prices["bestSellPrice"]) / 10**24
-    best_buy_price = float(prices["bestBuyPrice"]) / 10**24
-    print(f"Best Sell Price: ${best_sell_price:.6f}")
-    print(f"Best Buy Price: ${best_buy_price:.6f}")
+    logger.info("Closing %s position of %s INJ with a %s order", "long" if is_long else "short", quantity, order_type)
 
     # Add a small buffer to prices to improve execution chances
     price_buffer = 0.001  # 0.1% buffer
-    buffered_sell_price = best_sell_price * (1 + price_buffer)  # Lower sell price (better for closing longs)
-    buffered_buy_price = best_buy_price * (1 - price_buffer)    # Higher buy price (better for closing shorts)
-    print(f"Buffered Sell Price (-{price_buffer*100}%): ${buffered_sell_price:.6f}")
-    print(f"Buffered Buy Price (+{price_buffer*100}%): ${buffered_buy_price:.6f}")
+
+    # Price the close from local depth for the full quantity when the book is in sync
+    local_price = order_books.closing_price(market_id, order_type, quantity, price_buffer)
+    if local_price:
+        execution_price, average_price = local_price
+        execution_price = float(execution_price)
+        logger.info("Local book price for %s INJ: worst $%.6f, average $%.6f", quantity, execution_price, average_price)
+    else:
+        # Fetch market prices for the derivative
+        prices = await client.fetch_derivative_mid_price_and_tob(market_id=market_id)
+        best_sell_price = float(prices["bestSellPrice"]) / 10**24
+        best_buy_price = float(prices["bestBuyPrice"]) / 10**24
+        buffered_sell_price = best_sell_price * (1 + price_buffer)  # Lower sell price (better for closing longs)
+        buffered_buy_price = best_buy_price * (1 - price_buffer)    # Higher buy price (better for closing shorts)
+        logger.info(
+            "Top of book: best sell $%.6f (buffered $%.6f), best buy $%.6f (buffered $%.6f)",
+            best_sell_price, buffered_sell_price, best_buy_price, buffered_buy_price
+        )
+        execution_price = buffered_buy_price if is_long else buffered_sell_price
 
     fee_recipient = "inj1xwfmk0rxf5nw2exvc42u2utgntuypx3k3gdl90"
-    execution_price = buffered_buy_price if is_long else buffered_sell_price
-    price_decimal = Decimal(str(execution_price))
-    quantity_decimal = Decimal(str(quantity))
+
+    # Quantize and validate locally so invalid orders never reach simulation
+    try:
+        market_spec = await market_specs.get(client, market_id)
+        price_decimal = market_spec.quantize_price(Decimal(str(execution_price)), order_type)
+        quantity_decimal = market_spec.quantize_quantity(Decimal(str(quantity)))
+        market_spec.validate_order(price_decimal, quantity_decimal)
+    except OrderValidationError as ex:
+        logger.error("Order rejected before simulation: %s", ex)
+        return None
 
     try:
         msg = composer.msg_create_derivative_market_order(
@@ -1646,38 +1904,42 @@ async def close_helix_position(client, composer, address, subaccount_id, market_
         sim_sign_doc = tx.get_sign_doc(pub_key)
         sim_sig = priv_key.sign(sim_sign_doc.SerializeToString())
         sim_tx_raw_bytes = tx.get_tx_data(sim_sig, pub_key)
-        sim_res = await client.simulate(sim_tx_raw_bytes)
-        print("Simulation successful")
+        with track("tx", "simulate"):
+            sim_res = await client.simulate(sim_tx_raw_bytes)
+        log_payload(logger, "Simulation result", sim_res)
         
         gas_price = GAS_PRICE
-        gas_limit = int(sim_res["gasInfo"]["gasUsed"]) + 50000
+        simulated = int(sim_res["gasInfo"]["gasUsed"])
+        gas_limit = gas_model.limit('derivative_market_order', simulated)
         gas_fee = "{:.18f}".format((gas_price * gas_limit) / 10**18).rstrip("0")
         fee = [composer.coin(amount=gas_price * gas_limit, denom=network.fee_denom)]
         tx = tx.with_gas(gas_limit).with_fee(fee).with_memo("").with_timeout_height(client.timeout_height)
         sign_doc = tx.get_sign_doc(pub_key)
         sig = priv_key.sign(sign_doc.SerializeToString())
         tx_raw_bytes = tx.get_tx_data(sig, pub_key)
-        res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
-        print("=== Transaction Details ===")
-        print(res)
-        print(f"Gas wanted: {gas_limit}")
-        print(f"Gas fee: {gas_fee} INJ")
+        with track("tx", "broadcast"):
+            res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
+        log_payload(logger, "Broadcast result", res)
+        logger.info("Broadcast close order %s with gas limit %d (fee %s INJ)", tx_hash_of(res), gas_limit, gas_fee)
         
         # Check transaction status
         if 'txResponse' in res and res['txResponse'].get('code', 0) == 0:
-            print("Position closed successfully!")
+            if not await confirm_tx(client, res, 'derivative_market_order', simulated, gas_limit):
+                return None
+            logger.info("Position closed successfully")
             return res
         else:
             if 'txResponse' in res and 'rawLog' in res['txResponse']:
-                print(f"Transaction failed with error: {res['txResponse']['rawLog']}")
+                logger.error("Transaction failed with error: %s", res['txResponse']['rawLog'])
             else:
-                print("Transaction status unclear. Please check manually.")
+                logger.error("Transaction status unclear. Please check manually.")
             return None
             
     except RpcError as ex:
-        print(f"Transaction failed: {ex}")
+        logger.error("Transaction failed: %s", ex)
         return None
 
+@timed("query")
 async def query_market_state(client, contract_address, query_data):
     """Query a smart contract's state"""
     contract_state = await client.fetch_smart_contract_state(
@@ -1709,9 +1971,12 @@ async def query_market_state(client, contract_address, query_data):
             break
     return result
 
+@with_tx_id
 async def execute_contract(msg, debt_info, client, composer, address, network, priv_key, pub_key, amount):
     """Execute a contract transaction with proper error handling and gas estimation"""
     try:
+        msg_type = contract_msg_type(msg)
+        
         # Prepare transaction message
         msg = composer.MsgExecuteContract(
             sender=address.to_acc_bech32(),
@@ -1736,12 +2001,15 @@ async def execute_contract(msg, debt_info, client, composer, address, network, p
         sim_tx_raw_bytes = tx.get_tx_data(sim_sig, pub_key)
 
         # Simulate transaction
-        sim_res = await client.simulate(sim_tx_raw_bytes)
-        print(f"Simulation successful. Gas used: {sim_res['gasInfo']['gasUsed']}")
+        with track("tx", "simulate"):
+            sim_res = await client.simulate(sim_tx_raw_bytes)
+        log_payload(logger, "Simulation result", sim_res)
 
         # Calculate gas and fee
         gas_price = GAS_PRICE
-        gas_limit = int(sim_res["gasInfo"]["gasUsed"]) + 50000
+        simulated = int(sim_res["gasInfo"]["gasUsed"])
+        gas_model.remember(msg_type, simulated)
+        gas_limit = gas_model.limit(msg_type, simulated)
         gas_fee = "{:.18f}".format((gas_price * gas_limit) / pow(10, 18)).rstrip("0")
         fee = [composer.coin(amount=gas_price * gas_limit, denom=network.fee_denom)]
 
@@ -1765,16 +2033,37 @@ async def execute_contract(msg, debt_info, client, composer, address, network, p
         tx_raw_bytes = tx.get_tx_data(sig, pub_key)
 
         # Broadcast transaction
-        res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
-        print(f"Transaction result: {res}")
-        print(f"Gas used: {gas_limit}, Gas fee: {gas_fee} INJ")
+        with track("tx", "broadcast"):
+            res = await client.broadcast_tx_sync_mode(tx_raw_bytes)
+        log_payload(logger, "Broadcast result", res)
+        logger.info("Broadcast %s %s with gas limit %d (fee %s INJ)", msg_type, tx_hash_of(res), gas_limit, gas_fee)
 
-        return res
+        return await confirm_tx(client, res, msg_type, simulated, gas_limit)
 
     except Exception as e:
-        print(f"Error executing contract: {str(e)}")
+        logger.error("Error executing contract: %s", e)
         return None
 
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show event-loop lag, endpoint health, learned gas buffers, rolling latency percentiles, cache hit rates and the slowest recent requests (admins only)"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ /perf is only available to bot admins.")
+        return
+    
+    report = format_perf_report()
+    if gas_model.transactions:
+        report = f"{gas_model.report()}\n\n{report}"
+    if len(endpoint_pool.endpoints) > 1:
+        report = f"{endpoint_pool.report()}\n\n{report}"
+    if loop_watchdog.samples:
+        report = f"{loop_watchdog.report()}\n\n{report}"
+    # Keep within Telegram's 4096 character limit by dropping whole lines from the end, which
+    # hold the span details of the least slow of the slowest requests
+    text = html.escape(report)
+    if len(text) > 3900:
+        text = text[:text.rfind("\n", 0, 3900)] + "\n..."
+    await update.message.reply_text(f"<pre>{text}</pre>", parse_mode="HTML")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors in the bot."""
     logger.error(f"Update {update} caused error {context.error}")
@@ -1798,6 +2087,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error in error handler: {str(e)}")
 
+@timed("query")
 async def query_derivative_position(client, market_id, subaccount_id):
     """Query the derivative position for a specific market and subaccount"""
     try:
@@ -1813,7 +2103,7 @@ async def query_derivative_position(client, market_id, subaccount_id):
                 return positions['state']
         return None
     except Exception as e:
-        debug_print(f"Error querying derivative position: {e}")
+        logger.debug("Error querying derivative position: %s", e)
         return None
 
 async def extract_borrow_rate_from_interest_model(interest_data):
@@ -1830,6 +2120,7 @@ async def extract_borrow_rate_from_interest_model(interest_data):
     
     return usdt_borrow_rate
 
+@timed("query")
 async def query_borrow_rate(client, contract_address, asset_denom="peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"):
     """Query the borrow rate for a specific asset (default is USDT)"""
     try:
@@ -1858,6 +2149,7 @@ async def query_borrow_rate(client, contract_address, asset_denom="peggy0xdAC17F
             pass
         return 0
 
+@timed("query")
 async def query_funding_rate(client, market_id):
     """Query the funding rate for a specific market"""
     try:
@@ -1898,36 +2190,42 @@ async def query_funding_rate(client, market_id):
     except Exception as e:
         return 0
 
+@timed("query")
 async def query_funding_payments(client, market_ids, subaccount_id, limit=10):
-    """Query the recent funding payments for a specific market and subaccount"""
-    try:
-        funding_payments = await client.fetch_funding_payments(
-            market_ids=market_ids, 
-            subaccount_id=subaccount_id
-        )
-        
-        total_payments = 0
-        payment_details = []
-        
-        if funding_payments and 'payments' in funding_payments and funding_payments['payments']:
-            for payment in funding_payments['payments']:
-                amount = float(payment['amount']) / 10**6
-                
-                from datetime import datetime
-                timestamp = int(payment['timestamp']) / 1000
-                date_time = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                
-                total_payments += amount
-                payment_details.append({
-                    'date': date_time,
-                    'amount': amount,
-                    'market_id': payment['marketId']
-                })
-        
-        return total_payments, payment_details
-    except Exception as e:
-        return 0, []
+    """Sync the funding ledger for `market_ids` and summarize it: lifetime and 7-day totals and the `limit` newest payments"""
+    for market_id in market_ids:
+        try:
+            await funding_ledger.sync(client, subaccount_id, market_id)
+        except Exception as e:
+            logger.warning("Funding ledger sync for %s failed, using the payments synced so far: %s", market_id, e)
+    
+    total_payments = 0
+    payment_count = 0
+    last_7_days = 0
+    recent = []
+    for market_id in market_ids:
+        market_total, market_count = funding_ledger.total(subaccount_id, market_id)
+        total_payments += market_total
+        payment_count += market_count
+        last_7_days += funding_ledger.since(subaccount_id, market_id, 7)
+        recent += [(timestamp, amount, market_id) for timestamp, amount in funding_ledger.recent(subaccount_id, market_id, limit)]
+    recent.sort(reverse=True)
+    
+    return {
+        'total': total_payments,
+        'count': payment_count,
+        'last_7_days': last_7_days,
+        'recent': [
+            {
+                'date': datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+                'amount': amount,
+                'market_id': market_id,
+            }
+            for timestamp, amount, market_id in recent[:limit]
+        ],
+    }
 
+@timed("query")
 async def query_derivative_market_data(client, market_id):
     """Query derivative market data to get cumulative funding information"""
     try:
@@ -1956,6 +2254,7 @@ async def query_derivative_market_data(client, market_id):
     except Exception as e:
         return None, None
 
+@timed("query")
 async def query_collateral_params(client, contract_address):
     """Query the Neptune market for collateral parameters"""
     try:
@@ -2010,49 +2309,201 @@ async def extract_usdt_debt(decoded_data):
     
     return usdt_debt
 
-async def extract_account_health(health_data):
-    """Extract account health metrics from query response"""
-    health_factor = 0
-    liquidation_threshold = 0
-    
-    if isinstance(health_data, str):
+async def refresh_rebalance_inputs():
+    """Reload the wallet's Neptune balances, perp position and collateral LTV into the risk engine.
+
+    Returns the wallet's USDT bank balance, which is what a partial repay can draw on.
+    """
+    client, _, _, _, _, address = await setup_client()
+    user_address = address.to_acc_bech32()
+    user_query = f'{{"get_user_accounts": {{"addr": "{user_address}"}}}}'
+    decoded_data, (inj_price, usdt_price), position_data, (inj_liquidation_ltv, _), (cumulative_funding, _), balance = await asyncio.gather(
+        query_contract_state(client, NEPTUNE_MARKET_CONTRACT, user_query),
+        oracle_prices.get(client),
+        query_derivative_position(client, INJ_PERP_MARKET_ID, address.get_subaccount_id(index=0)),
+        query_collateral_params(client, NEPTUNE_MARKET_CONTRACT),
+        query_derivative_market_data(client, INJ_PERP_MARKET_ID),
+        client.fetch_bank_balance(user_address, "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"),
+    )
+    risk_engine.update(
+        inj_collateral=await extract_inj_collateral(decoded_data), usdt_debt=await extract_usdt_debt(decoded_data),
+        liquidation_ltv=inj_liquidation_ltv, position_data=position_data, has_position=bool(position_data),
+        cumulative_funding=cumulative_funding, inj_price=inj_price, usdt_price=usdt_price,
+    )
+    return float(balance.get('balance', {}).get('amount', 0)) / 10**6
+
+@with_tx_id
+async def execute_rebalance(plan):
+    """Send a rebalance plan's borrow or repay and its short resize as a single transaction"""
+    client, composer, network, priv_key, pub_key, address = await setup_client()
+    await client.sync_timeout_height()
+    msgs, kinds = [], []
+    if plan['order_type']:
+        # Quantize and validate locally; an order too small to send drops its borrow with it
+        order_type = plan['order_type']
         try:
-            health_factor = float(health_data.strip('"'))
-            liquidation_threshold = 1.0
-        except (ValueError, TypeError):
-            pass
-    elif isinstance(health_data, dict):
-        if 'health_factor' in health_data:
-            health_factor = float(health_data['health_factor'])
-        
-        if 'liquidation_threshold' in health_data:
-            liquidation_threshold = float(health_data['liquidation_threshold'])
-    
-    return health_factor, liquidation_threshold
+            market_spec = await market_specs.get(client, INJ_PERP_MARKET_ID)
+            price = Decimal(str(plan['inj_price']))
+            worst_price = price*Decimal("0.95") if order_type == "SELL" else price*Decimal("1.05")
+            order_price, order_quantity = market_spec.quantize_order(worst_price, Decimal(str(plan['quantity'])), order_type)
+        except OrderValidationError as ex:
+            logger.warning("Rebalance order dropped: %s", ex)
+            order_type = None
+        if order_type == "SELL":
+            if plan['borrow']:
+                msgs.append(contract_msg(composer, address, NEPTUNE_MARKET_CONTRACT, {
+                    "borrow": {
+                        "account_index": 0,
+                        "amount": str(int(plan['borrow'] * 10**6)),
+                        "asset_info": {"native_token": {"denom": "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"}},
+                    }
+                }, []))
+                kinds.append("borrow")
+            margin = Decimal(str(plan['margin'])).quantize(Decimal("0.000001"))
+        elif order_type == "BUY":
+            margin = composer.calculate_margin(
+                quantity=order_quantity, price=order_price, leverage=Decimal(1), is_reduce_only=True
+            )
+        if order_type:
+            msgs.append(composer.msg_create_derivative_market_order(
+                sender=address.to_acc_bech32(),
+                market_id=INJ_PERP_MARKET_ID,
+                subaccount_id=get_subaccount_id(address.to_acc_bech32()),
+                fee_recipient=FEE_RECIPIENT,
+                price=order_price,
+                quantity=order_quantity,
+                margin=margin,
+                order_type=order_type,
+                cid=str(uuid.uuid4()),
+            ))
+            kinds.append("order")
+    if plan['repay']:
+        funds = [composer.coin(amount=int(plan['repay'] * 10**6), denom="peggy0xdAC17F958D2ee523a2206206994597C13D831ec7")]
+        msgs.append(contract_msg(composer, address, NEPTUNE_MARKET_CONTRACT, {"return": {"account_index": 0}}, funds))
+        kinds.append("return")
+    if not msgs:
+        return None
+    return await broadcast_msgs(
+        client, composer, network, priv_key, pub_key, address, msgs, "rebalance_" + "+".join(kinds)
+    )
 
-def debug_print(*args, **kwargs):
-    """Print only if DEBUG mode is enabled"""
-    # Check both the DEBUG flag and the environment variable
-    if os.environ.get('INJECTIVE_DEBUG', '0') == '1':
-        print(*args, **kwargs)
+async def notify_rebalance(bot, plan, result):
+    """Tell the admins what an auto-rebalance did"""
+    health = f"{plan['health_factor']:.2f} → {plan['health_after']:.2f}" if plan['health_factor'] is not None else "n/a"
+    text = (
+        f"⚖️ Auto-rebalance: {plan_summary(plan)}\n"
+        f"Hedge ratio was {plan['hedge_ratio']:.1f}%, health factor {health}\n"
+        f"Tx: {tx_hash_of(result)}"
+    )
+    for user_id in ADMIN_USER_IDS:
+        try:
+            await outbox.send_message(bot, user_id, text)
+        except Exception as e:
+            logger.error("Error notifying admin %s of a rebalance: %s", user_id, e)
+
+def update_wallet_key(update):
+    """Serialization key for updates that sign transactions with the configured wallet"""
+    if not isinstance(update, Update):
+        return None
+    if update.callback_query and (update.callback_query.data or "").startswith(WALLET_CALLBACK_PREFIXES):
+        return "wallet"
+    if update.message and update.message.text:
+        command = update.message.text.split()[0].split('@')[0]
+        if command in WALLET_COMMANDS:
+            return "wallet"
+    return None
+
+async def post_init(application: Application):
+    """Start background market data streams (and the rebalancer, if enabled) once the bot's event loop is running"""
+    if LOOP_BLOCK_THRESHOLD > 0:
+        loop_watchdog.start()
+    endpoint_pool.start_probing()
+    if METRICS_PORT:
+        try:
+            application.bot_data['metrics_runner'] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except Exception as e:
+            logger.error(f"Error starting metrics endpoint: {str(e)}")
+    
+    try:
+        market_spec = await market_specs.get(client, INJ_PERP_MARKET_ID)
+        order_books.track(client, INJ_PERP_MARKET_ID, 10**market_spec.quote_decimals)
+        risk_engine.track(client, market_spec)
+    except Exception as e:
+        logger.error(f"Error starting market data streams: {str(e)}")
+    
+    if AUTO_REBALANCE:
+        rebalancer = application.bot_data['rebalancer'] = Rebalancer(
+            risk_engine, refresh_rebalance_inputs, execute_rebalance, BORROW_RATIO,
+            lock=lambda: wallet_locks.hold("wallet"),
+            busy=lambda: bool(journal.pending()),
+            notify=lambda plan, result: notify_rebalance(application.bot, plan, result),
+        )
+        rebalancer.start()
+
+async def post_shutdown(application: Application):
+    """Stop background market data streams and flush queued messages"""
+    rebalancer = application.bot_data.get('rebalancer')
+    if rebalancer:
+        await rebalancer.stop()
+    await loop_watchdog.stop()
+    await endpoint_pool.stop()
+    await risk_engine.stop()
+    await order_books.stop()
+    await prefetcher.stop()
+    await outbox.stop()
+    metrics_runner = application.bot_data.get('metrics_runner')
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    cassette.save()
+
+async def assign_request_id(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Tag every record logged while handling an update with a fresh request ID"""
+    new_request_id(f"u{update.update_id}" if isinstance(update, Update) else None)
 
 if __name__ == '__main__':
     # Check for existing bot instances
     try:
-        application = Application.builder().token(TOKEN).build()
-        print("Starting bot...")
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .concurrent_updates(
+                # Background rebalances take the wallet lock, so wallet updates must take it too
+                OrderedUpdateProcessor(CONCURRENT_UPDATES, update_wallet_key, MAX_PENDING_UPDATES, wallet_locks)
+                if CONCURRENT_UPDATES > 1 or AUTO_REBALANCE else False
+            )
+            .build()
+        )
+        logger.info("Starting bot...")
         
         # Add handlers
+        application.add_handler(TypeHandler(object, assign_request_id), group=-1)
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("invest", execute_strategy))
         application.add_handler(CommandHandler("close", close_strategy))
+        application.add_handler(CommandHandler("perf", perf_command))
         application.add_handler(CallbackQueryHandler(button_click))
         application.add_error_handler(error_handler)
         
-        print("Handlers registered")
-        
-        application.run_polling(drop_pending_updates=True)  # Add drop_pending_updates=True
+        logger.info("Handlers registered")
+        
+        if WEBHOOK_URL:
+            if not WEBHOOK_SECRET_TOKEN:
+                raise ValueError("WEBHOOK_SECRET_TOKEN must be set when WEBHOOK_URL is used")
+            asyncio.run(serve_webhook(
+                application,
+                webhook_url=WEBHOOK_URL,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                set_webhook=WEBHOOK_SET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            ))
+        else:
+            application.run_polling(drop_pending_updates=True)  # Add drop_pending_updates=True
     except Exception as e:
-        print(f"Failed to start bot: {str(e)}")
+        logger.error("Failed to start bot: %s", e)
         if "Conflict: terminated by other getUpdates request" in str(e):
-            print("ERROR: Another bot instance is already running. Please stop it first.")
\ No newline at end of file
+            logger.error("Another bot instance is already running. Please stop it first.")
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""Record/replay of chain queries, tx simulate/broadcast responses and rate-feed payloads.
+
+Set PERP_CASSETTE_MODE=record to capture a session into PERP_CASSETTE (a
+gzipped JSON-lines file), or PERP_CASSETTE_MODE=replay to serve the same
+responses back without touching the network. PERP_REPLAY_SPEED scales the
+recorded timing: 1 replays at recorded latency, 10 is ten times faster and 0
+answers immediately.
+
+Inspect a recording with `python cassette.py <path>`.
+"""
+import asyncio
+import atexit
+import dataclasses
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from google.protobuf import json_format
+from google.protobuf.message import Message
+
+logger = logging.getLogger(__name__)
+
+# Client methods whose arguments are unique per call (signed tx bytes) and
+# are therefore matched on the method name alone
+UNKEYED_CALLS = {"simulate", "broadcast_tx_sync_mode", "broadcast_tx_async_mode", "broadcast_tx_block_mode"}
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a call was never recorded"""
+
+
+class Cassette:
+    """Captures or replays every chain and HTTP response seen by the bot"""
+
+    def __init__(self, mode=None, path=None, speed=1.0):
+        if mode not in (None, "record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode and not path:
+            raise ValueError("PERP_CASSETTE must be set when PERP_CASSETTE_MODE is used")
+        self.mode = mode
+        self.path = path
+        self.speed = speed
+        self.entries = []
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._queues = {}
+        self._last = {}
+
+        if mode == "record":
+            atexit.register(self.save)
+            logger.info(f"Recording chain and HTTP responses to {path}")
+        elif mode == "replay":
+            self.entries = load_entries(path)
+            for entry in self.entries:
+                self._queues.setdefault((entry["kind"], entry["call"], entry["key"]), []).append(entry)
+            logger.info(f"Replaying {len(self.entries)} recorded responses from {path}")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.getenv("PERP_CASSETTE_MODE") or None,
+            path=os.getenv("PERP_CASSETTE"),
+            speed=float(os.getenv("PERP_REPLAY_SPEED", "1")),
+        )
+
+    def wrap_client(self, client):
+        """Wrap an AsyncClient for recording, or replace it entirely when replaying"""
+        if self.mode == "record":
+            return RecordingClient(client, self)
+        if self.mode == "replay":
+            return ReplayClient(self)
+        return client
+
+    def http_get(self, url, fetch):
+        """Return the body of `url` via `fetch()`, recording or replaying it.
+
+        Feeds are keyed by path and query only, so a recording can be replayed
+        against a differently hosted copy of the same feed.
+        """
+        parts = urlsplit(url)
+        key = f"{parts.path}?{parts.query}" if parts.query else parts.path
+        if self.mode == "replay":
+            entry = self.next_entry("http", "GET", key)
+            self._sleep_sync(entry["duration"])
+            return entry["response"]
+
+        started = time.perf_counter()
+        body = fetch()
+        if self.mode == "record":
+            self.record("http", "GET", key, body, time.perf_counter() - started)
+        return body
+
+    def record(self, kind, call, key, response, duration):
+        entry = {
+            "t": round(time.monotonic() - self._started, 6),
+            "kind": kind,
+            "call": call,
+            "key": key,
+            "duration": round(duration, 6),
+            "response": response,
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def next_entry(self, kind, call, key):
+        """Pop the next recorded response for a call, repeating the last one once exhausted"""
+        queue_key = (kind, call, key)
+        with self._lock:
+            queue = self._queues.get(queue_key)
+            if queue:
+                entry = queue.pop(0)
+                self._last[queue_key] = entry
+                return entry
+            if queue_key in self._last:
+                return self._last[queue_key]
+        raise CassetteMiss(f"No recorded response for {kind} {call} {key}")
+
+    def save(self):
+        if self.mode != "record":
+            return
+        with self._lock:
+            entries = list(self.entries)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":"), default=_json_default) + "\n")
+        logger.info(f"Saved {len(entries)} recorded responses to {self.path}")
+
+    async def sleep(self, duration):
+        if self.speed > 0 and duration > 0:
+            await asyncio.sleep(duration / self.speed)
+
+    def _sleep_sync(self, duration):
+        if self.speed > 0 and duration > 0:
+            time.sleep(duration / self.speed)
+
+
+class RecordingClient:
+    """AsyncClient proxy that records every awaited call and its response"""
+
+    def __init__(self, client, cassette):
+        self._client = client
+        self._cassette = cassette
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if not asyncio.iscoroutinefunction(value) or attr.startswith("listen_"):
+            return value
+
+        async def recorded(*args, **kwargs):
+            started = time.perf_counter()
+            result = await value(*args, **kwargs)
+            duration = time.perf_counter() - started
+            self._cassette.record("chain", attr, call_key(attr, args, kwargs), self._serialize(attr, result), duration)
+            return result
+        return recorded
+
+    def _serialize(self, attr, result):
+        # Calls that mutate client state are recorded as the state they leave behind
+        if attr == "fetch_account":
+            return {"sequence": self._client.sequence, "number": self._client.number}
+        if attr == "sync_timeout_height":
+            return {"timeout_height": self._client.timeout_height}
+        if attr == "composer":
+            return {"derivative_markets": [_dataclass_to_dict(m) for m in result.derivative_markets.values()]}
+        if isinstance(result, Message):
+            return json_format.MessageToDict(result)
+        return result
+
+
+class ReplayClient:
+    """Stand-in for AsyncClient that serves responses from a cassette"""
+
+    def __init__(self, cassette):
+        self._cassette = cassette
+        self.sequence = 0
+        self.number = 0
+        self.timeout_height = 0
+        self.calls = {}
+
+    def get_sequence(self):
+        current_seq = self.sequence
+        self.sequence += 1
+        return current_seq
+
+    def get_number(self):
+        return self.number
+
+    async def fetch_account(self, address):
+        state = await self._replay("fetch_account", (address,), {})
+        self.sequence = state["sequence"]
+        self.number = state["number"]
+
+    async def sync_timeout_height(self):
+        state = await self._replay("sync_timeout_height", (), {})
+        self.timeout_height = state["timeout_height"]
+
+    async def composer(self):
+        from pyinjective.composer import Composer
+
+        state = await self._replay("composer", (), {})
+        markets = [_derivative_market_from_dict(m) for m in state["derivative_markets"]]
+        return Composer(network="mainnet", derivative_markets={market.id: market for market in markets})
+
+    async def listen_derivative_orderbook_updates(self, market_ids, callback, on_end_callback=None,
+                                                  on_status_callback=None):
+        # Streams are not recorded; the snapshot fetched before subscribing is replayed instead
+        await asyncio.Event().wait()
+
+    def __getattr__(self, attr):
+        if attr.startswith("listen_"):
+            async def idle_stream(*args, **kwargs):
+                await asyncio.Event().wait()
+            return idle_stream
+
+        async def replayed(*args, **kwargs):
+            return await self._replay(attr, args, kwargs)
+        return replayed
+
+    async def _replay(self, attr, args, kwargs):
+        self.calls[attr] = self.calls.get(attr, 0) + 1
+        entry = self._cassette.next_entry("chain", attr, call_key(attr, args, kwargs))
+        await self._cassette.sleep(entry["duration"])
+        return json.loads(json.dumps(entry["response"]))
+
+
+def call_key(attr, args, kwargs):
+    """Stable key identifying a call by its arguments"""
+    if attr in UNKEYED_CALLS:
+        return ""
+    return json.dumps([list(args), kwargs], sort_keys=True, default=_json_default)
+
+
+def load_entries(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, Message):
+        return json_format.MessageToDict(value)
+    if hasattr(value, "__dict__"):
+        return {key: item for key, item in vars(value).items() if item is not None}
+    return str(value)
+
+
+def _dataclass_to_dict(value):
+    return {
+        field.name: _dataclass_to_dict(getattr(value, field.name)) if dataclasses.is_dataclass(getattr(value, field.name))
+        else getattr(value, field.name)
+        for field in dataclasses.fields(value)
+    }
+
+
+def _derivative_market_from_dict(data):
+    from pyinjective.core.market import DerivativeMarket
+    from pyinjective.core.token import Token
+
+    kwargs = {}
+    for field in dataclasses.fields(DerivativeMarket):
+        value = data.get(field.name)
+        if field.name == "quote_token":
+            value = Token(**value)
+        elif field.type in (Decimal, "Decimal") and value is not None:
+            value = Decimal(value)
+        kwargs[field.name] = value
+    return DerivativeMarket(**kwargs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python cassette.py <cassette.jsonl.gz>")
+        sys.exit(1)
+    entries = load_entries(sys.argv[1])
+    calls = {}
+    for entry in entries:
+        print(f"{entry['t']:>10.3f}s  {entry['duration'] * 1000:>8.1f}ms  {entry['kind']:<5} {entry['call']:<45} {entry['key'][:60]}")
+        total, count = calls.get(entry["call"], (0, 0))
+        calls[entry["call"]] = (total + entry["duration"], count + 1)
+    print()
+    for call, (total, count) in sorted(calls.items(), key=lambda item: -item[1][0]):
+        print(f"{call:<45} {count:>5} calls  {total / count * 1000:>8.1f}ms avg")
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Updates admitted into the processor at once, including those waiting on a chat or wallet
+DEFAULT_MAX_PENDING_UPDATES = 256
+
+metrics.describe("updates_waiting", "Updates queued behind a chat, wallet or concurrency limit")
+metrics.describe("updates_running", "Updates currently being handled")
+metrics.describe("update_locks_held", "Chats or wallets with an update in progress or queued")
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, discarded once nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates from different chats concurrently while keeping each chat in order.
+
+    Updates from the same chat run one at a time in arrival order, as do updates
+    for which `wallet_key(update)` returns the same key (e.g. everything that
+    signs transactions with one wallet). At most `max_concurrent_updates`
+    handlers run at once; an update only takes one of those slots after its
+    chat and wallet are free, so a long close in one chat never holds a slot
+    while another update of that chat waits behind it. Passing `wallet_locks`
+    shares the wallet locks with work outside the processor, such as background
+    transactions.
+    """
+
+    def __init__(self, max_concurrent_updates, wallet_key=None, max_pending_updates=DEFAULT_MAX_PENDING_UPDATES,
+                 wallet_locks=None):
+        # The base class semaphore bounds admitted updates; running ones are bounded below
+        super().__init__(max(max_pending_updates, max_concurrent_updates, 2))
+        self.max_running = max_concurrent_updates
+        self.wallet_key = wallet_key
+        self.waiting = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = KeyedLocks()
+        self._wallet_locks = wallet_locks if wallet_locks is not None else KeyedLocks()
+
+    async def initialize(self):
+        self._publish()
+
+    async def shutdown(self):
+        if self.running or self.waiting:
+            logger.info(f"Update processor shutting down with {self.running} running and {self.waiting} waiting")
+
+    async def do_process_update(self, update, coroutine):
+        chat_key = chat_key_for(update)
+        wallet_key = self.wallet_key(update) if self.wallet_key else None
+        queued = time.perf_counter()
+        self.waiting += 1
+        self._publish()
+        started = False
+        try:
+            async with AsyncExitStack() as stack:
+                if chat_key is not None:
+                    await stack.enter_async_context(self._chat_locks.hold(chat_key))
+                if wallet_key is not None:
+                    await stack.enter_async_context(self._wallet_locks.hold(wallet_key))
+                await stack.enter_async_context(self._slots)
+
+                started = True
+                self.waiting -= 1
+                self.running += 1
+                self._publish()
+                metrics.observe("queue", "update_wait", time.perf_counter() - queued)
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+                coroutine.close()
+            self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("updates_waiting", self.waiting)
+        metrics.set_gauge("updates_running", self.running)
+        metrics.set_gauge("update_locks_held", len(self._chat_locks), scope="chat")
+        metrics.set_gauge("update_locks_held", len(self._wallet_locks), scope="wallet")
+
+
+def chat_key_for(update):
+    """Chat an update belongs to, falling back to the user for chat-less updates"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return ("user", update.effective_user.id)
+    return None
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from pyinjective.client.model.pagination import PaginationOption
+
+from metrics import metrics, track
+
+logger = logging.getLogger(__name__)
+
+# Default location of the ledger file, relative to the working directory
+DEFAULT_LEDGER_PATH = "funding_ledger.json"
+
+# Payments requested per indexer page
+PAGE_LIMIT = 100
+
+# Older pages fetched per sync while backfilling history; the rest continues on the next sync
+MAX_BACKFILL_PAGES = 20
+
+# Seconds after a sync during which the ledger is served without asking the indexer
+SYNC_INTERVAL = 60
+
+# Newest payments kept per ledger for display
+RECENT_PAYMENTS = 20
+
+# Funding payment amounts are in USDT's smallest unit
+AMOUNT_SCALE = 10**6
+
+metrics.describe("funding_ledger_pages_total", "Funding payment pages fetched by the ledger, by direction")
+metrics.describe("funding_ledger_payments_total", "Funding payments added to the ledger")
+
+
+class FundingLedger:
+    """Local record of funding payments per (subaccount, market), synced incrementally.
+
+    The indexer returns payments newest first. Each ledger covers one
+    contiguous time range: a sync first collects payments newer than the
+    covered range, paging down from now until a page reaches it, then
+    backfills older history below the oldest one until the indexer runs out,
+    MAX_BACKFILL_PAGES at a time. Both walk with an end-time cursor rather
+    than skip, so payments arriving mid-sync cannot shift pages (the
+    indexer's funding payments query takes no start time). Amounts are
+    summed as integers into a running total and per-day (UTC) totals, so
+    lifetime funding is a lookup however long the position has been open.
+    Ledgers persist to `path`.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        self.path = path
+        self.ledgers = {}
+        self.synced_at = {}
+        self._locks = {}
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("FUNDING_LEDGER_PATH", DEFAULT_LEDGER_PATH))
+
+    def ledger(self, subaccount_id, market_id):
+        """The ledger for a subaccount and market (empty if never synced)"""
+        return self.ledgers.get(_key(subaccount_id, market_id)) or _new_ledger()
+
+    def total(self, subaccount_id, market_id):
+        """Lifetime funding in USDT (positive = received) and the number of payments"""
+        ledger = self.ledger(subaccount_id, market_id)
+        return ledger['total'] / AMOUNT_SCALE, ledger['count']
+
+    def since(self, subaccount_id, market_id, days):
+        """Funding in USDT over the last `days` UTC days, today included"""
+        daily = self.ledger(subaccount_id, market_id)['daily']
+        first_day = datetime.fromtimestamp(time.time() - (days - 1) * 86400, timezone.utc).strftime("%Y-%m-%d")
+        return sum(amount for day, amount in daily.items() if day >= first_day) / AMOUNT_SCALE
+
+    def recent(self, subaccount_id, market_id, limit=RECENT_PAYMENTS):
+        """Newest payments as (timestamp in ms, amount in USDT), newest first"""
+        return [(ts, amount / AMOUNT_SCALE) for ts, amount in self.ledger(subaccount_id, market_id)['recent'][:limit]]
+
+    async def sync(self, client, subaccount_id, market_id, force=False):
+        """Add payments made since the last sync (and more history, while backfilling)"""
+        key = _key(subaccount_id, market_id)
+        if not force and time.monotonic() - self.synced_at.get(key, float('-inf')) < SYNC_INTERVAL:
+            metrics.record_cache("funding_ledger", True)
+            return
+        metrics.record_cache("funding_ledger", False)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if not force and time.monotonic() - self.synced_at.get(key, float('-inf')) < SYNC_INTERVAL:
+                return
+            ledger = self.ledgers.get(key) or _new_ledger()
+            with track("query", "funding_ledger_sync"):
+                added = await self._sync_newer(client, subaccount_id, market_id, ledger)
+                if not ledger['backfilled'] or ledger['covered_to'] is None:
+                    added += await self._backfill(client, subaccount_id, market_id, ledger)
+            self.ledgers[key] = ledger
+            self.synced_at[key] = time.monotonic()
+            if added:
+                metrics.inc("funding_ledger_payments_total", added)
+                logger.info("Funding ledger %s: %d new payments, total %+.6f USDT", market_id[:10], added, ledger['total'] / AMOUNT_SCALE)
+                self._save()
+
+    async def _sync_newer(self, client, subaccount_id, market_id, ledger):
+        # Payments above the covered range are collected first and applied together,
+        # so a failure part way leaves the range contiguous
+        if ledger['covered_to'] is None:
+            return 0
+        newer = []
+        end_time = None
+        while True:
+            page = await self._page(client, subaccount_id, market_id, end_time, "newer")
+            fresh = [
+                payment for payment in page
+                if payment[0] > ledger['covered_to'] and (end_time is None or payment[0] <= end_time)
+            ]
+            newer += fresh
+            if len(page) < PAGE_LIMIT or not fresh or len(fresh) < len(page):
+                break
+            end_time = fresh[-1][0] - 1
+        return self._apply(ledger, newer)
+
+    async def _backfill(self, client, subaccount_id, market_id, ledger):
+        added = 0
+        for _ in range(MAX_BACKFILL_PAGES):
+            end_time = ledger['covered_from'] - 1 if ledger['covered_from'] is not None else None
+            page = await self._page(client, subaccount_id, market_id, end_time, "older")
+            older = [payment for payment in page if ledger['covered_from'] is None or payment[0] < ledger['covered_from']]
+            added += self._apply(ledger, older)
+            if len(page) < PAGE_LIMIT or not older:
+                ledger['backfilled'] = True
+                break
+        return added
+
+    async def _page(self, client, subaccount_id, market_id, end_time, direction):
+        response = await client.fetch_funding_payments(
+            market_ids=[market_id],
+            subaccount_id=subaccount_id,
+            pagination=PaginationOption(limit=PAGE_LIMIT, end_time=end_time),
+        )
+        metrics.inc("funding_ledger_pages_total", direction=direction)
+        payments = [
+            (int(payment['timestamp']), int(payment['amount']))
+            for payment in (response or {}).get('payments', [])
+            if payment.get('marketId', market_id) == market_id
+        ]
+        # Newest first, as the indexer returns them; timestamps are unique per subaccount and market
+        payments.sort(reverse=True)
+        return payments
+
+    def _apply(self, ledger, payments):
+        seen = set()
+        added = 0
+        for ts, amount in payments:
+            if ts in seen:
+                continue
+            seen.add(ts)
+            ledger['total'] += amount
+            ledger['count'] += 1
+            day = datetime.fromtimestamp(ts / 1000, timezone.utc).strftime("%Y-%m-%d")
+            ledger['daily'][day] = ledger['daily'].get(day, 0) + amount
+            added += 1
+        if seen:
+            ledger['covered_from'] = min(seen) if ledger['covered_from'] is None else min(ledger['covered_from'], *seen)
+            ledger['covered_to'] = max(seen) if ledger['covered_to'] is None else max(ledger['covered_to'], *seen)
+            recent = {ts: amount for ts, amount in ledger['recent']}
+            recent.update((ts, amount) for ts, amount in payments)
+            ledger['recent'] = sorted(recent.items(), reverse=True)[:RECENT_PAYMENTS]
+        return added
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading funding ledger {self.path}: {str(e)}")
+            return
+        for key, ledger in data.items():
+            ledger['recent'] = [tuple(payment) for payment in ledger.get('recent', [])]
+            self.ledgers[key] = {**_new_ledger(), **ledger}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.ledgers, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving funding ledger {self.path}: {str(e)}")
+
+
+def _key(subaccount_id, market_id):
+    return f"{subaccount_id}:{market_id}"
+
+
+def _new_ledger():
+    return {
+        'total': 0,
+        'count': 0,
+        'daily': {},
+        'recent': [],
+        'covered_from': None,
+        'covered_to': None,
+        'backfilled': False,
+    }
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+
+from grpc import RpcError
+from pyinjective.constant import GAS_PRICE
+
+from metrics import metrics, track
+
+logger = logging.getLogger(__name__)
+
+# Default location of the learned gas statistics, relative to the working directory
+DEFAULT_GAS_STATS_PATH = "gas_stats.json"
+
+# Share of past transactions of a type whose actual gas must fit under the buffer
+DEFAULT_TARGET_PERCENTILE = 0.99
+
+# Flat buffer used until a message type has MIN_SAMPLES confirmed transactions
+FIXED_GAS_BUFFER = 50000
+MIN_SAMPLES = 20
+
+# Actual/simulated ratios remembered per message type
+SAMPLE_WINDOW = 200
+
+# Extra gas on top of the learned ratio, covering rounding and tiny state drift
+MIN_HEADROOM = 2000
+
+# An out-of-gas transaction is recorded as having needed this much more than its limit
+OUT_OF_GAS_PENALTY = 1.2
+
+# Cosmos SDK ABCI code for "out of gas"
+OUT_OF_GAS_CODE = 11
+
+# Polling of fetch_tx while waiting for a broadcast transaction to be included
+CONFIRM_TIMEOUT = 30
+CONFIRM_POLL_INTERVAL = 0.5
+
+metrics.describe("gas_buffer", "Current gas buffer per message type, as a share of simulated gas")
+metrics.describe("gas_saved", "Gas saved per message type versus the fixed 50000 buffer (negative when spending more)")
+metrics.describe("gas_out_of_gas_total", "Transactions that ran out of gas")
+
+
+class GasModel:
+    """Learns how much gas to add on top of simulation, per message type.
+
+    Every confirmed transaction contributes the ratio of its on-chain gasUsed to
+    its simulated gasUsed. Once a type has MIN_SAMPLES ratios, its gas limit is
+    the simulated gas times the ratio at `target_percentile` plus a small
+    headroom, instead of simulated + FIXED_GAS_BUFFER. An out-of-gas failure
+    sets a floor above the limit that failed for the next SAMPLE_WINDOW
+    transactions of its type, however rare it is among the samples.
+    Statistics persist to `path` so a restart keeps what was learned.
+    """
+
+    def __init__(self, path=DEFAULT_GAS_STATS_PATH, target_percentile=DEFAULT_TARGET_PERCENTILE):
+        self.path = path
+        self.target_percentile = target_percentile
+        self.ratios = {}
+        self.last_simulated = {}
+        self.saved = {}
+        self.transactions = {}
+        self.out_of_gas = {}
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("GAS_STATS_PATH", DEFAULT_GAS_STATS_PATH),
+            float(os.getenv("GAS_TARGET_PERCENTILE", str(DEFAULT_TARGET_PERCENTILE))),
+        )
+
+    def limit(self, msg_type, simulated):
+        """Gas limit for a transaction of `msg_type` that simulated at `simulated` gas"""
+        ratio = self.ratio(msg_type)
+        if ratio is None:
+            limit = simulated + FIXED_GAS_BUFFER
+        else:
+            limit = math.ceil(simulated * ratio) + MIN_HEADROOM
+        floor = self._out_of_gas_floor(msg_type)
+        if floor:
+            limit = max(limit, math.ceil(simulated * floor) + MIN_HEADROOM)
+        return limit
+
+    def remember(self, msg_type, simulated):
+        """Note the latest simulation of `msg_type`, for estimates made without simulating"""
+        self.last_simulated[msg_type] = simulated
+
+    def estimate(self, msg_type, default):
+        """Expected gas limit for `msg_type` from its last simulation, or from `default` gas"""
+        return self.limit(msg_type, self.last_simulated.get(msg_type, default))
+
+    def ratio(self, msg_type):
+        """Actual/simulated gas ratio at the target percentile, or None while still learning"""
+        ratios = self.ratios.get(msg_type)
+        if not ratios or len(ratios) < MIN_SAMPLES:
+            return None
+        ordered = sorted(ratios)
+        index = min(len(ordered) - 1, math.ceil(self.target_percentile * len(ordered)) - 1)
+        return max(1.0, ordered[index])
+
+    def record(self, msg_type, simulated, gas_limit, gas_used, out_of_gas=False):
+        """Feed back the on-chain outcome of a transaction"""
+        if simulated <= 0:
+            return
+        self.transactions[msg_type] = self.transactions.get(msg_type, 0) + 1
+        if out_of_gas:
+            ratio = gas_limit / simulated * OUT_OF_GAS_PENALTY
+            self.out_of_gas[msg_type] = [ratio, self.transactions[msg_type]]
+            metrics.inc("gas_out_of_gas_total", msg_type=msg_type)
+            logger.warning(f"{msg_type} ran out of gas at limit {gas_limit} (simulated {simulated})")
+        else:
+            ratio = gas_used / simulated
+        self.ratios.setdefault(msg_type, deque(maxlen=SAMPLE_WINDOW)).append(ratio)
+        self.saved[msg_type] = self.saved.get(msg_type, 0) + simulated + FIXED_GAS_BUFFER - gas_limit
+
+        metrics.set_gauge("gas_buffer", (self.ratio(msg_type) or 0.0), msg_type=msg_type)
+        metrics.set_gauge("gas_saved", self.saved[msg_type], msg_type=msg_type)
+        self._save()
+
+    def _out_of_gas_floor(self, msg_type):
+        entry = self.out_of_gas.get(msg_type)
+        if entry and self.transactions.get(msg_type, 0) - entry[1] < SAMPLE_WINDOW:
+            return entry[0]
+        return None
+
+    def report(self):
+        """Plain-text per-type buffers and savings for the /perf command"""
+        lines = [f"Gas buffers (p{self.target_percentile * 100:g})  txs  buffer   saved INJ"]
+        for msg_type in sorted(self.transactions):
+            ratio = self.ratio(msg_type)
+            buffer = f"x{ratio:.3f}" if ratio else f"+{FIXED_GAS_BUFFER}"
+            saved = self.saved.get(msg_type, 0) * GAS_PRICE / 10**18
+            lines.append(f"{msg_type[:24]:<24}{self.transactions[msg_type]:>6}{buffer:>9}{saved:>12.6f}")
+        return "\n".join(lines)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading gas statistics {self.path}: {str(e)}")
+            return
+        for msg_type, stats in data.items():
+            self.ratios[msg_type] = deque(stats.get("ratios", []), maxlen=SAMPLE_WINDOW)
+            self.transactions[msg_type] = stats.get("transactions", 0)
+            self.saved[msg_type] = stats.get("saved", 0)
+            if stats.get("out_of_gas"):
+                self.out_of_gas[msg_type] = stats["out_of_gas"]
+            if stats.get("last_simulated"):
+                self.last_simulated[msg_type] = stats["last_simulated"]
+
+    def _save(self):
+        data = {
+            msg_type: {
+                "ratios": list(self.ratios.get(msg_type, ())),
+                "transactions": self.transactions.get(msg_type, 0),
+                "saved": self.saved.get(msg_type, 0),
+                "last_simulated": self.last_simulated.get(msg_type),
+                "out_of_gas": self.out_of_gas.get(msg_type),
+            }
+            for msg_type in self.transactions
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving gas statistics {self.path}: {str(e)}")
+
+
+async def wait_for_tx(client, tx_hash, timeout=CONFIRM_TIMEOUT, interval=CONFIRM_POLL_INTERVAL):
+    """Poll fetch_tx until `tx_hash` is in a block; return its txResponse, or None on timeout"""
+    deadline = time.monotonic() + timeout
+    with track("tx", "confirm"):
+        while True:
+            try:
+                response = await client.fetch_tx(hash=tx_hash)
+                tx_response = response.get("txResponse") if response else None
+                if tx_response and int(tx_response.get("height", 0) or 0) > 0:
+                    return tx_response
+            except RpcError:
+                # NOT_FOUND until the transaction is included
+                pass
+            if time.monotonic() >= deadline:
+                logger.warning(f"Transaction {tx_hash} not confirmed after {timeout}s")
+                return None
+            await asyncio.sleep(interval)
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import time
+from decimal import Decimal
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Default location of the journal file, relative to the working directory
+DEFAULT_JOURNAL_PATH = "strategy_journal.json"
+
+# Seconds after its last recorded step that an unfinished run stops being resumed;
+# by then the chain has likely moved on and a retry should start from scratch
+DEFAULT_RUN_TTL = 3600
+
+metrics.describe("journal_resumed_total", "Strategy runs resumed from a journaled step")
+metrics.describe("journal_expired_total", "Unfinished strategy runs dropped for being older than the run TTL")
+
+
+class StepJournal:
+    """Persistent record of the completed steps of multi-transaction strategy runs.
+
+    Each run is keyed by what it does (e.g. "execute:5" or "close"). A step is
+    recorded as soon as its transaction is broadcast, together with its tx hash
+    and any values later steps need, and the file is rewritten atomically.
+    Starting a run with a key that already has an unfinished run resumes it, so
+    a retry after a failure skips every step that already went through. Runs
+    with no step recorded for `ttl` seconds are dropped rather than resumed.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, ttl=DEFAULT_RUN_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._runs = self._load()
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("STRATEGY_JOURNAL_PATH", DEFAULT_JOURNAL_PATH))
+
+    def begin(self, kind, key=None, **params):
+        """Return the unfinished run for `kind`/`key`, or start a new one with `params`"""
+        run_key = kind if key is None else f"{kind}:{key}"
+        self._expire()
+        entry = self._runs.get(run_key)
+        if entry is not None and entry["steps"]:
+            metrics.inc("journal_resumed_total", kind=kind)
+            logger.info(f"Resuming {run_key} after steps {', '.join(entry['steps'])}")
+            return JournalRun(self, run_key, entry, resumed=True)
+        entry = self._runs[run_key] = {"kind": kind, "params": params, "started_at": time.time(), "steps": {}}
+        return JournalRun(self, run_key, entry, resumed=False)
+
+    def pending(self, kind=None):
+        """Keys of unfinished runs with at least one recorded step, optionally only those of `kind`"""
+        self._expire()
+        return [
+            key for key, entry in self._runs.items()
+            if entry["steps"] and (kind is None or entry["kind"] == kind)
+        ]
+
+    def abandon(self, kind):
+        """Forget every unfinished run of `kind`, e.g. once a close has unwound them"""
+        keys = [key for key, entry in self._runs.items() if entry["kind"] == kind]
+        for key in keys:
+            del self._runs[key]
+        if keys:
+            self._save()
+
+    def _expire(self):
+        now = time.time()
+        expired = [key for key, entry in self._runs.items() if now - _last_activity(entry) > self.ttl]
+        for key in expired:
+            metrics.inc("journal_expired_total", kind=self._runs[key]["kind"])
+            logger.warning("Dropping unfinished %s run, no step recorded for over %ds", key, self.ttl)
+            del self._runs[key]
+        if expired:
+            self._save()
+
+    def _finish(self, run_key):
+        if self._runs.pop(run_key, None) is not None:
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f, object_hook=_decode)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading strategy journal {self.path}: {str(e)}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._runs, f, default=_encode, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class JournalRun:
+    """Steps of one strategy run; see StepJournal"""
+
+    def __init__(self, journal, key, entry, resumed):
+        self.journal = journal
+        self.key = key
+        self.entry = entry
+        self.resumed = resumed
+
+    @property
+    def params(self):
+        return self.entry["params"]
+
+    def completed(self):
+        """Names of the steps recorded so far, in order"""
+        return list(self.entry["steps"])
+
+    def done(self, step):
+        return step in self.entry["steps"]
+
+    def values(self, step):
+        """Values recorded with `step`, or None if it has not completed"""
+        record = self.entry["steps"].get(step)
+        return record["values"] if record else None
+
+    def age(self, step):
+        """Seconds since `step` was recorded"""
+        return time.time() - self.entry["steps"][step]["recorded_at"]
+
+    def record(self, step, tx_hash=None, **values):
+        self.entry["steps"][step] = {"tx_hash": tx_hash, "values": values, "recorded_at": time.time()}
+        self.journal._save()
+
+    def finish(self):
+        """Mark the run complete; it will not be resumed"""
+        self.journal._finish(self.key)
+
+
+def tx_hash_of(result):
+    """Hash of a broadcast_tx_sync_mode response, if it has one"""
+    if isinstance(result, dict):
+        return result.get("txResponse", {}).get("txhash")
+    return None
+
+
+def _last_activity(entry):
+    return max([entry["started_at"]] + [step["recorded_at"] for step in entry["steps"].values()])
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    raise TypeError(f"Cannot journal {type(value).__name__}")
+
+
+def _decode(obj):
+    if set(obj) == {"__decimal__"}:
+        return Decimal(obj["__decimal__"])
+    return obj
@@ -0,0 +1,136 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+
+# Correlation IDs attached to every record logged while they are set
+request_id = contextvars.ContextVar("request_id", default=None)
+tx_id = contextvars.ContextVar("tx_id", default=None)
+
+# Full simulation/broadcast/query payloads are only logged with INJECTIVE_DEBUG=1
+DEBUG_PAYLOADS = os.getenv("INJECTIVE_DEBUG", "0") == "1"
+
+# Chatty third-party loggers kept at WARNING (httpx logs every Bot API request at INFO)
+QUIET_LOGGERS = ("httpx", "httpcore", "apscheduler")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the request and tx IDs of the context that logged them"""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        record.tx_id = tx_id.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler merges `msg % args` before queueing, i.e. on the event
+    loop. Records stay in-process, so they can be queued as they are; only
+    the correlation IDs need capturing here.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including correlation IDs and any payload"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "tx_id", None):
+            entry["tx_id"] = record.tx_id
+        if getattr(record, "payload", None) is not None:
+            entry["payload"] = record.payload
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, followed by correlation IDs and any payload"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        ids = [f"{key}={getattr(record, key)}" for key in ("request_id", "tx_id") if getattr(record, key, None)]
+        if ids:
+            line = f"{line} [{' '.join(ids)}]"
+        if getattr(record, "payload", None) is not None:
+            line = f"{line}\n{record.payload}"
+        return line
+
+
+def setup_logging(level=logging.INFO, fmt="json"):
+    """Route all logging through a queue drained by a background thread.
+
+    Handlers (and message formatting) run on the listener thread, so a log call
+    on the event loop only builds a record and enqueues it. Returns the
+    QueueListener, which is stopped at exit to flush pending records.
+    """
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, level))
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def new_request_id(prefix=None):
+    """Start a new request correlation ID in the current context"""
+    value = f"{prefix}-{uuid.uuid4().hex[:8]}" if prefix is not None else uuid.uuid4().hex[:12]
+    request_id.set(value)
+    return value
+
+
+def with_tx_id(func):
+    """Give every record logged by the wrapped coroutine the same fresh tx ID"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = tx_id.set(uuid.uuid4().hex[:12])
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            tx_id.reset(token)
+    return wrapper
+
+
+def log_payload(logger, label, payload):
+    """Log a full response or request body, only when INJECTIVE_DEBUG is on"""
+    if DEBUG_PAYLOADS and logger.isEnabledFor(logging.INFO):
+        logger.info(label, extra={"payload": payload})
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from metrics import metrics, _quantile
+
+logger = logging.getLogger(__name__)
+
+# How often the heartbeat task asks to be woken; its lateness is the loop lag
+DEFAULT_INTERVAL = 0.1
+
+# A heartbeat this many seconds overdue counts as a blocked loop and gets its stack captured
+DEFAULT_THRESHOLD = 0.25
+
+# Lag samples kept for the exported percentiles (a minute at the default interval)
+LAG_WINDOW = 600
+
+# Seconds between refreshes of the lag percentile gauges
+PUBLISH_INTERVAL = 5
+
+# Blocking episodes kept for /perf, and stack frames kept per episode
+STALL_HISTORY = 10
+STACK_LIMIT = 12
+
+metrics.describe("event_loop_lag_seconds", "Rolling event-loop scheduling lag percentiles")
+metrics.describe("event_loop_stalls_total", "Times the event loop was blocked for longer than the watchdog threshold")
+
+
+class Stall:
+    """One episode of the event loop being blocked, with the stack it was stuck in"""
+
+    def __init__(self, wall_time, stack):
+        self.wall_time = wall_time
+        self.stack = stack
+        self.duration = None
+
+
+class LoopWatchdog:
+    """Measures event-loop lag continuously and catches the code that blocks it.
+
+    A task on the loop sleeps `interval` at a time and records how late it
+    wakes up. A daemon thread watches that heartbeat; once it is more than
+    `threshold` seconds overdue the loop is stuck in synchronous code, so the
+    thread grabs the loop thread's current stack (the blocking frame) and logs
+    it. The episode's duration is filled in when the heartbeat resumes.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, threshold=DEFAULT_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=LAG_WINDOW)
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_publish = loop.time()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(0.0, now - scheduled)
+            self.samples.append(lag)
+            self._heartbeat = time.monotonic()
+            metrics.observe("loop", "lag", lag)
+            if now - last_publish >= PUBLISH_INTERVAL:
+                last_publish = now
+                self._publish()
+
+    def _watch(self):
+        stall = None
+        poll = min(self.interval, self.threshold / 2)
+        while not self._stopped.wait(poll):
+            overdue = time.monotonic() - self._heartbeat - self.interval
+            if overdue > self.threshold and stall is None:
+                stall = self._capture()
+            elif overdue <= self.threshold and stall is not None:
+                # The heartbeat ran again; it recorded the full lag of the stalled tick
+                stall.duration = self.samples[-1] if self.samples else overdue
+                logger.warning("Event loop was blocked for %.3fs", stall.duration)
+                stall = None
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else ""
+        stall = Stall(time.time(), stack)
+        self.stalls.append(stall)
+        metrics.inc("event_loop_stalls_total")
+        logger.warning("Event loop blocked for over %.2fs in:\n%s", self.threshold, stack)
+        return stall
+
+    def _publish(self):
+        ordered = sorted(self.samples)
+        for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)):
+            metrics.set_gauge("event_loop_lag_seconds", _quantile(ordered, q), quantile=label)
+
+    def report(self, limit=3):
+        """Plain-text lag percentiles and the latest blocking stacks for the /perf command"""
+        ordered = sorted(self.samples)
+        lines = [
+            f"Event-loop lag (ms)  p50 {_quantile(ordered, 0.5) * 1000:.1f}  "
+            f"p99 {_quantile(ordered, 0.99) * 1000:.1f}  max {_quantile(ordered, 1.0) * 1000:.1f}"
+        ]
+        for stall in list(self.stalls)[-limit:]:
+            started = time.strftime("%H:%M:%S", time.localtime(stall.wall_time))
+            duration = f"{stall.duration * 1000:.0f}ms" if stall.duration is not None else "ongoing"
+            lines.append(f"Blocked {duration} at {started}:")
+            # The innermost frames are the ones doing the blocking
+            lines.extend(line for line in stall.stack.rstrip().splitlines()[-6:])
+        return "\n".join(lines)
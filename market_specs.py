@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long market specs are trusted before being refreshed from the indexer
+MARKET_SPEC_TTL = 3600
+
+
+class OrderValidationError(ValueError):
+    """Raised when an order would be rejected by the exchange"""
+
+
+class MarketSpec:
+    """Tick, lot and notional constraints of a derivative market"""
+
+    def __init__(self, market_id, ticker, price_tick, quantity_tick, min_notional, quote_decimals,
+                 oracle_base=None, oracle_quote=None, oracle_type=None,
+                 initial_margin_ratio=None, maintenance_margin_ratio=None):
+        self.market_id = market_id
+        self.ticker = ticker
+        self.price_tick = price_tick
+        self.quantity_tick = quantity_tick
+        self.min_notional = min_notional
+        self.quote_decimals = quote_decimals
+        self.oracle_base = oracle_base
+        self.oracle_quote = oracle_quote
+        self.oracle_type = oracle_type
+        self.initial_margin_ratio = initial_margin_ratio
+        self.maintenance_margin_ratio = maintenance_margin_ratio
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_indexer(cls, market):
+        """Build a spec from the `market` entry of a fetch_derivative_market response.
+
+        The indexer reports the price tick and min notional in the quote token's
+        smallest units, while quantities are already human readable.
+        """
+        quote_decimals = int(market.get('quoteTokenMeta', {}).get('decimals', 6))
+        quote_scale = Decimal(10) ** quote_decimals
+        return cls(
+            market_id=market['marketId'],
+            ticker=market.get('ticker', ''),
+            price_tick=Decimal(market['minPriceTickSize']) / quote_scale,
+            quantity_tick=Decimal(market['minQuantityTickSize']),
+            min_notional=Decimal(market.get('minNotional', '0') or '0') / quote_scale,
+            quote_decimals=quote_decimals,
+            oracle_base=market.get('oracleBase'),
+            oracle_quote=market.get('oracleQuote'),
+            oracle_type=market.get('oracleType'),
+            initial_margin_ratio=_optional_decimal(market.get('initialMarginRatio')),
+            maintenance_margin_ratio=_optional_decimal(market.get('maintenanceMarginRatio')),
+        )
+
+    def quantize_price(self, price, order_type):
+        """Round a worst-acceptable price onto the tick grid.
+
+        Buys are rounded up and sells down, so quantizing never makes a
+        market order less likely to fill.
+        """
+        rounding = ROUND_CEILING if order_type == "BUY" else ROUND_FLOOR
+        return _to_tick(Decimal(price), self.price_tick, rounding)
+
+    def quantize_quantity(self, quantity):
+        """Round a quantity down onto the lot grid"""
+        return _to_tick(Decimal(quantity), self.quantity_tick, ROUND_FLOOR)
+
+    def quantize_order(self, price, quantity, order_type):
+        """Quantize and validate an order, returning the (price, quantity) to send"""
+        price = self.quantize_price(price, order_type)
+        quantity = self.quantize_quantity(quantity)
+        self.validate_order(price, quantity)
+        return price, quantity
+
+    def validate_order(self, price, quantity):
+        """Raise OrderValidationError if the exchange would reject this order"""
+        if price <= 0:
+            raise OrderValidationError(f"Price {price} must be positive")
+        if quantity <= 0:
+            raise OrderValidationError(
+                f"Quantity {quantity} is below the minimum quantity tick {self.quantity_tick}"
+            )
+        if price % self.price_tick != 0:
+            raise OrderValidationError(f"Price {price} is not a multiple of tick {self.price_tick}")
+        if quantity % self.quantity_tick != 0:
+            raise OrderValidationError(f"Quantity {quantity} is not a multiple of lot {self.quantity_tick}")
+        notional = price * quantity
+        if notional < self.min_notional:
+            raise OrderValidationError(
+                f"Order notional {notional:.6f} is below the market minimum of {self.min_notional}"
+            )
+
+    def min_quantity_for_notional(self, price):
+        """Smallest quantity on the lot grid that satisfies min notional at `price`"""
+        price = Decimal(price)
+        if price <= 0:
+            raise OrderValidationError(f"Price {price} must be positive")
+        quantity = _to_tick(self.min_notional / price, self.quantity_tick, ROUND_CEILING)
+        return max(quantity, self.quantity_tick)
+
+
+class MarketSpecCache:
+    """Process-wide cache of MarketSpec objects keyed by market ID.
+
+    Concurrent lookups for the same market share a single indexer request.
+    """
+
+    def __init__(self, ttl=MARKET_SPEC_TTL):
+        self.ttl = ttl
+        self._specs = {}
+        self._locks = {}
+
+    def peek(self, market_id):
+        """Return the cached spec without touching the network (may be None)"""
+        return self._specs.get(market_id)
+
+    async def get(self, client, market_id):
+        """Return the spec for `market_id`, loading it from the indexer if needed"""
+        spec = self._specs.get(market_id)
+        if spec and time.monotonic() - spec.loaded_at < self.ttl:
+            metrics.record_cache("market_specs", True)
+            return spec
+        metrics.record_cache("market_specs", False)
+
+        lock = self._locks.setdefault(market_id, asyncio.Lock())
+        async with lock:
+            spec = self._specs.get(market_id)
+            if spec and time.monotonic() - spec.loaded_at < self.ttl:
+                return spec
+            try:
+                response = await client.fetch_derivative_market(market_id=market_id)
+                spec = MarketSpec.from_indexer(response['market'])
+            except Exception as e:
+                if spec:
+                    # A stale spec is still far better than no validation at all
+                    logger.warning(f"Error refreshing market spec for {market_id}, using cached: {str(e)}")
+                    return spec
+                raise
+            self._specs[market_id] = spec
+            logger.info(
+                f"Loaded market spec {spec.ticker}: price tick {spec.price_tick}, "
+                f"quantity tick {spec.quantity_tick}, min notional {spec.min_notional}"
+            )
+            return spec
+
+
+def _to_tick(value, tick, rounding):
+    if tick <= 0:
+        return value
+    return (value / tick).to_integral_value(rounding=rounding) * tick
+
+
+def _optional_decimal(value):
+    return Decimal(value) if value not in (None, '') else None
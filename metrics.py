@@ -0,0 +1,316 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "perp_prophet"
+
+# Latency buckets in seconds, spanning cache hits up to slow tx confirmations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Number of recent samples per series used for rolling percentiles
+ROLLING_WINDOW = 500
+
+# Number of recent request traces kept for the slowest-request breakdown
+TRACE_HISTORY = 200
+
+# Spans kept per trace; long multi-step handlers beyond this are truncated
+MAX_TRACE_SPANS = 100
+
+
+class Histogram:
+    """Cumulative latency histogram for one label set"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Thread-safe store of latency histograms, counters and gauges.
+
+    Every series is keyed by metric name plus a sorted tuple of label pairs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._recent = {}
+        self._traces = deque(maxlen=TRACE_HISTORY)
+
+    def describe(self, name, help_text):
+        """Register the HELP text for a counter or gauge"""
+        self._help[name] = help_text
+
+    def observe(self, kind, name, seconds, error=False):
+        """Record one call of `name` (e.g. a handler or chain query) taking `seconds`"""
+        key = (("kind", kind), ("name", name))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+            recent = self._recent.get(key)
+            if recent is None:
+                recent = self._recent[key] = deque(maxlen=ROLLING_WINDOW)
+            recent.append(seconds)
+            if error:
+                self._counters[("errors_total", key)] = self._counters.get(("errors_total", key), 0) + 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def record_cache(self, cache, hit):
+        """Count a lookup against `cache` as a hit or a miss"""
+        self.inc("cache_hits_total" if hit else "cache_misses_total", cache=cache)
+
+    def record_trace(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """Rolling percentiles per series: {(kind, name): (count, [p...])}"""
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self._recent.items()}
+        result = {}
+        for key, values in snapshot.items():
+            result[(key[0][1], key[1][1])] = (len(values), [_quantile(values, q) for q in quantiles])
+        return result
+
+    def cache_rates(self):
+        """Hit rate per cache: {cache: (hits, misses)}"""
+        rates = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if name in ("cache_hits_total", "cache_misses_total"):
+                    cache = dict(labels).get("cache", "")
+                    hits, misses = rates.get(cache, (0, 0))
+                    if name == "cache_hits_total":
+                        hits += value
+                    else:
+                        misses += value
+                    rates[cache] = (hits, misses)
+        return rates
+
+    def slowest_traces(self, limit=5):
+        with self._lock:
+            traces = list(self._traces)
+        return sorted(traces, key=lambda trace: trace.duration or 0, reverse=True)[:limit]
+
+    def render(self):
+        """Render every series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metric = f"{METRIC_PREFIX}_latency_seconds"
+            lines.append(f"# HELP {metric} Latency of handlers, chain queries, tx stages and iAgent calls")
+            lines.append(f"# TYPE {metric} histogram")
+            for key, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_labels(key + (('le', _format_bound(bound)),))} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels(key)} {histogram.total}")
+                lines.append(f"{metric}_count{_labels(key)} {histogram.count}")
+
+            self._help.setdefault("errors_total", "Failed handler, query, tx stage and iAgent calls")
+            for series, kind in ((self._counters, "counter"), (self._gauges, "gauge")):
+                for name in sorted({name for name, _ in series}):
+                    metric = f"{METRIC_PREFIX}_{name}"
+                    if name in self._help:
+                        lines.append(f"# HELP {metric} {self._help[name]}")
+                    lines.append(f"# TYPE {metric} {kind}")
+                    for (series_name, key), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{metric}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Trace of the update currently being handled (one per asyncio task)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    """Timing of one tracked call; set `failed` to count it as an error without raising"""
+
+    def __init__(self, kind, name, depth=0):
+        self.kind = kind
+        self.name = name
+        self.depth = depth
+        self.failed = False
+        self.started = time.perf_counter()
+        self.duration = None
+
+
+class Trace:
+    """All spans recorded while handling one request, in start order"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.duration = None
+        self.spans = []
+        self.depth = 0
+
+
+@contextmanager
+def track(kind, name):
+    """Time the enclosed block and record it under (kind, name).
+
+    A handler span with no trace in progress starts a new request trace;
+    every span inside it is attached to that trace for the /perf breakdown.
+    """
+    trace = _current_trace.get()
+    token = None
+    if trace is None and kind == "handler":
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+
+    span = Span(kind, name, depth=trace.depth if trace else 0)
+    if trace:
+        if len(trace.spans) < MAX_TRACE_SPANS:
+            trace.spans.append(span)
+        trace.depth += 1
+    try:
+        yield span
+    except BaseException as e:
+        span.failed = not isinstance(e, asyncio.CancelledError)
+        raise
+    finally:
+        span.duration = time.perf_counter() - span.started
+        metrics.observe(kind, name, span.duration, error=span.failed)
+        if trace:
+            trace.depth -= 1
+        if token is not None:
+            trace.duration = span.duration
+            metrics.record_trace(trace)
+            _current_trace.reset(token)
+
+
+def timed(kind, name=None):
+    """Decorator recording latency and errors of a sync or async function"""
+    def decorator(func):
+        label = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(kind, label):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(kind, label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedClient:
+    """Proxy around AsyncClient that times every fetch_* call"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if attr.startswith("fetch_") and asyncio.iscoroutinefunction(value):
+            return timed("chain", attr)(value)
+        return value
+
+
+async def start_metrics_server(host, port):
+    """Serve /metrics in Prometheus text format; returns the runner for cleanup"""
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
+
+
+def format_perf_report(limit=5):
+    """Plain-text latency, cache and slow-request summary for the /perf command"""
+    lines = ["Rolling latency (ms)          n     p50     p95     p99"]
+    for (kind, name), (count, (p50, p95, p99)) in sorted(metrics.percentiles().items()):
+        label = f"{kind}:{name}"[:26]
+        lines.append(f"{label:<26}{count:>6}{p50 * 1000:>8.0f}{p95 * 1000:>8.0f}{p99 * 1000:>8.0f}")
+
+    cache_rates = metrics.cache_rates()
+    if cache_rates:
+        lines.append("")
+        lines.append("Cache hit rates")
+        for cache, (hits, misses) in sorted(cache_rates.items()):
+            total = hits + misses
+            lines.append(f"{cache:<26}{hits}/{total} ({hits / total * 100 if total else 0:.1f}%)")
+
+    slowest = metrics.slowest_traces(limit)
+    if slowest:
+        lines.append("")
+        lines.append(f"Slowest of last {TRACE_HISTORY} requests")
+        for trace in slowest:
+            started = time.strftime("%H:%M:%S", time.localtime(trace.wall_time))
+            lines.append(f"{trace.name} {trace.duration * 1000:.0f}ms at {started}")
+            for span in trace.spans[1:]:
+                offset = (span.started - trace.started) * 1000
+                duration = span.duration * 1000 if span.duration is not None else 0
+                marker = " !" if span.failed else ""
+                lines.append(f"{'  ' * span.depth}+{offset:.0f}ms {span.kind}:{span.name} {duration:.0f}ms{marker}")
+    return "\n".join(lines)
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_bound(bound):
+    return repr(float(bound))
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting a dropped orderbook stream
+STREAM_RECONNECT_DELAY = 5
+
+
+class OrderBook:
+    """In-memory L2 order book for one derivative market.
+
+    Prices are kept in human units (USDT), quantities in base units (INJ).
+    """
+
+    def __init__(self, market_id, price_scale):
+        self.market_id = market_id
+        self.price_scale = Decimal(price_scale)
+        self.bids = {}
+        self.asks = {}
+        self.sequence = 0
+        self.synced = False
+        self.updated_at = None
+
+    def apply_snapshot(self, buys, sells, sequence):
+        """Replace the book with a full snapshot"""
+        self.bids = {}
+        self.asks = {}
+        self._apply_levels(self.bids, buys)
+        self._apply_levels(self.asks, sells)
+        self.sequence = int(sequence)
+        self.synced = True
+        self.updated_at = time.monotonic()
+
+    def apply_update(self, buys, sells, sequence):
+        """Apply an incremental level update.
+
+        Returns False when the update does not directly follow the current
+        sequence, meaning the book must be re-synced from a snapshot.
+        """
+        sequence = int(sequence)
+        if sequence <= self.sequence:
+            return True  # Already reflected in the snapshot
+        if not self.synced or sequence != self.sequence + 1:
+            self.synced = False
+            return False
+        self._apply_levels(self.bids, buys)
+        self._apply_levels(self.asks, sells)
+        self.sequence = sequence
+        self.updated_at = time.monotonic()
+        return True
+
+    def best_bid(self):
+        return max(self.bids) if self.bids else None
+
+    def best_ask(self):
+        return min(self.asks) if self.asks else None
+
+    def sweep(self, order_type, quantity):
+        """Walk the book to fill `quantity` with a market order.
+
+        Returns (worst_price, average_price), or None if there is not enough
+        depth on the opposite side of the book.
+        """
+        if order_type == "BUY":
+            levels = sorted(self.asks.items())
+        else:
+            levels = sorted(self.bids.items(), reverse=True)
+
+        remaining = Decimal(quantity)
+        cost = Decimal(0)
+        for price, level_quantity in levels:
+            filled = min(remaining, level_quantity)
+            cost += filled * price
+            remaining -= filled
+            if remaining <= 0:
+                return price, cost / Decimal(quantity)
+        return None
+
+    def _apply_levels(self, side, levels):
+        for level in levels:
+            price = Decimal(level['price']) / self.price_scale
+            quantity = Decimal(level['quantity'])
+            if quantity <= 0 or level.get('isActive', True) is False:
+                side.pop(price, None)
+            else:
+                side[price] = quantity
+
+
+class OrderBookManager:
+    """Keeps an OrderBook per tracked market current from the indexer stream"""
+
+    def __init__(self):
+        self._books = {}
+        self._tasks = {}
+
+    def track(self, client, market_id, price_scale):
+        """Start streaming `market_id` in the background (no-op if already tracked)"""
+        if market_id in self._tasks:
+            return
+        self._books[market_id] = OrderBook(market_id, price_scale)
+        self._tasks[market_id] = asyncio.create_task(self._run(client, market_id))
+
+    async def stop(self):
+        """Cancel all stream tasks"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks = {}
+
+    def get(self, market_id):
+        """Return the book for `market_id` if it is live and in sync, otherwise None"""
+        book = self._books.get(market_id)
+        if book and book.synced:
+            return book
+        return None
+
+    def closing_price(self, market_id, order_type, quantity, price_buffer=0.001):
+        """Worst acceptable price for a market order of `quantity`, from local depth.
+
+        The deepest level the order would reach is padded by `price_buffer`.
+        Returns None when the book is unavailable or too thin, in which case the
+        caller should fall back to querying the exchange.
+        """
+        book = self.get(market_id)
+        fill = book.sweep(order_type, Decimal(str(quantity))) if book else None
+        metrics.record_cache("orderbook", fill is not None)
+        if not fill:
+            return None
+        worst_price, average_price = fill
+        buffer = Decimal(str(price_buffer))
+        if order_type == "BUY":
+            return worst_price * (1 + buffer), average_price
+        return worst_price * (1 - buffer), average_price
+
+    async def _run(self, client, market_id):
+        book = self._books[market_id]
+        while True:
+            try:
+                await self._resync(client, book)
+
+                async def on_update(event):
+                    update = event.get('orderbookLevelUpdates', {})
+                    if update.get('marketId') != market_id:
+                        return
+                    if not book.apply_update(update.get('buys', []), update.get('sells', []), update['sequence']):
+                        logger.info(f"Orderbook sequence gap for {market_id}, re-syncing")
+                        await self._resync(client, book)
+
+                await client.listen_derivative_orderbook_updates(
+                    callback=on_update,
+                    market_ids=[market_id],
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Orderbook stream for {market_id} failed: {str(e)}")
+            book.synced = False
+            await asyncio.sleep(STREAM_RECONNECT_DELAY)
+
+    async def _resync(self, client, book):
+        response = await client.fetch_derivative_orderbooks_v2(market_ids=[book.market_id])
+        for entry in response.get('orderbooks', []):
+            if entry.get('marketId') == book.market_id:
+                snapshot = entry['orderbook']
+                book.apply_snapshot(snapshot.get('buys', []), snapshot.get('sells', []), snapshot.get('sequence', 0))
+                return
+        raise ValueError(f"No orderbook snapshot returned for {book.market_id}")
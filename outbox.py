@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+from metrics import metrics, track
+
+logger = logging.getLogger(__name__)
+
+# Bot API limits: about 30 messages per second overall and one per second per chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+# Times a request is retried after Telegram answers with RetryAfter
+MAX_RETRIES = 3
+
+# Per-chat buckets idle for longer than this are dropped (they would be full again anyway)
+BUCKET_IDLE_TTL = 60
+
+metrics.describe("outbox_pending", "Outbound Telegram requests waiting to be sent")
+metrics.describe("outbox_coalesced_total", "Message edits replaced by a newer edit before being sent")
+metrics.describe("telegram_retry_after_total", "Bot API requests rejected with RetryAfter")
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = self.paused_until - now
+            if wait <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(max(wait, (1 - self.tokens) / self.rate))
+
+    def pause(self, seconds):
+        """Hold every acquisition for `seconds`, e.g. after a RetryAfter"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _Job:
+    def __init__(self, name, call, kwargs, coalesce_key):
+        self.name = name
+        self.call = call
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued = time.perf_counter()
+
+
+class MessageOutbox:
+    """Rate-limited queue for outbound Bot API calls.
+
+    Requests are delivered per chat in the order they were queued, throttled by
+    a per-chat and a global token bucket. An edit queued while an older edit of
+    the same message is still waiting replaces it, so bursts of status updates
+    collapse into the latest one. RetryAfter responses pause the chat and retry.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_retries=MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._queues = {}
+        self._workers = {}
+
+    async def send_message(self, bot, chat_id, text, **kwargs):
+        """Queue a sendMessage and wait for the sent Message"""
+        return await self._enqueue(chat_id, "send_message", bot.send_message, dict(chat_id=chat_id, text=text, **kwargs))
+
+    async def edit(self, message, text, **kwargs):
+        """Queue an edit of `message` and wait for the edited Message"""
+        return await self._enqueue_edit(message, text, kwargs)
+
+    def post_edit(self, message, text, **kwargs):
+        """Queue an edit of `message` without waiting, e.g. for progress updates.
+
+        Failures are logged rather than raised.
+        """
+        future = self._enqueue_edit(message, text, kwargs)
+        future.add_done_callback(_log_failure)
+        return future
+
+    async def delete(self, message):
+        """Queue a deletion of `message` and wait for it"""
+        return await self._enqueue(message.chat_id, "delete_message", message.get_bot().delete_message,
+                                   dict(chat_id=message.chat_id, message_id=message.message_id))
+
+    async def stop(self, timeout=10):
+        """Give queued requests up to `timeout` seconds to go out, then cancel the rest"""
+        workers = list(self._workers.values())
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _enqueue_edit(self, message, text, kwargs):
+        chat_id = message.chat_id
+        kwargs = dict(chat_id=chat_id, message_id=message.message_id, text=text, **kwargs)
+        return self._enqueue(chat_id, "edit_message_text", message.get_bot().edit_message_text, kwargs,
+                             coalesce_key=("edit", message.message_id))
+
+    def _enqueue(self, chat_id, name, call, kwargs, coalesce_key=None):
+        queue = self._queues.setdefault(chat_id, deque())
+        if coalesce_key and queue and queue[-1].coalesce_key == coalesce_key:
+            job = queue[-1]
+            job.kwargs = kwargs
+            metrics.inc("outbox_coalesced_total")
+            return job.future
+
+        job = _Job(name, call, kwargs, coalesce_key)
+        queue.append(job)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        self._publish()
+        return job.future
+
+    async def _drain(self, chat_id):
+        queue = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        try:
+            while queue:
+                job = queue.popleft()
+                self._publish()
+                try:
+                    await self._deliver(bucket, job)
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+        finally:
+            for job in queue:
+                job.future.cancel()
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+            self._publish()
+
+    async def _deliver(self, bucket, job):
+        for attempt in range(self.max_retries + 1):
+            # A caller that stopped waiting (e.g. a superseded edit) no longer wants the send
+            if job.future.done():
+                return
+            await bucket.acquire()
+            await self._global.acquire()
+            if attempt == 0:
+                metrics.observe("queue", "outbox_wait", time.perf_counter() - job.queued)
+            try:
+                with track("telegram", job.name):
+                    result = await job.call(**job.kwargs)
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                metrics.inc("telegram_retry_after_total")
+                if attempt == self.max_retries:
+                    _resolve(job.future, exception=e)
+                    return
+                logger.warning(f"Telegram flood limit on {job.name}, retrying in {delay}s")
+                bucket.pause(delay)
+            except Exception as e:
+                _resolve(job.future, exception=e)
+                return
+            else:
+                _resolve(job.future, result)
+                return
+
+    def _bucket(self, chat_id):
+        now = time.monotonic()
+        for idle_chat in [c for c, b in self._buckets.items() if now - b.updated > BUCKET_IDLE_TTL]:
+            if idle_chat not in self._workers:
+                del self._buckets[idle_chat]
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _publish(self):
+        metrics.set_gauge("outbox_pending", sum(len(queue) for queue in self._queues.values()))
+
+
+def _seconds(retry_after):
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _resolve(future, result=None, exception=None):
+    # The caller may have cancelled the future while the request was in flight
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception():
+        logger.error(f"Error sending queued Telegram update: {str(future.exception())}")
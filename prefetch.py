@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Speculative loads allowed to run at once; beyond this new ones are skipped, never queued
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Seconds a prefetch waits to be claimed before it is cancelled and dropped
+DEFAULT_TTL = 30
+
+metrics.describe("prefetch_in_flight", "Speculative prefetches currently loading")
+metrics.describe("prefetch_total", "Speculative prefetches by outcome (started, used, unused, skipped, failed)")
+
+
+class Prefetcher:
+    """Runs speculative loads in the background, one per key, until they are claimed.
+
+    A handler that expects a follow-up click starts a prefetch for its chat; the
+    follow-up claims it and awaits the result instead of loading from scratch.
+    Prefetches nobody claims within `ttl` seconds are cancelled, and at most
+    `max_in_flight` run at once so speculation never competes with real work.
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, ttl=DEFAULT_TTL):
+        self.max_in_flight = max_in_flight
+        self.ttl = ttl
+        self._entries = {}
+
+    def start(self, key, load):
+        """Start `load()` for `key` unless one is already pending or the cap is reached"""
+        if key in self._entries:
+            return False
+        if self.in_flight() >= self.max_in_flight:
+            metrics.inc("prefetch_total", outcome="skipped")
+            return False
+        task = asyncio.create_task(load())
+        task.add_done_callback(self._finished)
+        expiry = asyncio.get_running_loop().call_later(self.ttl, self._expire, key, task)
+        self._entries[key] = (task, expiry)
+        metrics.inc("prefetch_total", outcome="started")
+        self._publish()
+        return True
+
+    async def claim(self, key):
+        """Wait for the prefetch for `key` and return whether it completed successfully"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        task, expiry = entry
+        expiry.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            return False
+        except Exception as e:
+            logger.warning(f"Prefetch for {key} failed: {str(e)}")
+            return False
+        metrics.inc("prefetch_total", outcome="used")
+        return True
+
+    def discard(self, key):
+        """Cancel and drop the prefetch for `key`, if any"""
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._cancel(*entry)
+
+    def in_flight(self):
+        return sum(1 for task, _ in self._entries.values() if not task.done())
+
+    async def stop(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            self._cancel(*entry)
+        await asyncio.gather(*(task for task, _ in entries), return_exceptions=True)
+
+    def _expire(self, key, task):
+        entry = self._entries.get(key)
+        if entry and entry[0] is task:
+            del self._entries[key]
+            self._cancel(*entry)
+
+    def _cancel(self, task, expiry):
+        expiry.cancel()
+        task.cancel()
+        metrics.inc("prefetch_total", outcome="unused")
+        self._publish()
+
+    def _finished(self, task):
+        if not task.cancelled() and task.exception():
+            metrics.inc("prefetch_total", outcome="failed")
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("prefetch_in_flight", self.in_flight())
@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+
+from metrics import metrics, track
+
+logger = logging.getLogger(__name__)
+
+# Seconds a queried INJ/USDT price pair is served to every handler
+DEFAULT_PRICE_TTL = 5
+
+# With stream feeding: seconds a streamed INJ/USDT tick stays usable, and how long the
+# queried USDT price it is converted with may be reused
+STREAM_PRICE_TTL = 10
+USDT_PRICE_TTL = 300
+
+USDT_DENOM = "peggy0xdAC17F958D2ee523a2206206994597C13D831ec7"
+
+# Neptune oracle query for the two prices the strategy needs
+PRICE_QUERY = json.dumps({
+    "get_prices": {
+        "assets": [
+            {"native_token": {"denom": "inj"}},
+            {"native_token": {"denom": USDT_DENOM}},
+        ]
+    }
+})
+
+metrics.describe("oracle_price_loads_total", "Neptune oracle price queries by outcome")
+
+
+def parse_prices(prices_data):
+    """INJ and USDT USD prices from a Neptune get_prices response (0 for a missing asset)"""
+    inj_price = 0
+    usdt_price = 0
+    for asset, price_info in prices_data:
+        denom = asset.get('native_token', {}).get('denom', '')
+        if denom == 'inj':
+            inj_price = float(price_info['price'])
+        elif 'peggy' in denom:
+            usdt_price = float(price_info['price'])
+    return inj_price, usdt_price
+
+
+class OraclePriceCache:
+    """Process-wide INJ and USDT prices from the Neptune oracle, shared by every handler.
+
+    A price pair is reused for `ttl` seconds. Lookups that miss while a query
+    is already running wait for that query instead of sending their own, so
+    one oracle call serves every concurrent view; a caller that gives up (e.g.
+    on its own deadline) does not cancel it for the others. With stream ticks
+    fed in through on_stream_price, the INJ price between queries is the
+    streamed INJ/USDT price times the last queried USDT price.
+    """
+
+    def __init__(self, oracle_address, ttl=DEFAULT_PRICE_TTL):
+        self.oracle_address = oracle_address
+        self.ttl = ttl
+        self.prices = None
+        self.loaded_at = float('-inf')
+        self.stream_price = None
+        self.stream_at = float('-inf')
+        self._pending = None
+
+    def peek(self):
+        """The cached (inj_price, usdt_price) if still fresh, without touching the network (may be None)"""
+        now = time.monotonic()
+        if self.prices and now - self.loaded_at < self.ttl:
+            return self.prices
+        if self.prices and now - self.stream_at < STREAM_PRICE_TTL and now - self.loaded_at < USDT_PRICE_TTL:
+            usdt_price = self.prices[1]
+            return self.stream_price * usdt_price, usdt_price
+        return None
+
+    async def get(self, client):
+        """(inj_price, usdt_price) in USD, queried through `client` unless a fresh pair is cached"""
+        prices = self.peek()
+        metrics.record_cache("oracle_prices", prices is not None)
+        if prices is not None:
+            return prices
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._load(client))
+            self._pending.add_done_callback(self._loaded)
+        return await asyncio.shield(self._pending)
+
+    def on_stream_price(self, price):
+        """Apply a streamed INJ/USDT oracle price"""
+        self.stream_price = price
+        self.stream_at = time.monotonic()
+
+    async def _load(self, client):
+        started = time.monotonic()
+        try:
+            with track("query", "oracle_prices"):
+                response = await client.fetch_smart_contract_state(address=self.oracle_address, query_data=PRICE_QUERY)
+            prices = parse_prices(json.loads(base64.b64decode(response["data"])))
+        except Exception:
+            metrics.inc("oracle_price_loads_total", outcome="error")
+            raise
+        metrics.inc("oracle_price_loads_total", outcome="ok")
+        # Age from when the query was sent, so the pair is never served past the oracle state it reflects
+        self.prices, self.loaded_at = prices, started
+        return prices
+
+    def _loaded(self, future):
+        self._pending = None
+        if not future.cancelled() and future.exception() is not None:
+            # Waiters that are still around see the error themselves; this keeps an
+            # abandoned load from warning about a never-retrieved exception
+            logger.warning("Oracle price query failed: %r", future.exception())
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from metrics import metrics
+from risk import health_factor, hedge_ratio
+
+logger = logging.getLogger(__name__)
+
+# Hedge ratio (collateral as a percentage of the short) outside which the short is resized,
+# and the ratio a resize aims for
+HEDGE_BAND = (95.0, 105.0)
+TARGET_HEDGE_RATIO = 100.0
+
+# Health factor below which USDT debt is partially repaid, and the factor the repay aims for
+MIN_HEALTH_FACTOR = 1.3
+TARGET_HEALTH_FACTOR = 1.5
+
+# Borrows and repays smaller than this many USDT are not worth a message
+MIN_ADJUSTMENT_USDT = 1.0
+
+# Churn limits: seconds between rebalance attempts and executed rebalances per rolling day
+MIN_REBALANCE_INTERVAL = 3600
+MAX_REBALANCES_PER_DAY = 4
+
+# Seconds between balance refreshes, and how long refreshed balances are trusted for a rebalance
+CHECK_INTERVAL = 300
+FRESH_INPUTS = 10
+
+metrics.describe("rebalances_total", "Auto-rebalance transactions by outcome")
+metrics.describe("rebalance_skipped_total", "Out-of-band positions left alone, by reason")
+
+
+def plan_rebalance(inj_collateral, short_quantity, inj_price, usdt_price, usdt_debt, liquidation_ltv,
+                   usdt_available, margin_ratio, band=HEDGE_BAND, target_ratio=TARGET_HEDGE_RATIO,
+                   min_health=MIN_HEALTH_FACTOR, target_health=TARGET_HEALTH_FACTOR):
+    """Smallest set of adjustments that brings the hedge ratio and health factor back in band.
+
+    A hedge ratio outside `band` resizes the short to `target_ratio`: a reduce-only
+    BUY when the short exceeds the collateral (under-hedged, ratio below the band),
+    or a SELL when the collateral exceeds the short (over-hedged, as report.py's
+    over_hedged_amount counts it), whose margin (`margin_ratio` of its notional, as
+    when the strategy was opened) is borrowed. A health factor
+    below `min_health`, counting any new borrow, drops that borrow and its SELL and
+    instead repays debt towards `target_health`, out of at most `usdt_available`
+    USDT. Amounts are in INJ and USDT; the order quantity is not yet quantized.
+    """
+    plan = {
+        'inj_price': inj_price,
+        'order_type': None,
+        'quantity': 0.0,
+        'margin': 0.0,
+        'borrow': 0.0,
+        'repay': 0.0,
+        'hedge_ratio': hedge_ratio(inj_collateral, short_quantity),
+        'health_factor': health_factor(inj_collateral, inj_price, liquidation_ltv, usdt_debt * usdt_price),
+        'notes': [],
+    }
+    ratio = plan['hedge_ratio']
+    if short_quantity > 0 and not band[0] <= ratio <= band[1]:
+        delta = inj_collateral * 100 / target_ratio - short_quantity
+        if delta < 0:
+            plan['order_type'], plan['quantity'] = "BUY", -delta
+        else:
+            plan['order_type'], plan['quantity'] = "SELL", delta
+            plan['margin'] = delta * inj_price * margin_ratio / usdt_price
+            # Margin too small to be worth a borrow comes out of the wallet
+            plan['borrow'] = plan['margin'] if plan['margin'] >= MIN_ADJUSTMENT_USDT else 0.0
+
+    health = health_factor(inj_collateral, inj_price, liquidation_ltv, (usdt_debt + plan['borrow']) * usdt_price)
+    if health is not None and health < min_health:
+        if plan['borrow']:
+            plan['notes'].append(f"short increase skipped: borrowing its margin would leave HF {health:.2f}")
+            plan['order_type'], plan['quantity'], plan['margin'], plan['borrow'] = None, 0.0, 0.0, 0.0
+        target_debt = inj_collateral * inj_price * liquidation_ltv / (target_health * usdt_price)
+        repay = usdt_debt - target_debt
+        if repay > usdt_available:
+            plan['notes'].append(f"repay capped at the {usdt_available:.2f} USDT in the wallet (needed {repay:.2f})")
+            repay = usdt_available
+        plan['repay'] = repay if repay >= MIN_ADJUSTMENT_USDT else 0.0
+
+    plan['health_after'] = health_factor(
+        inj_collateral, inj_price, liquidation_ltv, (usdt_debt + plan['borrow'] - plan['repay']) * usdt_price
+    )
+    return plan
+
+
+def plan_summary(plan):
+    """One-line description of a plan's actions, e.g. for logs and admin notices"""
+    actions = []
+    if plan['repay']:
+        actions.append(f"repay {plan['repay']:.2f} USDT")
+    if plan['borrow']:
+        actions.append(f"borrow {plan['borrow']:.2f} USDT")
+    if plan['order_type']:
+        actions.append(f"{plan['order_type']} {plan['quantity']:.4f} INJ")
+    return ", ".join(actions) or "nothing"
+
+
+class Rebalancer:
+    """Keeps the bot wallet's hedge ratio and health factor in band, driven by the risk engine.
+
+    Every risk engine reprice (oracle tick or balance update) is checked
+    against HEDGE_BAND and MIN_HEALTH_FACTOR; balances are also refreshed every
+    CHECK_INTERVAL so the check does not depend on someone opening a view. An
+    out-of-band position is re-read, planned with plan_rebalance and handed to
+    `execute(plan)`, which sends all of the plan's messages in one transaction.
+    Attempts are at least MIN_REBALANCE_INTERVAL apart and at most
+    MAX_REBALANCES_PER_DAY execute, so a position hovering at a band edge is
+    not traded back and forth.
+
+    `refresh()` reloads balances into the engine and returns the wallet's spare
+    USDT; `lock()` is held around each rebalance to keep it apart from other
+    wallet transactions; `busy()` is true while an invest or close run is
+    unfinished; `notify(plan, result)` reports each executed rebalance.
+    """
+
+    def __init__(self, engine, refresh, execute, margin_ratio, lock=nullcontext, busy=lambda: False,
+                 notify=None, min_interval=MIN_REBALANCE_INTERVAL, max_per_day=MAX_REBALANCES_PER_DAY):
+        self.engine = engine
+        self.refresh = refresh
+        self.execute = execute
+        self.margin_ratio = margin_ratio
+        self.lock = lock
+        self.busy = busy
+        self.notify = notify
+        self.min_interval = min_interval
+        self.max_per_day = max_per_day
+        self.executed = deque()
+        self.last_attempt = float('-inf')
+        self.usdt_available = 0.0
+        self.refreshed_at = float('-inf')
+        self._task = None
+        self._poll_task = None
+
+    def start(self):
+        if self._poll_task is None:
+            self.engine.listeners.append(self.check)
+            self._poll_task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self.check in self.engine.listeners:
+            self.engine.listeners.remove(self.check)
+        for task in (self._poll_task, self._task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._poll_task = self._task = None
+
+    def out_of_band(self, risk):
+        ratio = risk.get('hedge_ratio')
+        health = risk.get('health_factor')
+        if ratio and not HEDGE_BAND[0] <= ratio <= HEDGE_BAND[1]:
+            return True
+        return health is not None and health < MIN_HEALTH_FACTOR
+
+    def throttled(self):
+        """Why a rebalance may not start now, or None"""
+        now = time.monotonic()
+        if now - self.last_attempt < self.min_interval:
+            return "interval"
+        while self.executed and now - self.executed[0] > 86400:
+            self.executed.popleft()
+        if len(self.executed) >= self.max_per_day:
+            return "daily_limit"
+        return None
+
+    def check(self, risk):
+        """Risk engine listener: start a rebalance if the position left its band and limits allow"""
+        if self._task is not None and not self._task.done():
+            return
+        if self.out_of_band(risk) and self.throttled() is None:
+            self._task = asyncio.create_task(self._rebalance())
+
+    async def _poll(self):
+        while True:
+            try:
+                await self._refresh()
+                risk = self.engine.current()
+                if risk and self.out_of_band(risk):
+                    reason = self.throttled()
+                    if reason:
+                        metrics.inc("rebalance_skipped_total", reason=reason)
+                        logger.info("Position out of band, rebalance deferred (%s)", reason)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Rebalancer balance refresh failed: %s", e)
+            await asyncio.sleep(CHECK_INTERVAL)
+
+    async def _refresh(self):
+        self.usdt_available = await self.refresh()
+        self.refreshed_at = time.monotonic()
+
+    async def _rebalance(self):
+        async with self.lock():
+            self.last_attempt = time.monotonic()
+            if self.busy():
+                metrics.inc("rebalance_skipped_total", reason="run_pending")
+                logger.info("Rebalance skipped: an invest or close run is unfinished")
+                return
+            try:
+                if time.monotonic() - self.refreshed_at > FRESH_INPUTS:
+                    await self._refresh()
+                plan = self.plan()
+                if plan is None:
+                    metrics.inc("rebalance_skipped_total", reason="back_in_band")
+                    return
+                for note in plan['notes']:
+                    logger.warning("Rebalance: %s", note)
+                if not (plan['order_type'] or plan['borrow'] or plan['repay']):
+                    metrics.inc("rebalance_skipped_total", reason="nothing_to_do")
+                    return
+                logger.info("Rebalancing: %s", plan_summary(plan))
+                result = await self.execute(plan)
+            except Exception as e:
+                metrics.inc("rebalances_total", outcome="error")
+                logger.error("Rebalance failed: %s", e)
+                return
+            if not result:
+                metrics.inc("rebalances_total", outcome="failed")
+                logger.error("Rebalance transaction failed: %s", plan_summary(plan))
+                return
+            self.executed.append(time.monotonic())
+            metrics.inc("rebalances_total", outcome="ok")
+        # Force a reload, so the next check sees the position as it is now
+        self.refreshed_at = float('-inf')
+        if self.notify:
+            await self.notify(plan, result)
+
+    def plan(self):
+        """Plan for the engine's current inputs, or None if the position is back in band"""
+        engine = self.engine
+        risk = engine.current()
+        if not risk or not self.out_of_band(risk) or engine.liquidation_ltv is None:
+            return None
+        position = engine.position
+        short_quantity = position['quantity'] if position and position['direction'] == "Short" else 0.0
+        return plan_rebalance(
+            engine.inj_collateral, short_quantity, risk['inj_price'], risk['usdt_price'], engine.usdt_debt,
+            engine.liquidation_ltv, self.usdt_available, self.margin_ratio,
+        )
@@ -0,0 +1,546 @@
+import hashlib
+import html
+import re
+from string import Formatter
+
+import risk
+import stress
+
+# Telegram rejects messages over 4096 characters; leave room for continuation notes
+MAX_MESSAGE_LENGTH = 4000
+CONTINUED_NOTE = "\n(continued in next message)"
+
+
+class Template:
+    """A str.format template parsed once at import time.
+
+    String values are HTML-escaped when rendered; numbers are formatted as-is.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._parts = [
+            (literal, field, spec)
+            for literal, field, spec, _ in Formatter().parse(source)
+        ]
+
+    def render(self, **values):
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                value = values[field]
+                if isinstance(value, str):
+                    value = html.escape(value)
+                out.append(format(value, spec))
+        return "".join(out)
+
+
+def _templates(**sources):
+    return {name: Template(source) for name, source in sources.items()}
+
+
+T = _templates(
+    header="<b>=== {title} ===</b>",
+    stale="⏳ {label} timed out; showing values from {age} ago",
+    inj_price="INJ Price: ${inj_price:.2f}",
+    usdt_price="USDT Price: ${usdt_price:.2f}",
+    inj_collateral="INJ Collateral: {inj_collateral} INJ (${inj_collateral_value:.2f})",
+    usdt_debt="USDT Debt: {usdt_debt} USDT (${usdt_debt_value:.2f})",
+    health_factor="Health Factor: {health_factor:.4f}",
+    liquidation_threshold="Liquidation Threshold: {liquidation_threshold:.4f}",
+    liquidation_ltv="Liquidation LTV: {inj_liquidation_ltv:.2f}",
+    neptune_liquidation_price="Neptune Liquidation Price: ${neptune_liquidation_price:.2f} (current price: ${inj_price:.2f})",
+    neptune_price_drop="Price Drop to Neptune Liquidation: {price_drop_percentage:.2f}%",
+    health_excellent="Health Status: ✅ Excellent (margin: {health_margin:.2f}%)",
+    health_good="Health Status: ✅ Good (margin: {health_margin:.2f}%)",
+    health_caution="Health Status: ⚠️ Caution (margin: {health_margin:.2f}%)",
+    ltv_ratio="Loan-to-Value Ratio: {ltv_ratio:.2f}%",
+    direction="Position Direction: {direction}",
+    entry_price="Entry Price: ${entry_price:.2f}",
+    current_price="Current Price: ${inj_price:.2f}",
+    quantity="Quantity: {quantity} INJ",
+    original_margin="Original Margin: {margin:.4f} USDT (${margin_value:.2f})",
+    funding_positive="Total Accumulated Funding: +{funding_payment:.6f} USDT (+${funding_value:.2f})",
+    funding_negative="Total Accumulated Funding: {funding_payment:.6f} USDT (${funding_value:.2f})",
+    margin_with_funding="Current Margin (With Funding Payments): {margin_with_funding:.4f} USDT (${margin_with_funding_value:.2f})",
+    notional="Notional Value: ${position_notional:.2f} ({quantity} INJ @ ${inj_price:.2f})",
+    unrealized_pnl="Unrealized PnL: ${pnl:.2f}",
+    effective_margin="Effective Margin: ${effective_margin:.2f}",
+    effective_margin_excl_funding="Effective Margin: ${effective_margin:.2f} (excl. funding)",
+    effective_leverage="Effective Leverage: {leverage:.2f}x",
+    perp_liquidation_price="Perp Liquidation Price: ${liquidation_mark_price:.3f} (current: ${inj_price:.2f})",
+    perp_price_increase="Price Increase to Perp Liquidation: {price_movement_to_liquidation:.2f}%",
+    leverage_utilization="Leverage Utilization: {leverage_utilization:.2f}% of maximum",
+    neptune_equity="Neptune Equity (Collateral - Debt): ${neptune_equity:.2f}",
+    perp_effective_margin="Injective Perp Effective Margin: ${effective_margin:.2f}",
+    strategy_value="Total Strategy Value: ${overall_strategy_value:.2f}",
+    funding_pnl_positive="PnL from Funding Rate: +${funding_pnl:.2f} (+{funding_pnl_percentage:.2f}% of strategy value)",
+    funding_pnl_negative="PnL from Funding Rate: ${funding_pnl:.2f} ({funding_pnl_percentage:.2f}% of strategy value)",
+    borrow_rate="USDT Borrow Rate (Neptune): {usdt_borrow_rate:.2f}% APR (${annual_borrow_cost:.2f}/year on ${usdt_debt_value:.2f} debt)",
+    funding_rate_positive="INJ Funding Rate (Injective): +{funding_rate:.2f}% APR (${annual_funding_income:.2f}/year on ${position_notional:.2f} position)",
+    funding_rate_negative="INJ Funding Rate (Injective): {funding_rate:.2f}% APR (-${annual_funding_cost:.2f}/year on ${position_notional:.2f} position)",
+    funding_rate_neutral="INJ Funding Rate (Injective): {funding_rate:.2f}% APR ($0.00/year)",
+    annual_borrow_cost="   → Annual Borrow Cost: ${annual_borrow_cost:.2f}",
+    annual_funding_income="   → Annual Funding Income: ${annual_funding_income:.2f}",
+    annual_net_yield="   → Net Annual Yield: ${annual_net_yield:.2f}",
+    percentage_of_value="As Percentage of Strategy Value (${overall_strategy_value:.2f}):",
+    weighted_borrow_cost="   → Borrow Cost: {weighted_borrow_cost:.2f}% APR",
+    weighted_funding_income="   → Funding Income: {weighted_funding_income:.2f}% APR",
+    weighted_effective_cost="   → Effective Cost: {weighted_effective_cost:.2f}% APR",
+    funding_exceeds_cost="   → Funding payments received exceed borrowing costs by {funding_surplus:.2f}%",
+    strategy_yield="Strategy Yield: {strategy_yield:.2f}% APR (${annual_net_yield:.2f}/year)",
+    hedge_ratio="Hedge Ratio (Collateral / Perp Notional): {hedge_ratio:.2f}%",
+    under_hedged="⚠️ Position is under-hedged. Consider increasing collateral by ${under_hedged_amount:.2f}",
+    under_hedged_detail="   This would require approximately {under_hedged_inj:.4f} more INJ as collateral.",
+    over_hedged="⚠️ Position is over-hedged. Consider reducing collateral by ${over_hedged_amount:.2f}",
+    over_hedged_detail="   This would require withdrawing approximately {over_hedged_inj:.4f} INJ.",
+    net_exposure="Net INJ Exposure: {net_inj_exposure:.4f} INJ (${net_inj_value:.2f})",
+    funding_payments_total="Funding Payments: {total:+.6f} USDT over {count} payments ({last_7_days:+.6f} in the last 7 days)",
+    funding_payments_recent="Recent Funding Payments:",
+    funding_payment_row="   {date}: {amount:+.6f} USDT",
+    no_hedge="⚠️ No hedge for ${inj_collateral_value:.2f} of collateral. Consider opening a short position.",
+    recommended_size="   Recommended position size: Short {recommended_short:.4f} INJ",
+)
+
+
+def position_metrics(inj_price, usdt_price, inj_collateral, usdt_debt, health_factor, liquidation_threshold,
+                     position_data, inj_liquidation_ltv=None, cumulative_funding=None, usdt_borrow_rate=None,
+                     funding_rate=None, funding_payments=None):
+    """Derive the figures shown in the positions report from the raw query results.
+
+    Everything after `position_data` is optional; figures that depend on a
+    missing input are left out and the sections that need them skip them.
+    """
+    v = dict(
+        inj_price=inj_price, usdt_price=usdt_price,
+        inj_collateral=inj_collateral, usdt_debt=usdt_debt,
+        inj_collateral_value=inj_collateral * inj_price,
+        usdt_debt_value=usdt_debt * usdt_price,
+        health_factor=health_factor, liquidation_threshold=liquidation_threshold,
+        inj_liquidation_ltv=inj_liquidation_ltv,
+        usdt_borrow_rate=usdt_borrow_rate, funding_rate=funding_rate,
+        funding_payments=funding_payments,
+        has_position=bool(position_data),
+        funding_loaded=cumulative_funding is not None,
+    )
+    if inj_liquidation_ltv is not None:
+        v['neptune_liquidation_price'] = risk.neptune_liquidation_price(v['usdt_debt_value'], inj_collateral, inj_liquidation_ltv)
+        v['price_drop_percentage'] = ((inj_price - v['neptune_liquidation_price']) / inj_price) * 100
+    if health_factor > 0:
+        v['health_margin'] = ((health_factor / liquidation_threshold) - 1) * 100 if liquidation_threshold > 0 else 0
+    v['ltv_ratio'] = (v['usdt_debt_value'] / v['inj_collateral_value']) * 100 if v['inj_collateral_value'] > 0 else 0
+    v['recommended_short'] = v['inj_collateral_value'] / inj_price if inj_price else 0
+    if not position_data:
+        return v
+
+    position = risk.parse_position(position_data, cumulative_funding)
+    direction, quantity, entry_price, margin = (
+        position['direction'], position['quantity'], position['entry_price'], position['margin']
+    )
+    position_notional = quantity * inj_price
+    pnl = (entry_price - inj_price) * quantity if direction == "Short" else (inj_price - entry_price) * quantity
+    v.update(
+        direction=direction, quantity=quantity, entry_price=entry_price, margin=margin,
+        margin_value=margin * usdt_price, position_notional=position_notional, pnl=pnl,
+    )
+
+    funding_payment = position['funding_payment']
+    if funding_payment is not None:
+        v['funding_value'] = funding_payment * usdt_price
+    v['funding_payment'] = funding_payment
+
+    margin_with_funding = position['margin_with_funding']
+    effective_margin = margin_with_funding * usdt_price + pnl
+    leverage = position_notional / effective_margin if effective_margin > 0 else 0
+    v.update(
+        margin_with_funding=margin_with_funding,
+        margin_with_funding_value=margin_with_funding * usdt_price,
+        effective_margin=effective_margin, leverage=leverage,
+    )
+
+    maintenance_margin_ratio = 1 / risk.MAX_LEVERAGE
+    if direction == "Short":
+        liquidation_mark_price = risk.helix_liquidation_mark_price(margin_with_funding, usdt_price, entry_price, quantity)
+        net_inj_exposure = inj_collateral - quantity
+        v.update(
+            liquidation_mark_price=liquidation_mark_price,
+            price_movement_to_liquidation=((liquidation_mark_price - inj_price) / inj_price) * 100,
+            leverage_utilization=(leverage / (1/maintenance_margin_ratio)) * 100,
+            hedge_ratio=risk.hedge_ratio(v['inj_collateral_value'], position_notional),
+            under_hedged_amount=position_notional - v['inj_collateral_value'],
+            over_hedged_amount=v['inj_collateral_value'] - position_notional,
+            net_inj_exposure=net_inj_exposure,
+            net_inj_value=net_inj_exposure * inj_price,
+        )
+        v['under_hedged_inj'] = v['under_hedged_amount'] / inj_price
+        v['over_hedged_inj'] = v['over_hedged_amount'] / inj_price
+
+    neptune_equity = v['inj_collateral_value'] - v['usdt_debt_value']
+    overall_strategy_value = neptune_equity + effective_margin
+    funding_pnl = funding_payment * usdt_price if funding_payment is not None else 0
+    v.update(
+        neptune_equity=neptune_equity,
+        overall_strategy_value=overall_strategy_value,
+        funding_pnl=funding_pnl,
+        funding_pnl_percentage=(funding_pnl / overall_strategy_value) * 100 if overall_strategy_value > 0 else 0,
+    )
+    if usdt_borrow_rate is not None:
+        v['annual_borrow_cost'] = v['usdt_debt_value'] * (usdt_borrow_rate / 100)
+    if funding_rate is not None:
+        v['annual_funding_income'] = position_notional * (funding_rate / 100)
+        v['annual_funding_cost'] = abs(position_notional * funding_rate / 100)
+
+    if direction == "Short" and usdt_borrow_rate is not None and funding_rate is not None:
+        v['annual_net_yield'] = v['annual_funding_income'] - v['annual_borrow_cost']
+        weighted_borrow_cost = v['annual_borrow_cost'] / overall_strategy_value * 100 if overall_strategy_value > 0 else 0
+        weighted_funding_income = v['annual_funding_income'] / overall_strategy_value * 100 if overall_strategy_value > 0 else 0
+        weighted_effective_cost = weighted_borrow_cost - weighted_funding_income
+        v.update(
+            weighted_borrow_cost=weighted_borrow_cost,
+            weighted_funding_income=weighted_funding_income,
+            weighted_effective_cost=weighted_effective_cost,
+            funding_surplus=abs(weighted_effective_cost),
+            strategy_yield=-weighted_effective_cost,
+        )
+    return v
+
+
+def _buffer_status(percentage, remedy):
+    if percentage > 40:
+        return "✅ Very safe - large buffer to liquidation"
+    if percentage > 25:
+        return "✅ Safe - good buffer to liquidation"
+    if percentage > 15:
+        return "⚠️ Moderate buffer to liquidation"
+    return f"🚨 Small buffer to liquidation - {remedy}"
+
+
+def _format_age(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def staleness_section(v):
+    """Which inputs missed their deadline and were rendered from the previous snapshot"""
+    return [T['stale'].render(label=label, age=_format_age(age)) for label, age in v.get('stale', ())]
+
+
+def prices_section(v):
+    return [
+        T['header'].render(title="CURRENT MARKET PRICES"),
+        T['inj_price'].render(**v),
+        T['usdt_price'].render(**v),
+    ]
+
+
+def neptune_section(v):
+    lines = [
+        T['header'].render(title="NEPTUNE FINANCE POSITION"),
+        T['inj_collateral'].render(**v),
+        T['usdt_debt'].render(**v),
+        T['health_factor'].render(**v),
+        T['liquidation_threshold'].render(**v),
+    ]
+    if v['health_factor'] > 0:
+        if v['health_factor'] >= 1.5:
+            lines.append(T['health_excellent'].render(**v))
+        elif v['health_factor'] >= 1.2:
+            lines.append(T['health_good'].render(**v))
+        elif v['health_factor'] >= 1.0:
+            lines.append(T['health_caution'].render(**v))
+        else:
+            lines.append("Health Status: 🚨 At Risk of Liquidation!")
+    lines.append(T['ltv_ratio'].render(**v))
+    return lines
+
+
+def perp_section(v):
+    lines = [T['header'].render(title="INJECTIVE PERP POSITION")]
+    if not v['has_position']:
+        lines.append("No derivative position found.")
+        return lines
+
+    lines += [
+        T['direction'].render(**v),
+        T['entry_price'].render(**v),
+        T['current_price'].render(**v),
+        T['quantity'].render(**v),
+        T['original_margin'].render(**v),
+        T['notional'].render(**v),
+        T['unrealized_pnl'].render(**v),
+        T['effective_margin' if v['funding_loaded'] else 'effective_margin_excl_funding'].render(**v),
+        T['effective_leverage'].render(**v),
+    ]
+    if v['effective_margin'] <= 0:
+        lines.append("🚨 CRITICAL: Negative or zero effective margin! Position at extreme risk.")
+    elif v['leverage'] > 5:
+        lines.append("🚨 WARNING: Extremely high leverage! High risk of liquidation.")
+    elif v['leverage'] > 3:
+        lines.append("⚠️ CAUTION: Leverage is higher than recommended. Consider adding margin.")
+    return lines
+
+
+def comparison_section(v):
+    lines = [T['header'].render(title="POSITION COMPARISON")]
+    if not v['has_position']:
+        lines += [T['no_hedge'].render(**v), T['recommended_size'].render(**v)]
+        return lines
+
+    lines.append("Strategy: Short INJ on Injective Perp to hedge INJ collateral on Neptune")
+    if v['direction'] == "Short":
+        lines.append(T['hedge_ratio'].render(**v))
+        if 95 < v['hedge_ratio'] < 105:
+            lines += [
+                "✅ Position is well-hedged (95-105% range)",
+                "   Your INJ collateral value is properly hedged against price movements.",
+            ]
+        elif v['hedge_ratio'] < 95:
+            lines += [T['under_hedged'].render(**v), T['under_hedged_detail'].render(**v)]
+        else:
+            lines += [T['over_hedged'].render(**v), T['over_hedged_detail'].render(**v)]
+        lines += ["", T['net_exposure'].render(**v)]
+        if abs(v['net_inj_exposure']) < 0.01:
+            lines.append("✅ Delta neutral position achieved")
+        else:
+            lines.append(f"{'⚠️ Long' if v['net_inj_exposure'] > 0 else '⚠️ Short'} bias in your overall position")
+    return lines
+
+
+def _funding_rate_lines(v):
+    if v['funding_rate'] > 0:
+        return [T['funding_rate_positive'].render(**v), "(shorts receive)"]
+    if v['funding_rate'] < 0:
+        return [T['funding_rate_negative'].render(**v), "(shorts pay)"]
+    return [T['funding_rate_neutral'].render(**v), "(neutral)"]
+
+
+def funding_section(v):
+    lines = [T['header'].render(title="FUNDING DETAILS")]
+    if v['has_position']:
+        if v['funding_payment'] is not None:
+            lines.append(T['funding_positive' if v['funding_payment'] > 0 else 'funding_negative'].render(**v))
+            lines.append(T['margin_with_funding'].render(**v))
+            lines.append(T['funding_pnl_positive' if v['funding_pnl'] > 0 else 'funding_pnl_negative'].render(**v))
+        if v['funding_rate'] is not None:
+            lines += _funding_rate_lines(v)
+    if v['funding_payments'] is not None:
+        payments = v['funding_payments']
+        lines += ["", T['funding_payments_total'].render(**payments)]
+        if payments['recent']:
+            lines.append(T['funding_payments_recent'].render())
+            lines += [T['funding_payment_row'].render(date=row['date'], amount=row['amount']) for row in payments['recent']]
+    return lines
+
+
+def liquidation_section(v):
+    lines = [T['header'].render(title="LIQUIDATION ANALYSIS")]
+    if v['inj_liquidation_ltv'] is not None:
+        lines += [
+            T['liquidation_ltv'].render(**v),
+            T['neptune_liquidation_price'].render(**v),
+            T['neptune_price_drop'].render(**v),
+            _buffer_status(v['price_drop_percentage'], "consider reducing debt or adding collateral"),
+        ]
+    if v['has_position'] and v['direction'] == "Short":
+        lines += [
+            T['perp_liquidation_price'].render(**v),
+            T['perp_price_increase'].render(**v),
+            _buffer_status(v['price_movement_to_liquidation'], "consider adding margin"),
+            T['leverage_utilization'].render(**v),
+        ]
+    if len(lines) == 1:
+        lines.append("No liquidation risk: no debt or short position found.")
+    return lines
+
+
+def yield_section(v):
+    lines = [T['header'].render(title="STRATEGY YIELD")]
+    if not v['has_position']:
+        lines.append("No derivative position found.")
+        return lines
+    lines += [
+        T['neptune_equity'].render(**v),
+        T['perp_effective_margin'].render(**v),
+        T['strategy_value'].render(**v),
+        "",
+        T['borrow_rate'].render(**v),
+    ]
+    lines += _funding_rate_lines(v)
+
+    if v['direction'] == "Short":
+        lines += [
+            "",
+            "Net Annual Dollar Amounts:",
+            T['annual_borrow_cost'].render(**v),
+            T['annual_funding_income'].render(**v),
+            T['annual_net_yield'].render(**v),
+            "",
+            T['percentage_of_value'].render(**v),
+            T['weighted_borrow_cost'].render(**v),
+            T['weighted_funding_income'].render(**v),
+            T['weighted_effective_cost'].render(**v),
+        ]
+        if v['weighted_effective_cost'] < 0:
+            lines.append(T['funding_exceeds_cost'].render(**v))
+        else:
+            lines.append("   → Net cost after accounting for funding payments")
+        lines += ["", T['strategy_yield'].render(**v)]
+        strategy_yield = v['strategy_yield']
+        if strategy_yield > 30:
+            lines.append("✅ Excellent yield")
+        elif strategy_yield > 15:
+            lines.append("✅ Very good yield")
+        elif strategy_yield > 5:
+            lines.append("✅ Good yield")
+        elif strategy_yield > 0:
+            lines.append("✅ Positive yield")
+        else:
+            lines.append("🚨 Negative yield - consider adjusting strategy")
+    return lines
+
+
+def stress_section(v):
+    lines = [T['header'].render(title=f"STRESS TEST ({stress.HORIZON_DAYS} DAYS)")]
+    if v['inj_liquidation_ltv'] is None or v['usdt_borrow_rate'] is None:
+        lines.append("Collateral parameters or borrow rate unavailable.")
+        return lines
+    short = v['has_position'] and v['direction'] == "Short"
+    grid = stress.stress_grid(
+        v['inj_price'], v['usdt_price'], v['inj_collateral'], v['usdt_debt'], v['inj_liquidation_ltv'],
+        v['usdt_borrow_rate'],
+        v['quantity'] if short else 0, v['entry_price'] if short else 0, v['margin_with_funding'] if short else 0,
+    )
+    table = stress.format_grid(grid, current_funding_rate=v['funding_rate'])
+    lines += [
+        "<pre>" + html.escape("\n".join(table)) + "</pre>",
+        "value: change in strategy value (USD) with funding at the column nearest today's rate and today's borrow rate",
+    ]
+    return lines
+
+
+# Always shown, rendered from the minimal query set
+SUMMARY_SECTIONS = (
+    staleness_section,
+    prices_section,
+    neptune_section,
+    perp_section,
+    comparison_section,
+)
+
+# Collapsible sections: key -> (button label, renderer)
+EXPANDABLE_SECTIONS = {
+    "funding": ("Funding details", funding_section),
+    "liquidation": ("Liquidation analysis", liquidation_section),
+    "yield": ("Strategy yield", yield_section),
+    "stress": ("Stress test", stress_section),
+}
+
+
+def render_sections(v, sections=SUMMARY_SECTIONS):
+    """Render each non-empty section to one string"""
+    rendered = []
+    for section in sections:
+        lines = section(v)
+        if lines:
+            rendered.append("\n".join(lines))
+    return rendered
+
+
+def chunk_sections(sections, limit=MAX_MESSAGE_LENGTH):
+    """Pack rendered sections into as few messages as possible.
+
+    Messages only break between sections, or between lines of a section that
+    is too long on its own. A single line longer than a message is cut outside
+    any tag or entity, with the tags open at the cut closed before it and
+    reopened after it, so every message is valid HTML on its own.
+    """
+    budget = limit - len(CONTINUED_NOTE)
+    pieces = []
+    for section in sections:
+        if len(section) <= budget:
+            pieces.append(section)
+        else:
+            pieces.extend(_split_long(section, budget))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}\n\n{piece}" if current else piece
+        if len(candidate) <= budget:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return [chunk + CONTINUED_NOTE for chunk in chunks[:-1]] + chunks[-1:]
+
+
+def _split_long(section, budget):
+    pieces = []
+    current = ""
+    for line in section.split("\n"):
+        if len(line) > budget and current:
+            pieces.append(current)
+            current = ""
+        while len(line) > budget:
+            head, line = _cut_line(line, budget)
+            pieces.append(head)
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) <= budget:
+            current = candidate
+        else:
+            pieces.append(current)
+            current = line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+_OPEN_MARKUP = re.compile(r"<[^>]*$|&[#\w]*$")
+
+
+def _safe_cut(line, budget):
+    """Index at or before `budget` that is not inside a tag or entity"""
+    match = _OPEN_MARKUP.search(line[:budget])
+    return match.start() if match and match.start() > 0 else budget
+
+
+_TAG = re.compile(r"<(/?)([\w-]+)[^>]*>")
+
+
+def _cut_line(line, budget):
+    """Head of `line` within `budget` with its open tags closed, and the rest with them reopened"""
+    limit = budget
+    while True:
+        cut = _safe_cut(line, limit)
+        tags = _open_tags(line[:cut])
+        closing = "".join(f"</{name}>" for name, _ in reversed(tags))
+        if cut + len(closing) <= budget:
+            return line[:cut] + closing, "".join(opening for _, opening in tags) + line[cut:]
+        limit = min(limit - 1, budget - len(closing))
+
+
+def _open_tags(text):
+    """(name, opening tag) of the tags still open at the end of `text`, outermost first"""
+    stack = []
+    for match in _TAG.finditer(text):
+        if not match.group(1):
+            stack.append((match.group(2), match.group(0)))
+        elif stack:
+            # Rendered reports are well nested, so a closing tag ends the innermost open one
+            stack.pop()
+    return stack
+
+
+def digest(*parts):
+    """Stable hash of rendered output, used to skip edits that would change nothing"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
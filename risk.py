@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting a dropped oracle price stream
+STREAM_RECONNECT_DELAY = 5
+
+# Seconds without an oracle tick after which queried prices are trusted again
+PRICE_STREAM_STALE = 60
+
+# Helix liquidation model used by the positions report: maintenance margin of a 25x
+# maximum leverage market, less a 2% buffer so the warning comes before the real mark
+MAX_LEVERAGE = 25.0
+LIQUIDATION_BUFFER = 0.02
+
+metrics.describe("risk_health_factor", "Neptune health factor computed locally from streamed oracle prices")
+metrics.describe("risk_liquidation_distance_percent", "Price move to liquidation per venue, from streamed oracle prices")
+metrics.describe("risk_price_ticks_total", "Oracle price updates applied by the risk engine")
+
+
+def health_factor(inj_collateral, inj_price, liquidation_ltv, usdt_debt_value):
+    """Neptune health factor: liquidation-weighted collateral value over debt value (None without debt)"""
+    if not usdt_debt_value:
+        return None
+    return inj_collateral * inj_price * liquidation_ltv / usdt_debt_value
+
+
+def neptune_liquidation_price(usdt_debt_value, inj_collateral, liquidation_ltv):
+    """INJ price at which the weighted collateral no longer covers the debt"""
+    return usdt_debt_value / (inj_collateral * liquidation_ltv)
+
+
+def helix_liquidation_mark_price(margin_with_funding, usdt_price, entry_price, quantity,
+                                 max_leverage=MAX_LEVERAGE, buffer=LIQUIDATION_BUFFER):
+    """Mark price at which a short's margin (with funding) falls to the buffered maintenance margin"""
+    maintenance_margin_ratio = 1 / max_leverage
+    return (margin_with_funding * usdt_price + entry_price * quantity) / (quantity * (1 + maintenance_margin_ratio - buffer))
+
+
+def hedge_ratio(inj_collateral_value, position_notional):
+    """Collateral value as a percentage of the short's notional"""
+    return inj_collateral_value / position_notional * 100 if position_notional > 0 else 0
+
+
+def parse_position(position_data, cumulative_funding=None):
+    """Direction, size, entry, margin and margin including funding of a chain position state"""
+    direction = "Short" if not position_data.get('isLong', False) else "Long"
+    quantity = float(position_data.get('quantity', '0')) / 10**18
+    entry_price = float(position_data.get('entryPrice', '0')) / 10**24
+    margin = float(position_data.get('margin', '0')) / 10**24
+    cumulative_funding_entry = float(position_data.get('cumulativeFundingEntry', '0')) / 10**18
+    funding_payment = None
+    if cumulative_funding is not None:
+        scaling_factor = 1/1000000
+        if direction == "Short":
+            funding_diff = cumulative_funding_entry - cumulative_funding
+        else:
+            funding_diff = cumulative_funding - cumulative_funding_entry
+        funding_payment = -(quantity * funding_diff * scaling_factor)
+    return {
+        'direction': direction,
+        'quantity': quantity,
+        'entry_price': entry_price,
+        'margin': margin,
+        'funding_payment': funding_payment,
+        'margin_with_funding': margin + (funding_payment or 0),
+    }
+
+
+class RiskEngine:
+    """Health factor, liquidation prices and hedge ratio of the bot wallet, kept current locally.
+
+    Balances, the perp position and the collateral LTV are fed in whenever a
+    view loads them; INJ prices arrive from the exchange oracle stream. Terms
+    that do not depend on the INJ price (liquidation prices, hedge ratio,
+    weighted collateral) are rebuilt only when those inputs change, so each
+    price tick is a handful of multiplications and no chain calls. Callables in
+    `listeners` get the new figures after every reprice, and those in
+    `price_listeners` every streamed INJ/USDT price.
+    """
+
+    def __init__(self):
+        self.inj_collateral = None
+        self.usdt_debt = None
+        self.liquidation_ltv = None
+        self.position = None
+        self.inj_price = None
+        self.usdt_price = None
+        self.price_updated_at = None
+        self.last_tick = None
+        self._fixed = {}
+        self._risk = {}
+        self._task = None
+        self.listeners = []
+        self.price_listeners = []
+
+    def update(self, inj_collateral=None, usdt_debt=None, liquidation_ltv=None, position_data=None,
+               cumulative_funding=None, inj_price=None, usdt_price=None, has_position=None):
+        """Feed freshly queried inputs; anything left as None keeps its previous value.
+
+        `has_position=False` clears the position, since an absent position and
+        one that was not queried both arrive as None.
+        """
+        if inj_collateral is not None:
+            self.inj_collateral = inj_collateral
+        if usdt_debt is not None:
+            self.usdt_debt = usdt_debt
+        if liquidation_ltv is not None:
+            self.liquidation_ltv = liquidation_ltv
+        if position_data:
+            self.position = parse_position(position_data, cumulative_funding)
+        elif has_position is False:
+            self.position = None
+        if usdt_price:
+            self.usdt_price = usdt_price
+        if inj_price and (self.last_tick is None or time.monotonic() - self.last_tick > PRICE_STREAM_STALE):
+            # While the oracle stream is ticking its prices are newer than queried ones
+            self.inj_price = inj_price
+            self.price_updated_at = time.monotonic()
+        self._rebuild()
+
+    def on_oracle_price(self, price):
+        """Apply a streamed INJ/USDT oracle price"""
+        for listener in self.price_listeners:
+            listener(price)
+        if not self.usdt_price:
+            return
+        self.inj_price = price * self.usdt_price
+        self.price_updated_at = self.last_tick = time.monotonic()
+        metrics.inc("risk_price_ticks_total")
+        self._reprice()
+
+    def current(self):
+        """Latest risk figures, or None until balances and a price have been fed in"""
+        if not self._risk:
+            return None
+        risk = dict(self._risk)
+        risk['price_age'] = time.monotonic() - self.price_updated_at
+        return risk
+
+    def _rebuild(self):
+        if self.inj_collateral is None or self.usdt_debt is None or not self.usdt_price:
+            return
+        fixed = {'usdt_debt_value': self.usdt_debt * self.usdt_price}
+        if self.liquidation_ltv and self.inj_collateral > 0:
+            fixed['collateral_weight'] = self.inj_collateral * self.liquidation_ltv
+            fixed['neptune_liquidation_price'] = neptune_liquidation_price(
+                fixed['usdt_debt_value'], self.inj_collateral, self.liquidation_ltv
+            )
+        position = self.position
+        if position and position['direction'] == "Short" and position['quantity'] > 0:
+            fixed['liquidation_mark_price'] = helix_liquidation_mark_price(
+                position['margin_with_funding'], self.usdt_price, position['entry_price'], position['quantity']
+            )
+            # Collateral and notional are both priced in INJ, so the ratio does not move with it
+            fixed['hedge_ratio'] = hedge_ratio(self.inj_collateral, position['quantity'])
+        self._fixed = fixed
+        self._reprice()
+
+    def _reprice(self):
+        fixed = self._fixed
+        inj_price = self.inj_price
+        if not fixed or not inj_price:
+            return
+        risk = {'inj_price': inj_price, 'usdt_price': self.usdt_price, 'hedge_ratio': fixed.get('hedge_ratio')}
+        if 'collateral_weight' in fixed:
+            risk['health_factor'] = health_factor(self.inj_collateral, inj_price, self.liquidation_ltv, fixed['usdt_debt_value'])
+            risk['neptune_liquidation_price'] = fixed['neptune_liquidation_price']
+            risk['price_drop_percentage'] = (inj_price - fixed['neptune_liquidation_price']) / inj_price * 100
+            if risk['health_factor'] is not None:
+                metrics.set_gauge("risk_health_factor", risk['health_factor'])
+            metrics.set_gauge("risk_liquidation_distance_percent", risk['price_drop_percentage'], venue="neptune")
+        if 'liquidation_mark_price' in fixed:
+            risk['liquidation_mark_price'] = fixed['liquidation_mark_price']
+            risk['price_movement_to_liquidation'] = (fixed['liquidation_mark_price'] - inj_price) / inj_price * 100
+            metrics.set_gauge("risk_liquidation_distance_percent", risk['price_movement_to_liquidation'], venue="helix")
+        self._risk = risk
+        for listener in self.listeners:
+            try:
+                listener(risk)
+            except Exception as e:
+                logger.error(f"Risk listener failed: {str(e)}")
+
+    def track(self, client, market_spec):
+        """Stream the oracle price of `market_spec` in the background (no-op if already streaming)"""
+        if self._task is None and market_spec.oracle_base:
+            self._task = asyncio.create_task(self._run(client, market_spec))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, client, market_spec):
+        async def on_price(event):
+            try:
+                self.on_oracle_price(float(event['price']))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Ignoring malformed oracle price update: {str(e)}")
+
+        while True:
+            try:
+                await client.listen_oracle_prices_updates(
+                    callback=on_price,
+                    base_symbol=market_spec.oracle_base,
+                    quote_symbol=market_spec.oracle_quote,
+                    oracle_type=market_spec.oracle_type,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Oracle price stream for {market_spec.ticker} failed: {str(e)}")
+            await asyncio.sleep(STREAM_RECONNECT_DELAY)
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import grpc
+from grpc import RpcError
+from pyinjective.async_client import AsyncClient
+from pyinjective.core.network import Network
+
+from metrics import metrics, _quantile
+
+logger = logging.getLogger(__name__)
+
+# Seconds between fetch_latest_block probes of every endpoint
+PROBE_INTERVAL = 10
+
+# Weight of the newest latency sample in an endpoint's moving average
+LATENCY_SMOOTHING = 0.2
+
+# Consecutive transport failures that open an endpoint's circuit, and how long it stays open
+FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN = 30
+
+# Per-method latencies kept for the hedging threshold; no hedging until MIN_HEDGE_SAMPLES are in
+HEDGE_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+HEDGE_QUANTILE = 0.95
+
+# Never hedge a read sooner than this, however fast the method usually is
+MIN_HEDGE_DELAY = 0.05
+
+# gRPC status codes that say something about the endpoint rather than the query
+TRANSPORT_ERRORS = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+}
+
+# fetch_* calls that must stay on the signing client: they update its account sequence
+PRIMARY_ONLY = {"fetch_account"}
+
+metrics.describe("endpoint_latency_seconds", "Smoothed read latency per chain endpoint")
+metrics.describe("endpoint_healthy", "1 while an endpoint's circuit is closed, 0 while it is open")
+metrics.describe("endpoint_reads_total", "Routed reads per endpoint")
+metrics.describe("endpoint_failures_total", "Transport failures per endpoint")
+metrics.describe("hedged_reads_total", "Reads duplicated to a second endpoint after exceeding the method's p95, by winner")
+
+
+def custom_network(grpc_endpoint, grpc_exchange_endpoint=None):
+    """Mainnet settings with the chain (and optionally exchange) gRPC endpoints replaced"""
+    mainnet = Network.mainnet()
+    exchange_endpoint = grpc_exchange_endpoint or mainnet.grpc_exchange_endpoint
+
+    def credentials(endpoint):
+        return grpc.ssl_channel_credentials() if endpoint.endswith(":443") else None
+
+    return Network.custom(
+        lcd_endpoint=mainnet.lcd_endpoint,
+        tm_websocket_endpoint=mainnet.tm_websocket_endpoint,
+        grpc_endpoint=grpc_endpoint,
+        grpc_exchange_endpoint=exchange_endpoint,
+        grpc_explorer_endpoint=mainnet.grpc_explorer_endpoint,
+        chain_stream_endpoint=mainnet.chain_stream_endpoint,
+        chain_id=mainnet.chain_id,
+        env=mainnet.env,
+        official_tokens_list_url=mainnet.official_tokens_list_url,
+        grpc_channel_credentials=credentials(grpc_endpoint),
+        grpc_exchange_channel_credentials=credentials(exchange_endpoint),
+        grpc_explorer_channel_credentials=grpc.ssl_channel_credentials(),
+        chain_stream_channel_credentials=grpc.ssl_channel_credentials(),
+    )
+
+
+def parse_endpoints(value):
+    """Networks for a comma-separated list of `chain_grpc[|exchange_grpc]` entries"""
+    networks = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if entry:
+            networks.append((entry, custom_network(*entry.split("|", 1))))
+    return networks
+
+
+class Endpoint:
+    """One chain endpoint: its client, smoothed latency and circuit breaker state"""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.latency = None
+        self.failures = 0
+        self.open_until = 0.0
+
+    def available(self, now):
+        """Closed circuit, or open long enough that trial requests may go through"""
+        return self.open_until <= now
+
+    def succeeded(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+        if self.failures >= FAILURE_THRESHOLD:
+            logger.info("Endpoint %s recovered", self.name)
+        self.failures = 0
+        self.open_until = 0.0
+        metrics.set_gauge("endpoint_latency_seconds", self.latency, endpoint=self.name)
+        metrics.set_gauge("endpoint_healthy", 1, endpoint=self.name)
+
+    def failed(self, error):
+        self.failures += 1
+        metrics.inc("endpoint_failures_total", endpoint=self.name)
+        if self.failures >= FAILURE_THRESHOLD:
+            # Re-opened after every failed trial request until one succeeds
+            self.open_until = time.monotonic() + BREAKER_COOLDOWN
+            metrics.set_gauge("endpoint_healthy", 0, endpoint=self.name)
+            logger.warning("Endpoint %s out of rotation for %ss after: %s", self.name, BREAKER_COOLDOWN, error)
+
+
+class EndpointPool:
+    """Chain endpoints that read queries are routed across.
+
+    Every read goes to the available endpoint with the lowest smoothed latency
+    (probed with fetch_latest_block every PROBE_INTERVAL and updated by real
+    reads). When a read outlasts the p95 of its method, a duplicate goes to
+    the next-best endpoint and whichever answers first wins. Transport
+    failures count against an endpoint; FAILURE_THRESHOLD in a row open its
+    circuit and take it out of rotation for BREAKER_COOLDOWN seconds.
+    """
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self._latencies = {}
+        self._probe_task = None
+
+    @classmethod
+    def from_env(cls, value, wrap=lambda client: client):
+        """The mainnet load balancer plus any endpoints listed in `value` (see parse_endpoints)"""
+        networks = [("mainnet", Network.mainnet())] + parse_endpoints(value or "")
+        return cls([Endpoint(name, wrap(AsyncClient(network=network))) for name, network in networks])
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+    def ranked(self):
+        """Available endpoints, fastest first; unmeasured ones keep their configured order"""
+        now = time.monotonic()
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        if not available:
+            # Every circuit is open: try the least recently failed rather than nothing
+            return sorted(self.endpoints, key=lambda endpoint: endpoint.open_until)[:1]
+        return sorted(available, key=lambda endpoint: endpoint.latency if endpoint.latency is not None else float("inf"))
+
+    async def read(self, method, *args, **kwargs):
+        """Run `method` on the best endpoint, hedging to the runner-up and failing over"""
+        candidates = self.ranked()
+        hedge_delay = self._hedge_delay(method)
+        pending = {}
+        first = None
+        hedged = False
+        last_error = None
+        started = time.monotonic()
+        try:
+            while True:
+                if not pending:
+                    if not candidates:
+                        raise last_error
+                    endpoint = candidates.pop(0)
+                    first = first or endpoint
+                    pending[self._start(endpoint, method, args, kwargs)] = endpoint
+                # Once the read outlasts the method's p95, duplicate it to the next endpoint
+                timeout = hedge_delay if candidates and hedge_delay is not None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    endpoint = candidates.pop(0)
+                    pending[self._start(endpoint, method, args, kwargs)] = endpoint
+                    hedged = True
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if hedged:
+                            metrics.inc("hedged_reads_total", method=method, winner="first" if endpoint is first else "hedge")
+                        self._record(method, time.monotonic() - started)
+                        return task.result()
+                    if not _is_transport_error(error):
+                        raise error
+                    last_error = error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _start(self, endpoint, method, args, kwargs):
+        return asyncio.create_task(self._call(endpoint, method, args, kwargs))
+
+    async def _call(self, endpoint, method, args, kwargs):
+        started = time.monotonic()
+        metrics.inc("endpoint_reads_total", endpoint=endpoint.name)
+        try:
+            result = await getattr(endpoint.client, method)(*args, **kwargs)
+        except Exception as e:
+            if _is_transport_error(e):
+                endpoint.failed(e)
+            raise
+        endpoint.succeeded(time.monotonic() - started)
+        return result
+
+    def _hedge_delay(self, method):
+        latencies = self._latencies.get(method)
+        if latencies is None or len(latencies) < MIN_HEDGE_SAMPLES or len(self.endpoints) < 2:
+            return None
+        return max(MIN_HEDGE_DELAY, _quantile(sorted(latencies), HEDGE_QUANTILE))
+
+    def _record(self, method, seconds):
+        self._latencies.setdefault(method, deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+    def start_probing(self, interval=PROBE_INTERVAL):
+        if len(self.endpoints) > 1 and self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe(interval))
+
+    async def stop(self):
+        if self._probe_task:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+
+    async def _probe(self, interval):
+        while True:
+            await asyncio.gather(
+                *(self._probe_one(endpoint) for endpoint in self.endpoints),
+                return_exceptions=True,
+            )
+            await asyncio.sleep(interval)
+
+    async def _probe_one(self, endpoint):
+        started = time.monotonic()
+        try:
+            await endpoint.client.fetch_latest_block()
+        except Exception as e:
+            # Any probe failure, unlike a failed query, means the endpoint itself is unwell
+            endpoint.failed(e)
+            return
+        endpoint.succeeded(time.monotonic() - started)
+
+    def report(self):
+        """Plain-text endpoint latencies and health for the /perf command"""
+        now = time.monotonic()
+        lines = ["Chain endpoints          latency  state"]
+        for endpoint in self.endpoints:
+            latency = f"{endpoint.latency * 1000:.0f}ms" if endpoint.latency is not None else "-"
+            state = "open" if not endpoint.available(now) else ("failing" if endpoint.failures else "ok")
+            lines.append(f"{endpoint.name[:24]:<24}{latency:>9}  {state}")
+        return "\n".join(lines)
+
+
+class RoutedClient:
+    """AsyncClient proxy that sends read queries through an EndpointPool.
+
+    fetch_* calls (except PRIMARY_ONLY) are routed; everything else, including
+    simulate, broadcast, sequence handling and streams, goes to `primary`.
+    """
+
+    def __init__(self, primary, pool):
+        self._client = primary
+        self._pool = pool
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if (
+            len(self._pool.endpoints) > 1
+            and attr.startswith("fetch_")
+            and attr not in PRIMARY_ONLY
+            and asyncio.iscoroutinefunction(value)
+        ):
+            async def routed(*args, **kwargs):
+                return await self._pool.read(attr, *args, **kwargs)
+            return routed
+        return value
+
+
+def _is_transport_error(error):
+    if isinstance(error, RpcError) and hasattr(error, "code"):
+        return error.code() in TRANSPORT_ERRORS
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError))
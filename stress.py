@@ -0,0 +1,111 @@
+import numpy as np
+
+import risk
+
+# Scenario axes: INJ price moves, annualized funding rates for the short (decimal APR,
+# positive = shorts receive) and shifts added to the current USDT borrow rate
+PRICE_MOVES = np.array([-0.5, -0.3, -0.2, -0.1, 0.0, 0.1, 0.2, 0.3, 0.5])
+FUNDING_RATES = np.array([-0.5, -0.2, 0.0, 0.1, 0.3])
+BORROW_SHIFTS = np.array([0.0, 0.1, 0.25, 0.5])
+
+# Days of funding and interest accrued before the price move is applied
+HORIZON_DAYS = 30
+
+# Health factor and distance to the Helix liquidation mark below which a scenario is flagged
+WARN_HEALTH_FACTOR = 1.2
+WARN_HELIX_DISTANCE = 0.1
+
+# Cell codes of the status grid
+SAFE, WARN, LIQUIDATED = 0, 1, 2
+
+
+def stress_grid(inj_price, usdt_price, inj_collateral, usdt_debt, liquidation_ltv, usdt_borrow_rate,
+                quantity, entry_price, margin_with_funding, price_moves=PRICE_MOVES,
+                funding_rates=FUNDING_RATES, borrow_shifts=BORROW_SHIFTS, horizon_days=HORIZON_DAYS):
+    """Evaluate the Neptune loan and Helix short over every combination of scenario axes at once.
+
+    Position inputs may be scalars or 1-D arrays (one entry per position); the
+    result arrays are shaped (positions, price moves, funding rates, borrow
+    shifts), with the position axis dropped for scalar inputs. Rates are in
+    percent APR as elsewhere in the bot. Returns health factor, fractional
+    distance to the Helix liquidation mark, change in combined strategy value
+    (USD) and a status code per cell.
+    """
+    scalar = np.ndim(inj_collateral) == 0
+
+    def position_axis(value):
+        return np.asarray(value, dtype=float).reshape(-1, 1, 1, 1)
+
+    inj_price, usdt_price, inj_collateral, usdt_debt, liquidation_ltv, usdt_borrow_rate, quantity, entry_price, \
+        margin_with_funding = map(position_axis, (
+            inj_price, usdt_price, inj_collateral, usdt_debt, liquidation_ltv, usdt_borrow_rate,
+            quantity, entry_price, margin_with_funding,
+        ))
+    moves = np.asarray(price_moves, dtype=float).reshape(1, -1, 1, 1)
+    funding = np.asarray(funding_rates, dtype=float).reshape(1, 1, -1, 1)
+    shifts = np.asarray(borrow_shifts, dtype=float).reshape(1, 1, 1, -1)
+    years = horizon_days / 365
+
+    price = inj_price * (1 + moves)
+    debt_value = usdt_debt * usdt_price * (1 + (usdt_borrow_rate / 100 + shifts) * years)
+    collateral_value = inj_collateral * price
+    with np.errstate(divide="ignore", invalid="ignore"):
+        health = np.where(debt_value > 0, collateral_value * liquidation_ltv / debt_value, np.inf)
+
+    # Funding accrues on the short's notional at today's price, before the move
+    margin = margin_with_funding + quantity * inj_price * funding * years / usdt_price
+    short = quantity > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        liquidation_mark = np.where(
+            short, risk.helix_liquidation_mark_price(margin, usdt_price, entry_price, quantity), np.inf
+        )
+    helix_distance = (liquidation_mark - price) / price
+
+    value_before = (
+        inj_collateral * inj_price - usdt_debt * usdt_price + margin_with_funding * usdt_price
+        + (entry_price - inj_price) * quantity
+    )
+    value_after = collateral_value - debt_value + margin * usdt_price + (entry_price - price) * quantity
+    value_change = value_after - value_before
+
+    status = np.full(np.broadcast(health, helix_distance).shape, SAFE, dtype=np.int8)
+    status[(health < WARN_HEALTH_FACTOR) | (helix_distance < WARN_HELIX_DISTANCE)] = WARN
+    status[(health < 1) | (helix_distance <= 0)] = LIQUIDATED
+
+    result = {
+        'health_factor': np.broadcast_to(health, status.shape),
+        'helix_distance': np.broadcast_to(helix_distance, status.shape),
+        'value_change': np.broadcast_to(value_change, status.shape),
+        'status': status,
+    }
+    if scalar:
+        result = {key: grid[0] for key, grid in result.items()}
+    return result
+
+
+def format_grid(grid, price_moves=PRICE_MOVES, funding_rates=FUNDING_RATES, borrow_shifts=BORROW_SHIFTS,
+                current_funding_rate=None):
+    """Compact text heatmap of one position's grid: worst status over borrow shifts per cell.
+
+    Rows are price moves and columns funding rates. A last column gives the
+    change in strategy value with funding at `current_funding_rate` (percent
+    APR, nearest column) and no borrow shift.
+    """
+    symbols = {SAFE: ".", WARN: "!", LIQUIDATED: "X"}
+    worst = grid['status'].max(axis=-1)
+    if current_funding_rate is None:
+        funding_column = int(np.argmin(np.abs(funding_rates)))
+    else:
+        funding_column = int(np.argmin(np.abs(funding_rates - current_funding_rate / 100)))
+    value_change = grid['value_change'][:, funding_column, 0]
+
+    header = "move " + "".join(f"{rate * 100:>+5.0f}" for rate in funding_rates) + "     value"
+    lines = [header]
+    for row, move in enumerate(price_moves):
+        cells = "".join(f"{symbols[int(code)]:>5}" for code in worst[row])
+        lines.append(f"{move * 100:>+4.0f}%{cells}{value_change[row]:>+10.2f}")
+    lines.append(
+        f"columns: funding APR %; worst of borrow +{', +'.join(f'{shift * 100:g}' for shift in borrow_shifts)}%"
+    )
+    lines.append(f". safe  ! HF<{WARN_HEALTH_FACTOR:g} or <{WARN_HELIX_DISTANCE * 100:g}% to perp liq  X liquidated")
+    return lines
@@ -0,0 +1,12 @@
+import report
+
+
+def test_long_line_is_cut_with_its_tags_closed_and_reopened():
+    line = "x" * 50 + "<b>" + "y" * 100 + '<a href="https://example.com">' + "z" * 80 + "</a></b> &amp; end"
+    chunks = report.chunk_sections([line], limit=60 + len(report.CONTINUED_NOTE))
+    bodies = [chunk.replace(report.CONTINUED_NOTE, "") for chunk in chunks]
+    assert len(bodies) > 1
+    for body in bodies:
+        assert len(body) <= 60
+        assert not report._open_tags(body)
+    assert bodies[1].startswith("<b>")
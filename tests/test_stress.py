@@ -0,0 +1,15 @@
+import numpy as np
+
+from stress import stress_grid
+
+
+def test_no_move_and_no_horizon_leaves_value_unchanged():
+    grid = stress_grid(25, 1, 100, 1000, 0.8, 10, 100, 20, 500, price_moves=[0.0], funding_rates=[0],
+                       borrow_shifts=[0], horizon_days=0)
+    assert np.allclose(grid['value_change'], 0)
+
+
+def test_hedged_position_value_is_flat_across_price_moves():
+    grid = stress_grid(25, 1, 100, 1000, 0.8, 10, 100, 20, 500, funding_rates=[0], borrow_shifts=[0],
+                       horizon_days=0)
+    assert np.allclose(grid['value_change'], 0)
@@ -0,0 +1,103 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Header Telegram uses to echo the secret_token passed to setWebhook
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp front end that feeds Telegram webhook updates into an Application.
+
+    Requests are acknowledged as soon as the update is queued; the Application's
+    update processor decides how many run at once.
+    """
+
+    def __init__(self, application, listen, port, path, secret_token):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token
+        self._runner = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request):
+        token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Error decoding webhook update: {str(e)}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.json_response({"running": self.application.running})
+
+
+async def serve_webhook(application, webhook_url, listen, port, path, secret_token,
+                        set_webhook=True, max_connections=40):
+    """Run `application` behind a WebhookServer until SIGINT/SIGTERM.
+
+    Mirrors Application.run_polling's lifecycle, including post_init,
+    post_stop and post_shutdown. Replicas behind a load balancer should all
+    share the same URL and secret; only one needs `set_webhook`.
+    """
+    server = WebhookServer(application, listen, port, path, secret_token)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await server.start()
+        if set_webhook:
+            await application.bot.set_webhook(
+                url=f"{webhook_url.rstrip('/')}{server.path}",
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                max_connections=max_connections,
+            )
+            logger.info(f"Registered webhook {webhook_url.rstrip('/')}{server.path}")
+        await application.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)